@@ -4,18 +4,30 @@
 import os
 import sys
 import argparse
+import asyncio
 import fnmatch
-from collections import defaultdict
 import re
+import operator
+import signal
+import socket
+import json
+import mmap
+import hashlib
+import struct
+import zlib
+from array import array
+from collections import deque, defaultdict, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from math import log
 from random import randint
-from time import sleep
+from time import sleep, monotonic, perf_counter
 
 
 def get_input_type(arg):
     if len(arg) < 2:
         # ts has not been wrapped with brackets to specify type
         return str(arg)
-    if arg[-1:] is "'" and arg[:1] is "'":
+    if arg[-1:] == "'" and arg[:1] == "'":
         v = arg[1:-1]
         # ts has been specified as an int or float type
         return float(v) if re.search('[.]', v) else int(v)
@@ -25,9 +37,71 @@ def get_input_type(arg):
     # raise Exception("Please specify type (number or string) using the ' or \" characters")
 
 
-def get_input() -> list:
-    global timestep, show_info, visual_dbg, ts
+def get_input() -> argparse.Namespace:
     parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command')
+    batch = subparsers.add_parser('batch', help='run a program once for every input set, printing json results')
+    batch.add_argument('-d', '--directory', required=False, type=str, action='store', default=os.curdir,
+                       help='directory containing .tier files for program. default to curdir')
+    batch.add_argument('-f', '--file', required=False, type=str, action='store', default='-',
+                       help='file of input sets, one json object per line, e.g. {"ts": "\'5\'", "stdin": ["\'7\'"]}. '
+                            'default to stdin')
+    batch.add_argument('-j', '--jobs', required=False, type=int, action='store', default=None,
+                       help='number of worker processes. default to the number of cores')
+    batch.add_argument('--max_steps', required=False, type=int, action='store', default=None,
+                       help='step limit for each run')
+    batch.add_argument('--timeout', required=False, type=float, action='store', default=None,
+                       help='time limit for each run, in seconds')
+    batch.add_argument('--detect_cycles', required=False, action='store_true', default=False,
+                       help='stop runs which are stuck in an infinite loop (see --detect_cycles of a single run)')
+    batch.add_argument('--resume', required=False, type=str, action='store', default=None,
+                       help='start every run from a snapshot saved by --checkpoint, rather than from the start of '
+                            'the program. ts of the input sets is ignored')
+    serve = subparsers.add_parser('serve', help='serve a program over tcp, running it for every connection')
+    serve.add_argument('-d', '--directory', required=False, type=str, action='store', default=os.curdir,
+                       help='directory containing .tier files for program. default to curdir')
+    serve.add_argument('--host', required=False, type=str, action='store', default='127.0.0.1',
+                       help='address to listen on. default to 127.0.0.1')
+    serve.add_argument('--port', required=False, type=int, action='store', default=8000,
+                       help='port to listen on. default to 8000')
+    serve.add_argument('--max_steps', required=False, type=int, action='store', default=None,
+                       help='step limit for each connection')
+    serve.add_argument('--timeout', required=False, type=float, action='store', default=None,
+                       help='time limit for each connection, in seconds (not counting time spent waiting for input)')
+    serve.add_argument('--slice', required=False, type=int, action='store', default=ASYNC_SLICE,
+                       help=f'number of steps each connection runs before letting the others go. '
+                            f'default {ASYNC_SLICE}')
+    daemon = subparsers.add_parser('daemon', help='keep programs loaded, running them for requests made on a unix '
+                                                  'socket (see tier_client.py)')
+    daemon.add_argument('--socket', required=False, type=str, action='store', default=DAEMON_SOCKET,
+                        help=f'path of the socket to listen on. default {DAEMON_SOCKET}')
+    daemon.add_argument('-j', '--jobs', required=False, type=int, action='store', default=None,
+                        help='number of worker processes, each keeping its own programs loaded. default to the number '
+                             'of cores')
+    daemon.add_argument('--programs', required=False, type=int, action='store', default=DAEMON_PROGRAMS,
+                        help=f'number of programs each worker keeps loaded. default {DAEMON_PROGRAMS}')
+    daemon.add_argument('--max_steps', required=False, type=int, action='store', default=None,
+                        help='step limit for each request which does not give its own')
+    daemon.add_argument('--timeout', required=False, type=float, action='store', default=None,
+                        help='time limit for each request which does not give its own, in seconds (not counting time '
+                             'spent waiting for input)')
+    daemon.add_argument('--slice', required=False, type=int, action='store', default=ASYNC_SLICE,
+                        help=f'number of steps each run makes before letting the others in its worker go. '
+                             f'default {ASYNC_SLICE}')
+    replay = subparsers.add_parser('replay', help='step forwards and backwards through a run saved by --record')
+    replay.add_argument('-d', '--directory', required=False, type=str, action='store', default=os.curdir,
+                        help='directory containing .tier files for program. default to curdir')
+    replay.add_argument('-f', '--file', required=True, type=str, action='store', help='the recording to view')
+    replay.add_argument('--step', required=False, type=int, action='store', default=0,
+                        help='step to start viewing from. default to the start of the recording')
+    replay.add_argument('--tail', required=False, type=int, action='store', default=None,
+                        help='print the last TAIL steps of the recording, instead of viewing it in the debugger')
+    analyze = subparsers.add_parser('analyze', help='report unreachable tiers and cells, problems which raise when '
+                                                    'reached, and operations folded into constants')
+    analyze.add_argument('-d', '--directory', required=False, type=str, action='store', default=os.curdir,
+                         help='directory containing .tier files for program. default to curdir')
+    analyze.add_argument('--concurrent', required=False, action='store_true', default=False,
+                         help='analyze the program as a concurrent program (see --concurrent)')
     parser.add_argument('-d', '--directory', required=False, type=str, action='store', default=os.curdir,
                         help='directory containing .tier files for program. default to curdir')
     parser.add_argument('-t', '--timestep', required=False, type=float, action='store', default=0,
@@ -38,301 +112,3474 @@ def get_input() -> list:
                         help='visual tool to aid debugging')
     parser.add_argument('-ts', '--set_ts', required=False, type=get_input_type, action='store', default=0,
                         help='set the starting value of ts. enclose in \' characters to input numbers. e.g. \'123\'')
-
-    args = parser.parse_args()
-    ts = args.set_ts
-    visual_dbg = args.visual
-    timestep = args.timestep
-    show_info = args.info
-    usedir = args.directory.replace("\\", "/")
-
-    if usedir[-1:] is not '/':  # formatting
+    parser.add_argument('-s', '--stats', required=False, action='store_true', default=False,
+                        help='print interpreter statistics (e.g. trace cache hits/misses) to stderr on exit')
+    parser.add_argument('--no_trace', required=False, action='store_true', default=False,
+                        help='disable the trace cache and execute one cell at a time')
+    parser.add_argument('--profile', required=False, type=str, action='store', nargs='?', const='profile.json',
+                        default=None, help='profile the program, writing the results as json to the given file '
+                                           '(default profile.json) and a heatmap of every tier to stderr')
+    parser.add_argument('-b', '--breakpoint', required=False, type=str, action='append', default=None,
+                        help='run at full speed until pc reaches a breakpoint, then debug as normal. can be given '
+                             'more than once. x,y or x,y,tier for a cell, @tier for a tier, or a single instruction')
+    parser.add_argument('--no_cache', required=False, action='store_true', default=False,
+                        help=f'do not load the program from (or save it to) the compiled cache, {CACHE_NAME}')
+    parser.add_argument('--input', required=False, type=str, action='store', default=None,
+                        help='file to read input from, one line per } instead of prompting')
+    parser.add_argument('--flush_size', required=False, type=int, action='store', default=FLUSH_SIZE,
+                        help=f'number of characters of output to hold before writing it out. default {FLUSH_SIZE}')
+    parser.add_argument('--max_steps', required=False, type=int, action='store', default=None,
+                        help='stop the program once it has run this many steps')
+    parser.add_argument('--timeout', required=False, type=float, action='store', default=None,
+                        help='stop the program once it has run for this many seconds')
+    parser.add_argument('--detect_cycles', required=False, action='store_true', default=False,
+                        help='stop the program as soon as it is found to be stuck in an infinite loop, naming the '
+                             'cells it loops through. only for programs which never run ` or }')
+    parser.add_argument('--chunked', required=False, type=int, action='store', nargs='?', const=CHUNK_MEMORY,
+                        default=None, help='read the program from its files in chunks as they are used, instead of '
+                                           'decoding it all up front, holding at most CHUNKED megabytes of them at '
+                                           f'once (default {CHUNK_MEMORY}). for programs too large to load in full')
+    parser.add_argument('--memoize', required=False, type=int, action='store', nargs='?', const=MEMO_SIZE,
+                        default=None, help='remember calls into pure tier functions, so that a call with the same '
+                                           'arguments returns straight away. keeps the last MEMOIZE calls (default '
+                                           f'{MEMO_SIZE}). the hit rate is printed with --stats')
+    parser.add_argument('--optimize', required=False, action='store_true', default=False,
+                        help='analyze the program before running it, removing cells which can never be reached')
+    parser.add_argument('--checkpoint', required=False, type=str, action='store', default=None,
+                        help='file to save a snapshot of the run to, every --checkpoint_steps steps and when the run '
+                             'is stopped by --max_steps or --timeout')
+    parser.add_argument('--checkpoint_steps', required=False, type=int, action='store', default=CHECKPOINT_STEPS,
+                        help=f'number of steps between snapshots. default {CHECKPOINT_STEPS}')
+    parser.add_argument('--resume', required=False, type=str, action='store', default=None,
+                        help='carry on the run saved in a snapshot, instead of starting the program afresh. lines of '
+                             'the --input file read before the snapshot was taken are skipped')
+    parser.add_argument('--stop_at_input', required=False, action='store_true', default=False,
+                        help='stop once pc reaches a } (saving a snapshot, if --checkpoint is given). used to save a '
+                             'snapshot which batch --resume can start many runs from')
+    parser.add_argument('--record', required=False, type=str, action='store', default=None,
+                        help='record every step of the run to the given file, to be viewed with replay. the run is '
+                             'made one cell at a time')
+    parser.add_argument('--record_last', required=False, type=int, action='store', default=None,
+                        help='only keep (at least) the last RECORD_LAST steps of the recording, in memory, writing '
+                             'them out when the run ends or fails')
+    parser.add_argument('--concurrent', required=False, action='store_true', default=False,
+                        help='run the program as a concurrent program, where Y forks a new pc, S sends a message to '
+                             'a tier and R receives one')
+    parser.add_argument('--workers', required=False, type=int, action='store', default=None,
+                        help='number of worker processes to hand the pcs of a concurrent program to, when they can '
+                             'run on their own. default to running every pc in this process')
+    parser.add_argument('--deterministic', required=False, action='store_true', default=False,
+                        help='take in what the --workers did in the order their pcs were forked, so that the run '
+                             'always does the same thing')
+    return parser.parse_args()
+
+
+def format_dir(directory) -> str:
+    usedir = directory.replace("\\", "/")
+    if usedir[-1:] != '/':  # formatting
         usedir += '/'
+    return usedir
 
-    files = []
-    entry_point_exists = False
-    print(f'Building program from directory:{usedir}')
-    for f in os.listdir(usedir):
-        if fnmatch.fnmatch(f, '*.tier'):
-            files.append(f'{usedir + f}')
-            if f == '0.tier':
-                entry_point_exists = True
-    if not entry_point_exists:
+
+def find_files(usedir) -> list:
+    # find the .tier files in a program directory
+    names = fnmatch.filter(os.listdir(usedir), '*.tier')
+    if '0.tier' not in names:
         raise Exception('Please add a 0.tier file to this dir as an entry point')
-    return files
+    return [usedir + f for f in names]
+
+
+def tier_name(file) -> str:
+    return file[file.rfind('/') + 1:file.rfind('.')]
+
 
+def split_lines(text) -> list:
+    # split the text of a file into the same lines readlines() would give
+    lines = text.split('\n')
+    return [line + '\n' for line in lines[:-1]] + ([lines[-1]] if lines[-1] else [])
 
-def store_chars(files) -> (defaultdict, list, int, int, dict):
-    global visual_dbg
-    char_dict = defaultdict(lambda: None)
+
+def tier_rows(lines) -> (list, int, int):
+    # the rows of one tier, and the largest row and column indexes it takes up
+    rows = []
+    fmax_width, fmax_height = 0, 0
+    for row_indx, line in enumerate(lines):
+        if row_indx > fmax_height:
+            fmax_height = row_indx
+
+        if line[:1] == ';':
+            # comment lines are treated as entirely whitespace, but still occupy a row
+            rows.append('')
+            continue
+        # ignore endlines. the position of the endline still counts towards the width of the tier
+        text = re.split('[\r\n]', line, 1)[0]
+        last_col = len(text) if len(text) < len(line) else len(text) - 1
+        if last_col > fmax_width:
+            fmax_width = last_col
+        # required to store ' ' chars, as they may be inside directional strings
+        rows.append(text)
+    return rows, fmax_height, fmax_width
+
+
+def store_chars(files, keep_lines=False) -> (dict, list, int, int, dict):
+    rows_dict = {}
     tier_list = []
     fmax_width, fmax_height = 0, 0  # used to wrap pc around edge of file
 
     lines_dict = None
-    if visual_dbg:
+    if keep_lines:
         lines_dict = {}
 
     for file in files:
         with open(file, 'r') as f:
-            fname = file[file.rfind('/') + 1:file.rfind('.')]
+            fname = tier_name(file)
             tier_list.append(fname)
             lines = f.readlines()
-            if visual_dbg:
-                # if curses module present set up all lines
+            if keep_lines:
+                # lines are kept for the visual debugger
                 lines_dict[fname] = lines
-            for row_indx, line in enumerate(lines):
-                if row_indx > fmax_height:
-                    fmax_height = row_indx
-
-                for col_indx, char in enumerate(line):
-                    if col_indx > fmax_width:
-                        fmax_width = col_indx
-                    if char == ';' and col_indx == 0 or char in ('\n', '\r'):
-                        break  # break if comment, ignore endlines
-                    # required to store ' ' chars, as they may be inside directional strings
-                    char_dict[f'{col_indx}-{row_indx}-{fname}'] = char
-
-    return char_dict, tier_list, fmax_height, fmax_width, lines_dict
-
+            rows_dict[fname], height, width = tier_rows(lines)
+            fmax_height, fmax_width = max(fmax_height, height), max(fmax_width, width)
 
-def create_stacks(tier_list) -> (dict, defaultdict):
-    # stack and stack pointer for all tiers
-    sp_dict, stacks = {}, {}
-    # ts = 0   # should not be arrays as tiers can have arbitrary, non-sequential names
-    for t in tier_list:
-        sp_dict[f'{t}'] = 0
-        # ts_dict[f'{t}'] = 0
-        stacks[f'{t}'] = defaultdict(lambda: 0)
+    return rows_dict, tier_list, fmax_height, fmax_width, lines_dict
 
-    return sp_dict, stacks
-
-
-def get_sp_stack() -> (int, defaultdict):
-    global pc, gsp_dict, gstacks_dict
-    return gsp_dict[f"{pc[2]}"], gstacks_dict[f"{pc[2]}"]  # return sp, stack for current tier
-
-
-def get_stack_top(sp, stack) -> int:
-    return 0 if not len(stack) else int(max(int(max(stack.keys())), sp))
-
-
-def view_debug():
-    global mode, pc, ts, char, velocity
-    sp, stack = get_sp_stack()
-    print(f"char={char}\npc={pc}, vel={velocity}\nts={ts}\nmode={mode}\nsp={sp}\nstack={stack}\n---")
-
-
-def change_vel(arg):
-    global velocity
-    velocity = arg
-
-
-def jump():
-    global mode, jump_address, pc, jump_pos
-    if not mode:
-        mode = 3
-        jump_pos = pc[0:2]
-    elif mode is 3:
-        mode = 0
-        str_ver = ''.join(jump_address)  # string version allows to jump to -1.tier
-        pc[0:2] = jump_pos[0:2]
-        pc[2] = int(str_ver)
-        jump_address = []
-
-
-def change_sp(arg):
-    global pc, gsp_dict
-    # increment/decrement stack pointer for tier
-    gsp_dict[f"{pc[2]}"] += arg
-
-
-def push_ts():
-    global ts
-    sp, stack = get_sp_stack()
-    stack_top = get_stack_top(sp, stack)
-    # there are no items in stack. ts may still be non-zero as ts is available to all stacks, sp is 0, item at sp is 0
-    stack[stack_top+1] = ts
-    # reset ts back to 0, replacing the 0 that was just evicted
-    ts = 0
-
-
-def copy_ts():
-    global ts
-    sp, stack = get_sp_stack()
-    ts = stack[sp]
 
+def tier_id(name):
+    # tiers are addressed by the integer following @, so only names which round-trip through int() are reachable
+    try:
+        return int(name) if str(int(name)) == name else name
+    except ValueError:
+        return name
+
+
+def decode_cell(char, options=None) -> tuple:
+    # classify a character once at load time. decoded cell layout: (char, func, arg, ends_jump)
+    # func is None for any character that is a NOP when mode = 0. options are the instructions, parse_options
+    # unless given (concurrent programs add Y, S and R, see concurrent_options)
+    if options is None:
+        options = parse_options
+    ends_jump = char in (' ', '.') or (char in options and char != '-')
+    if char not in options:
+        return char, None, None, ends_jump
+    func, arg = options[char]
+    return char, func, arg, ends_jump
+
+
+def decode_grid(rows, fmax_height, fmax_width, decoded, options=None) -> list:
+    # turn a tier into a dense grid (list of rows) of pre-classified cells, indexed as grid[row][col]
+    # all tiers share the same dimensions, so that pc wraps around every tier at the same edges.
+    # decoded is a dict of the cells already decoded, by char
+    grid = []
+    for row_indx in range(fmax_height + 1):
+        grid_row = [BLANK_CELL] * (fmax_width + 1)
+        if row_indx < len(rows):
+            for col_indx, char in enumerate(rows[row_indx]):
+                cell = decoded.get(char)
+                if cell is None:
+                    cell = decoded[char] = decode_cell(char, options)
+                grid_row[col_indx] = cell
+        grid.append(grid_row)
+    return grid
+
+
+def decode_tiers(rows_dict, tier_list, fmax_height, fmax_width, options=None) -> list:
+    decoded = {}
+    return [decode_grid(rows_dict[fname], fmax_height, fmax_width, decoded, options) for fname in tier_list]
+
+
+EMPTY_SLOT = object()  # marks an index of a TierStack buffer which has not been stored
+
+
+class TierStack:
+    # the stack of a single tier. indices extend from -inf to +inf, with every index holding 0 by default.
+    # reading an index stores it, so the top of the stack is the highest index that has been read or written.
+    # stored indices are kept in one list covering the lowest to the highest stored index, and the top is tracked
+    # as values are stored and popped (rather than searching for it on every push)
+    __slots__ = ('buf', 'base', 'lo', 'hi', 'holes')
+
+    def __init__(self):
+        self.buf = []  # buf[k] holds the value at index base + k
+        self.base = 0
+        self.lo = None  # lowest and highest stored index, None if the stack is empty
+        self.hi = None
+        self.holes = 0  # number of indices between lo and hi which have not been stored
+
+    def __getitem__(self, i):
+        k = i - self.base
+        if 0 <= k < len(self.buf):
+            v = self.buf[k]
+            if v is not EMPTY_SLOT:
+                return v
+        self[i] = 0
+        return 0
+
+    def __setitem__(self, i, v):
+        k = i - self.base
+        buf = self.buf
+        if not 0 <= k < len(buf):
+            k = self.grow(i)
+        if buf[k] is EMPTY_SLOT:
+            # index has not been stored before
+            if self.hi is None:
+                self.lo = self.hi = i
+            elif i > self.hi:
+                self.holes += i - self.hi - 1
+                self.hi = i
+            elif i < self.lo:
+                self.holes += self.lo - i - 1
+                self.lo = i
+            else:
+                self.holes -= 1
+        buf[k] = v
+
+    def grow(self, i) -> int:
+        # extend the buffer to cover index i, returning the position of i in the buffer
+        buf = self.buf
+        if not buf:
+            buf.append(EMPTY_SLOT)
+            self.base = i
+            return 0
+        k = i - self.base
+        if k >= len(buf):
+            buf.extend([EMPTY_SLOT] * (k - len(buf) + 1))
+            return k
+        # grow downwards by at least the current size, so that a stack growing into negative indices is not
+        # moved on every store
+        pad = max(-k, len(buf))
+        buf[0:0] = [EMPTY_SLOT] * pad
+        self.base -= pad
+        return k + pad
+
+    def top(self, sp) -> int:
+        # top of the stack is found as max(sp, highest stored index). 0 if nothing is stored
+        if self.hi is None:
+            return 0
+        return self.hi if self.hi > sp else sp
+
+    def pop(self, i):
+        k = i - self.base
+        buf = self.buf
+        if not 0 <= k < len(buf) or buf[k] is EMPTY_SLOT:
+            raise KeyError(i)
+        v = buf[k]
+        buf[k] = EMPTY_SLOT
+        if self.lo == self.hi:
+            self.__init__()
+        elif i == self.hi:
+            # find the next stored index below, then drop the unused end of the buffer
+            k -= 1
+            while buf[k] is EMPTY_SLOT:
+                k -= 1
+            self.holes -= i - self.base - k - 1
+            self.hi = self.base + k
+            del buf[k + 1:]
+        elif i == self.lo:
+            k += 1
+            while buf[k] is EMPTY_SLOT:
+                k += 1
+            self.holes -= self.base + k - i - 1
+            self.lo = self.base + k
+        else:
+            self.holes += 1
+        return v
+
+    def remove(self, i):
+        # pop the stored index i from below the top, moving every index above it down by one with a single block
+        # move. unstored indices in between become 0, as if each value had been read and moved down in turn
+        k, top_k = i - self.base, self.hi - self.base
+        buf = self.buf
+        v = buf[k]
+        gaps = buf[k + 1:top_k].count(EMPTY_SLOT) if self.holes else 0
+        del buf[k]
+        if gaps:
+            buf[k:top_k] = [0 if x is EMPTY_SLOT else x for x in buf[k:top_k]]
+            self.holes -= gaps
+        self.hi -= 1
+        return v
+
+    def items(self) -> list:
+        base = self.base
+        return [(base + k, v) for k, v in enumerate(self.buf) if v is not EMPTY_SLOT]
+
+    def __len__(self) -> int:
+        return 0 if self.hi is None else self.hi - self.lo + 1 - self.holes
+
+    def __repr__(self) -> str:
+        return '{' + ', '.join(f'{k}: {v!r}' for k, v in self.items()) + '}'
+
+
+class HashedStack(TierStack):
+    # a TierStack which keeps a hash of its stored (index, value) pairs up to date as it changes, so that states of
+    # the stack can be told apart without comparing them cell by cell (see TierVM.run_cycles). the type of each
+    # value is part of the hash, as 1 and 1.0 are printed differently
+    __slots__ = ('hash',)
+
+    def __init__(self, items=()):
+        # items are (index, value) pairs to store, lowest index first (e.g. TierStack.items() of a stack in use)
+        super().__init__()
+        self.hash = 0
+        for i, v in items:
+            self[i] = v
+
+    def __setitem__(self, i, v):
+        k = i - self.base
+        if 0 <= k < len(self.buf) and self.buf[k] is not EMPTY_SLOT:
+            old = self.buf[k]
+            self.hash ^= hash((i, type(old), old))
+        self.hash ^= hash((i, type(v), v))
+        super().__setitem__(i, v)
+
+    def pop(self, i):
+        v = super().pop(i)
+        # popping the last index resets the stack (and its hash)
+        if self.hi is not None:
+            self.hash ^= hash((i, type(v), v))
+        return v
+
+    def remove(self, i):
+        # every index from i up moves, so their part of the hash is worked out again. remove is usually close to the
+        # top of the stack (e.g. : at sp), so this is far fewer cells than the whole stack
+        self.hash ^= self.suffix_hash(i)
+        v = super().remove(i)
+        if self.hi is not None and i <= self.hi:
+            self.hash ^= self.suffix_hash(i)
+        return v
+
+    def suffix_hash(self, i) -> int:
+        # hash of the stored indices from i up to the top of the stack
+        h = 0
+        base, buf = self.base, self.buf
+        for k in range(i - base, self.hi - base + 1):
+            value = buf[k]
+            if value is not EMPTY_SLOT:
+                h ^= hash((base + k, type(value), value))
+        return h
+
+    def state(self) -> list:
+        # everything stored, to check that two states with the same hash really are the same
+        return [(index, type(value), value) for index, value in self.items()]
+
+
+class RecordingStack(TierStack):
+    # a TierStack which logs every change made to it to ops, for Recorder. stores are logged as (index, old value,
+    # new value) and pops as stores of EMPTY_SLOT. remove is logged as (None, index, value removed, indices which
+    # were not stored and became 0), as it moves every index above it
+    __slots__ = ('ops',)
+
+    def __init__(self, items=(), ops=None):
+        super().__init__()
+        if ops is not None:  # the stack is emptied by calling __init__ again, which keeps the same log
+            self.ops = ops
+        for i, v in items:
+            TierStack.__setitem__(self, i, v)
+
+    def __setitem__(self, i, v):
+        k = i - self.base
+        self.ops.append((i, self.buf[k] if 0 <= k < len(self.buf) else EMPTY_SLOT, v))
+        super().__setitem__(i, v)
+
+    def pop(self, i):
+        v = super().pop(i)
+        self.ops.append((i, v, EMPTY_SLOT))
+        return v
+
+    def remove(self, i):
+        base, buf = self.base, self.buf
+        holes = [j for j in range(i + 1, self.hi) if buf[j - base] is EMPTY_SLOT] if self.holes else []
+        v = super().remove(i)
+        self.ops.append((None, i, v, holes))
+        return v
+
+
+def create_stacks(n_tiers) -> (list, list):
+    # stack and stack pointer for all tiers, indexed in the same order as Program.tier_list
+    # ts is not part of this, as it is common to all tiers
+    return [0] * n_tiers, [TierStack() for _ in range(n_tiers)]
+
+
+def concat(a, b) -> str:
+    # + with a string operand joins the printed forms of both operands
+    return f'{a}{b}'
+
+
+# typed dispatch for the arithmetic instructions. operator : {(type of stack[sp], type of stack[sp-1]) : function}
+# numbers go straight to the operator functions. strings can only be concatenated (+) or repeated (*)
+arithmetic_ops = {
+    symbol: {(a, b): func for a in (int, float) for b in (int, float)}
+    for symbol, func in (('+', operator.add), ('-', operator.sub), ('*', operator.mul), ('/', operator.truediv),
+                         ('%', operator.mod), ('&', operator.and_), ('|', operator.or_), ('//', operator.floordiv))
+}
+arithmetic_ops['+'].update({(str, str): operator.add, (str, int): concat, (str, float): concat,
+                            (int, str): concat, (float, str): concat})
+arithmetic_ops['*'].update({(str, int): operator.mul, (int, str): operator.mul})
+NUMERIC = (int, float)
+
+
+def parse_number(text):
+    return int(text) if text.rfind('.') == -1 else float(text)
+
+
+# -----------------------------------------------INPUT/OUTPUT---------------------------------------------------------
+FLUSH_SIZE = 8192  # number of characters of output held before it is written out
+ASYNC_SLICE = 1000  # number of steps an async run makes before handing control back to the event loop
+SERVE_BACKLOG = 1024  # connections waiting to be accepted. a busy event loop only accepts them between slices
+
+
+class OutputBuffer:
+    # output written by {, joined and written to stream in blocks of at least flush_size characters.
+    # with no stream, all of the output is kept (captured) and can be read back with getvalue()
+    __slots__ = ('stream', 'flush_size', 'parts', 'size')
+
+    def __init__(self, stream=None, flush_size=FLUSH_SIZE):
+        self.stream = stream
+        self.flush_size = flush_size if stream is not None else float('inf')
+        self.parts = []
+        self.size = 0
+
+    def write(self, text):
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        # called before input is read, and once the program ends
+        if self.stream is None or not self.parts:
+            return
+        self.stream.write(''.join(self.parts))
+        self.stream.flush()
+        self.parts.clear()
+        self.size = 0
+
+    def getvalue(self) -> str:
+        return ''.join(self.parts) if self.stream is None else ''
+
+    def take(self) -> str:
+        # the output held so far, which is then cleared (used to hand output over in chunks, see TierVM.run_async)
+        text = ''.join(self.parts)
+        self.parts.clear()
+        self.size = 0
+        return text
+
+
+class InputReader:
+    # the lines read by }. source can be a file-like stream, a string holding all of the input, an iterable of
+    # lines, or a function returning the next line. input() is used if source is None. EOFError is raised once the
+    # input runs out. before_read is called before every read (e.g. to flush output ahead of a prompt)
+    __slots__ = ('source', 'stream', 'lines', 'before_read')
+
+    def __init__(self, source=None, before_read=None):
+        self.before_read = before_read
+        self.source, self.stream, self.lines = None, None, None
+        if source is None:
+            self.source = input
+        elif callable(source):
+            self.source = source
+        elif hasattr(source, 'readline'):
+            self.stream = source
+        else:
+            self.lines = iter(source.splitlines() if isinstance(source, str) else source)
+
+    def read(self) -> str:
+        if self.before_read is not None:
+            self.before_read()
+        if self.lines is not None:
+            line = next(self.lines, None)
+        elif self.stream is not None:
+            line = self.stream.readline() or None  # readline() returns '' at the end of a stream
+        else:
+            line = self.source()
+        if line is None:
+            raise EOFError('EOF when reading a line')
+        return line.rstrip('\r\n')
+
+
+class AsyncInputReader:
+    # the lines read by } in an async run. source can be an asyncio.StreamReader (or anything else with a readline
+    # coroutine), an async iterator of lines, a coroutine function returning the next line, or any source taken by
+    # InputReader. read() returns None once the input runs out
+    __slots__ = ('source', 'stream', 'lines', 'reader')
+
+    def __init__(self, source=None):
+        self.source, self.stream, self.lines, self.reader = None, None, None, None
+        if hasattr(source, 'readline') and asyncio.iscoroutinefunction(source.readline):
+            self.stream = source
+        elif hasattr(source, '__anext__'):
+            self.lines = source
+        elif asyncio.iscoroutinefunction(source):
+            self.source = source
+        else:
+            self.reader = InputReader(() if source is None else source)
+
+    async def read(self):
+        if self.stream is not None:
+            line = await self.stream.readline() or None  # readline() returns b'' at the end of a stream
+        elif self.lines is not None:
+            try:
+                line = await self.lines.__anext__()
+            except StopAsyncIteration:
+                line = None
+        elif self.source is not None:
+            line = await self.source()
+        else:
+            try:
+                line = self.reader.read()
+            except EOFError:
+                line = None
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', 'replace')
+        return None if line is None else line.rstrip('\r\n')
+
+
+# ----------------------------------------------COMPILED CACHE--------------------------------------------------------
+# a program is saved to CACHE_NAME in its directory as CACHE_MAGIC, the length of the header, the header (json), then
+# the source of every tier as utf-8. the header holds the size and mtime of every .tier file (so that the cache can be
+# checked without reading them), a hash of their contents, the order of the tiers, the size of the grid, and where
+# the source of each tier is. the cache is memory-mapped, and each tier is only decoded the first time it is used
+CACHE_NAME = '.tierc'
+CACHE_MAGIC = b'TIERC\x01'
+
+
+def file_signature(files) -> dict:
+    # file name : [size, mtime] of every .tier file
+    signature = {}
+    for file in files:
+        stat = os.stat(file)
+        signature[file[file.rfind('/') + 1:]] = [stat.st_size, stat.st_mtime_ns]
+    return signature
 
-def copy_sp():
-    global ts
-    sp, stack = get_sp_stack()
-    stack[sp] = ts
 
+def load_cache(usedir, files):
+    # the header and contents of the cache of a program, or None if there is no cache which matches the files
+    try:
+        with open(usedir + CACHE_NAME, 'rb') as f:
+            source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None  # no cache, or an empty one
+    start = len(CACHE_MAGIC) + 8
+    try:
+        if source[:len(CACHE_MAGIC)] != CACHE_MAGIC:
+            raise ValueError('not a cache')
+        header = json.loads(source[start:start + int.from_bytes(source[start - 8:start], 'little')])
+        if header['files'] != file_signature(files):
+            raise ValueError('out of date')
+    except (ValueError, KeyError):
+        source.close()
+        return None
+    return header, source
+
+
+def source_hash(blobs) -> str:
+    # hash of the source of every tier (utf-8, in the order of tier_list), as held by the cache
+    return hashlib.sha256(b'\0'.join(blobs)).hexdigest()
+
+
+def build_cache(usedir, files):
+    # read the .tier files of a program and save them as a cache. returns the same as load_cache. the program is
+    # still returned if the cache cannot be saved (e.g. the directory is read only)
+    signature = file_signature(files)
+    tier_list, blobs = [], []
+    fmax_height, fmax_width = 0, 0
+    for file in files:
+        with open(file, 'r') as f:
+            text = f.read()
+        _, height, width = tier_rows(split_lines(text))
+        fmax_height, fmax_width = max(fmax_height, height), max(fmax_width, width)
+        tier_list.append(tier_name(file))
+        blobs.append(text.encode('utf-8'))
+    offsets, position = [], 0
+    for blob in blobs:
+        offsets.append([position, position + len(blob)])
+        position += len(blob)
+    header = {'files': signature, 'hash': source_hash(blobs), 'tier_list': tier_list,
+              'tier_ids': [tier_id(fname) for fname in tier_list], 'max_height': fmax_height,
+              'max_width': fmax_width, 'offsets': offsets}
+    header_bytes = json.dumps(header).encode('utf-8')
+    source = b''.join([CACHE_MAGIC, len(header_bytes).to_bytes(8, 'little'), header_bytes] + blobs)
+    temp = f'{usedir}{CACHE_NAME}.{os.getpid()}'
+    try:
+        with open(temp, 'wb') as f:
+            f.write(source)
+        os.replace(temp, usedir + CACHE_NAME)
+    except OSError:
+        if os.path.exists(temp):
+            os.remove(temp)
+    return header, source
+
+
+class TierGrids(dict):
+    # decoded grids by tier position, decoded from the source held in a cache the first time each one is used
+    __slots__ = ('source', 'offsets', 'max_height', 'max_width', 'decoded', 'options')
+
+    def __init__(self, source, offsets, max_height, max_width, options=None):
+        super().__init__()
+        self.source = source
+        self.offsets = offsets  # [start, end] of the source of each tier
+        self.max_height, self.max_width = max_height, max_width
+        self.decoded = {}
+        self.options = options
+
+    def __missing__(self, t):
+        start, end = self.offsets[t]
+        rows, _, _ = tier_rows(split_lines(self.source[start:end].decode('utf-8')))
+        grid = self[t] = decode_grid(rows, self.max_height, self.max_width, self.decoded, self.options)
+        return grid
+
+    def __reduce__(self):
+        # pickled (e.g. for batch workers) as a plain dict of every grid, as the source may be memory-mapped
+        return dict, ({t: self[t] for t in range(len(self.offsets))},)
+
+
+# -----------------------------------------------CHUNKED GRIDS--------------------------------------------------------
+# a program too large to decode in full (e.g. generated by a compiler) can be held as chunks of CHUNK_ROWS by
+# CHUNK_COLS cells instead of dense grids. the .tier files are memory-mapped and indexed once (where each row starts
+# and how many characters it holds), and a chunk is only read from them the first time one of its cells is used, as
+# a string of one character per cell ('\0' for blank space), which takes one byte per cell for ascii source. chunks
+# past the end of every row in them are never stored, and once the chunks held take up more than the memory given,
+# the least recently used are dropped, to be read again if they are used again. grid[y][x] gives the same decoded
+# cells as a dense grid, so everything which reads a grid works the same on either
+CHUNK_ROWS, CHUNK_COLS = 64, 64
+CHUNK_MEMORY = 256  # megabytes of chunks held at once, unless given
+NEWLINE = re.compile(rb'\r\n|\r|\n')  # the line endings open() translates
+BLANK_CHUNK = '\0' * (CHUNK_ROWS * CHUNK_COLS)
+
+
+class CellTable(dict):
+    # char : decoded cell, decoded the first time each char is used. '\0' is blank space
+    __slots__ = ('options',)
+
+    def __init__(self, options=None):
+        super().__init__({'\0': BLANK_CELL})
+        self.options = options
+
+    def __missing__(self, char):
+        cell = self[char] = decode_cell(char, self.options)
+        return cell
+
+
+def map_file(path):
+    # the contents of a file, memory-mapped unless it is empty (which mmap refuses)
+    with open(path, 'rb') as f:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return b''
+
+
+def index_rows(source) -> (array, array, set, int):
+    # the byte offset each row of a tier starts at, the number of characters in it (0 for a comment), the rows which
+    # are not ascii, and the largest column index it takes up (the same as tier_rows)
+    starts, widths, wide = array('q'), array('q'), set()
+    fmax_width, start, ends = 0, 0, True
+    for match in NEWLINE.finditer(source):
+        starts.append(start)
+        widths.append(match.start() - start)
+        start = match.end()
+    if start < len(source):
+        starts.append(start)  # a last row with no line ending, whose final character is not counted in the width
+        widths.append(len(source) - start)
+        ends = False
+    if not all(source[i:i + 2 ** 20].isascii() for i in range(0, len(source), 2 ** 20)):
+        for y in range(len(starts)):
+            text = source[starts[y]:starts[y] + widths[y]]
+            if not text.isascii():
+                wide.add(y)
+                widths[y] = len(text.decode('utf-8'))
+    for y in range(len(starts)):
+        if source[starts[y]:starts[y] + 1] == b';':
+            widths[y] = 0  # comment lines are treated as entirely whitespace, but still occupy a row
+        elif widths[y]:
+            fmax_width = max(fmax_width, widths[y] - (0 if ends or y < len(starts) - 1 else 1))
+    return starts, widths, wide, fmax_width
+
+
+class ChunkStore:
+    # the chunks of every tier of a program (see CHUNKED GRIDS), read from its .tier files. grids is the ChunkedGrid
+    # of each tier, in the order of files. chunks which have been written to (see Analysis.optimize) are kept apart
+    # from the rest, and never dropped
+    __slots__ = ('paths', 'sources', 'starts', 'widths', 'wide', 'band_widths', 'n_bands', 'n_cols', 'max_height',
+                 'max_width', 'cells', 'grids', 'chunks', 'edited', 'memory', 'size', 'peak', 'loads', 'evictions')
+
+    def __init__(self, files, memory=CHUNK_MEMORY * 2 ** 20, options=None):
+        self.paths = list(files)
+        self.sources = [map_file(path) for path in self.paths]
+        self.starts, self.widths, self.wide = [], [], []
+        self.max_height, self.max_width = 0, 0
+        for source in self.sources:
+            starts, widths, wide, width = index_rows(source)
+            self.starts.append(starts)
+            self.widths.append(widths)
+            self.wide.append(wide)
+            self.max_height, self.max_width = max(self.max_height, len(starts) - 1), max(self.max_width, width)
+        self.n_bands = self.max_height // CHUNK_ROWS + 1
+        self.n_cols = self.max_width // CHUNK_COLS + 1
+        # widest row in each band of CHUNK_ROWS rows, so that chunks with nothing in them are known without reading
+        self.band_widths = [array('q', [max(widths[y:y + CHUNK_ROWS], default=0)
+                                        for y in range(0, self.n_bands * CHUNK_ROWS, CHUNK_ROWS)])
+                            for widths in self.widths]
+        self.cells = CellTable(options)
+        self.grids = [ChunkedGrid(self, t) for t in range(len(self.paths))]
+        self.chunks = OrderedDict()  # (t * n_bands + band) * n_cols + column of chunks : chunk, least recently used
+        self.edited = {}  # the same, for chunks which have been written to
+        self.memory = memory
+        self.size, self.peak, self.loads, self.evictions = 0, 0, 0, 0
+
+    def chunk(self, key) -> str:
+        # a chunk, by key (see chunks)
+        chunk = self.chunks.get(key)
+        if chunk is not None:
+            self.chunks.move_to_end(key)
+            return chunk
+        chunk = self.edited.get(key)
+        if chunk is not None:
+            return chunk
+        t, band = divmod(key // self.n_cols, self.n_bands)
+        x0 = key % self.n_cols * CHUNK_COLS
+        if self.band_widths[t][band] <= x0:
+            return BLANK_CHUNK
+        source, starts, widths, wide = self.sources[t], self.starts[t], self.widths[t], self.wide[t]
+        parts = []  # the row of the chunk in each row of the band
+        for y in range(band * CHUNK_ROWS, min(band * CHUNK_ROWS + CHUNK_ROWS, len(starts))):
+            x1 = min(widths[y], x0 + CHUNK_COLS)
+            if x1 <= x0:
+                text = ''
+            elif y in wide:
+                text = self.line(t, y)[x0:x1]
+            else:
+                text = source[starts[y] + x0:starts[y] + x1].decode('ascii')
+            parts.append(text.ljust(CHUNK_COLS, '\0'))
+        chunk = ''.join(parts).ljust(CHUNK_ROWS * CHUNK_COLS, '\0')
+        self.chunks[key] = chunk
+        self.loads += 1
+        self.size += sys.getsizeof(chunk)
+        while self.size > self.memory and len(self.chunks) > 1:
+            self.size -= sys.getsizeof(self.chunks.popitem(last=False)[1])
+            self.evictions += 1
+        self.peak = max(self.peak, self.size)
+        return chunk
 
-def end_prog():
-    global prog_over
-    prog_over = True
+    def write(self, key, i, char):
+        # change the character at index i of a chunk, which is then kept for as long as the program is
+        chunk = self.chunk(key)
+        if self.chunks.pop(key, None) is not None:
+            self.size -= sys.getsizeof(chunk)
+        self.edited[key] = chunk[:i] + char + chunk[i + 1:]
+
+    def line(self, t, y) -> str:
+        # the source of a row, as read by readlines()
+        starts, source = self.starts[t], self.sources[t]
+        end = starts[y + 1] if y + 1 < len(starts) else len(source)
+        return source[starts[y]:end].decode('utf-8').rstrip('\r\n') + '\n'
+
+    def report(self) -> str:
+        return (f'chunks: {self.loads} read, {self.evictions} dropped, {len(self.chunks)} held '
+                f'({self.size / 2 ** 20:.1f}MB, at most {self.peak / 2 ** 20:.1f}MB), {len(self.edited)} written to')
 
+    def __getstate__(self) -> dict:
+        # pickled (e.g. for batch workers) without the files, which are mapped again, or the chunks read so far
+        return {name: getattr(self, name) for name in self.__slots__
+                if name not in ('sources', 'chunks', 'size', 'peak', 'loads', 'evictions')}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self.sources = [map_file(path) for path in self.paths]
+        self.chunks = OrderedDict()
+        self.size, self.peak, self.loads, self.evictions = 0, 0, 0, 0
 
-def print_sp():
-    # get coords from pc, sp from dict, print stack at sp
-    sp, stack = get_sp_stack()
-    print(str(stack[sp]).replace('\\n', '\n'), end='')
 
+class ChunkedGrid:
+    # the grid of one tier of a ChunkStore, indexed as grid[row][col] in the same way as a dense grid
+    __slots__ = ('store', 't')
+
+    def __init__(self, store, t):
+        self.store, self.t = store, t
+
+    def __getitem__(self, y):
+        return ChunkedRow(self.store, self.t, y)
+
+    def __len__(self) -> int:
+        return self.store.max_height + 1
+
+    def __iter__(self):
+        return (ChunkedRow(self.store, self.t, y) for y in range(self.store.max_height + 1))
+
+
+class ChunkedRow:
+    # one row of a ChunkedGrid. made each time a row is indexed, so only holds where the row is in its chunks
+    __slots__ = ('store', 'base', 'offset')
+
+    def __init__(self, store, t, y):
+        self.store = store
+        self.base = (t * store.n_bands + y // CHUNK_ROWS) * store.n_cols  # key of the chunk holding column 0
+        self.offset = y % CHUNK_ROWS * CHUNK_COLS  # index of column 0 in each chunk
+
+    def __getitem__(self, x):
+        store = self.store
+        return store.cells[store.chunk(self.base + x // CHUNK_COLS)[self.offset + x % CHUNK_COLS]]
+
+    def __setitem__(self, x, cell):
+        self.store.write(self.base + x // CHUNK_COLS, self.offset + x % CHUNK_COLS, cell[0] or '\0')
+
+    def __len__(self) -> int:
+        return self.store.max_width + 1
+
+    def __iter__(self):
+        store, offset = self.store, self.offset
+        cells, left = store.cells, store.max_width + 1
+        for key in range(self.base, self.base + store.n_cols):
+            for char in store.chunk(key)[offset:offset + min(left, CHUNK_COLS)]:
+                yield cells[char]
+            left -= CHUNK_COLS
+
+
+class SourceLines:
+    # the lines of a tier of a ChunkStore, read as they are used (for the visual debugger and profiler)
+    __slots__ = ('store', 't')
+
+    def __init__(self, store, t):
+        self.store, self.t = store, t
+
+    def __len__(self) -> int:
+        return len(self.store.starts[self.t])
+
+    def __getitem__(self, y) -> str:
+        return self.store.line(self.t, y)
+
+    def __iter__(self):
+        return (self.store.line(self.t, y) for y in range(len(self)))
+
+
+# -------------------------------------------------SNAPSHOTS----------------------------------------------------------
+# the state of a run (see TierVM.snapshot) is saved as SNAPSHOT_MAGIC followed by the state as zlib compressed json.
+# tier values are only ever ints, floats and strings, which json keeps apart (1 and 1.0), so None marks an index of a
+# stack which has not been stored
+SNAPSHOT_MAGIC = b'TIERS\x01'
+CHECKPOINT_STEPS = 10 ** 7  # number of steps between the snapshots saved by a run with a checkpoint file
+
+
+def save_snapshot(snapshot, path):
+    # written to a temporary file first, so that a run killed while saving leaves the last snapshot as it was
+    data = SNAPSHOT_MAGIC + zlib.compress(json.dumps(snapshot, separators=(',', ':')).encode('utf-8'))
+    temp = f'{path}.{os.getpid()}'
+    with open(temp, 'wb') as f:
+        f.write(data)
+    os.replace(temp, path)
+
+
+def load_snapshot(path) -> dict:
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+        raise Exception(f'{path} is not a snapshot of a tier program')
+    return json.loads(zlib.decompress(data[len(SNAPSHOT_MAGIC):]))
+
+
+class LimitExceeded(Exception):
+    # raised when a run goes over its step limit or time limit. kind is 'step_limit' or 'timeout'
+    def __init__(self, kind, message):
+        super().__init__(message)
+        self.kind = kind
+
+
+class Program:
+    # a tier program, read from its directory and decoded once. any number of TierVMs can run the same Program
+    __slots__ = ('directory', 'tier_list', 'tier_ids', 'tier_index', 'grids', 'max_width', 'max_height', 'lines',
+                 'literals', 'skips', 'traces', 'input_stops', 'deterministic', 'hash', 'concurrent', 'chunks')
+
+    def __init__(self, directory, keep_lines=False, use_cache=True, concurrent=False, chunk_memory=None):
+        # keep_lines keeps the source lines of every tier for the visual debugger. unless keep_lines is set or
+        # use_cache is False, the program is loaded from (or saved to) a compiled cache in its directory, and
+        # each tier is only decoded the first time pc enters it. concurrent programs can run Y, S and R (see
+        # CONCURRENCY), which are otherwise NOPs. with chunk_memory (in bytes), every tier is instead read in
+        # chunks from its file as it is used, holding at most that much of them at once (see CHUNKED GRIDS)
+        self.directory = format_dir(directory)
+        self.concurrent = concurrent
+        options = concurrent_options if concurrent else None
+        files = find_files(self.directory)
+        self.chunks = None  # the ChunkStore the grids are read from, if any
+        if chunk_memory is not None:
+            self.chunks = ChunkStore(files, chunk_memory, options)
+            self.tier_list = [tier_name(file) for file in files]
+            self.tier_ids = [tier_id(fname) for fname in self.tier_list]
+            self.max_height, self.max_width = self.chunks.max_height, self.chunks.max_width
+            self.grids = self.chunks.grids
+            self.lines = [SourceLines(self.chunks, t) for t in range(len(files))] if keep_lines else None
+            self.hash = None
+        elif keep_lines or not use_cache:
+            rows_dict, self.tier_list, self.max_height, self.max_width, lines_dict = store_chars(files, keep_lines)
+            self.grids = decode_tiers(rows_dict, self.tier_list, self.max_height, self.max_width, options)
+            self.lines = [lines_dict[fname] for fname in self.tier_list] if keep_lines else None
+            self.tier_ids = [tier_id(fname) for fname in self.tier_list]
+            self.hash = None  # worked out the first time it is needed, see source_hash
+        else:
+            header, source = load_cache(self.directory, files) or build_cache(self.directory, files)
+            self.tier_list, self.tier_ids = header['tier_list'], header['tier_ids']
+            self.max_height, self.max_width = header['max_height'], header['max_width']
+            base = len(source) - header['offsets'][-1][1]  # the source of the tiers is at the end of the cache
+            self.grids = TierGrids(source, [(base + start, base + end) for start, end in header['offsets']],
+                                   self.max_height, self.max_width, options)
+            self.lines = None
+            self.hash = header['hash']
+        # tiers are referred to by their position in tier_list while running. tier_index maps the number used
+        # to jump to a tier (e.g. 1 for @1) to that position
+        self.tier_index = {tid: t for t, tid in enumerate(self.tier_ids)}
+        self.literals = {}  # (x, y, t, dx, dy) of a ' " or @ : the literal read from there (see find_literal)
+        self.skips = {}  # (x, y, t, dx, dy) of a cell which does nothing : the next live cell (see find_live_cell)
+        self.traces = {}  # compiled traces, shared by every TierVM running this program
+        self.input_stops = None  # Breakpoints at every }, for the traces of async runs (see TierVM.run_async)
+        self.deterministic = None  # whether pc can never reach a ` or }, worked out the first time it is needed
+
+    def source_hash(self) -> str:
+        # hash of the source of every tier, the same as held by the compiled cache. snapshots are checked against it,
+        # so that a run is never resumed with a different program
+        if self.hash is None:
+            blobs = []
+            for fname in self.tier_list:
+                with open(f'{self.directory}{fname}.tier', 'r') as f:
+                    blobs.append(f.read().encode('utf-8'))
+            self.hash = source_hash(blobs)
+        return self.hash
+
+    def __getstate__(self) -> dict:
+        # compiled traces are python functions, so each process compiles its own instead of pickling them
+        return {name: getattr(self, name) for name in self.__slots__ if name not in ('traces', 'input_stops')}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self.traces = {}
+        self.input_stops = None
+
+
+class TierVM:
+    # the state of one run of a Program. pc is held as x, y and t (the position of the tier in Program.tier_list),
+    # velocity as dx, dy. sp and stack are those of the current tier, and are swapped out when pc changes tier
+    __slots__ = ('program', 'grid', 'x', 'y', 't', 'dx', 'dy', 'mode', 'ts', 'sp', 'stack', 'sps', 'stacks',
+                 'literal', 'jump_pos', 'prog_over', 'read', 'write', 'output', 'debug_hook', 'trace_hits',
+                 'trace_misses', 'steps', 'max_steps', 'deadline', 'breakpoints', 'free_run', 'lines_read',
+                 'channels', 'forked', 'workers', 'in_order', 'memo')
+
+    def __init__(self, program):
+        self.program = program
+        self.debug_hook = None  # called with the vm before pc is advanced, on every step. forces per-cell stepping
+        self.breakpoints = None  # if set, the run is free (no debug_hook) until one of the Breakpoints is hit
+        self.workers = None  # number of worker processes a concurrent run can hand pcs to (see run_concurrent)
+        self.in_order = False  # whether a concurrent run takes the results of workers in the order they were forked
+        self.memo = None  # CallCache remembering calls into pure functions, if set (see run_memoized)
+        self.output = OutputBuffer()
+        self.read = input
+        self.write = self.output.write
+        self.reset()
+
+    def reset(self, ts=0):
+        # put the vm back into its starting state, without re-reading or re-decoding the program
+        program = self.program
+        self.sps, self.stacks = create_stacks(len(program.tier_list))
+        self.t = program.tier_index[0]  # 0.tier is the entry point
+        self.grid = program.grids[self.t]
+        self.sp, self.stack = 0, self.stacks[self.t]
+        self.x, self.y = 0, 0  # top left corner, tier 0
+        self.dx, self.dy = 1, 0  # eastwards
+        self.mode = 0  # 0 = simple traversal, 1 = reading numbers, 2 = reading strings, 3 = jumping
+        self.ts = ts  # temp storage, common to all stacks. holds the most recent stack operation result
+        self.literal = []  # characters of the number, string or jump address being read
+        self.jump_pos = (0, 0)
+        self.prog_over = False
+        self.trace_hits, self.trace_misses = 0, 0
+        self.steps = 0  # number of cells executed
+        self.lines_read = 0  # number of lines of input read by }
+        self.max_steps = float('inf')
+        self.deadline = None  # monotonic() time at which the run times out
+        self.free_run = bool(self.breakpoints)  # start by running to the first breakpoint, if there are any
+        self.channels = {}  # tier position : deque of the messages sent to it by S, oldest first
+        self.forked = []  # Pointers forked by Y, waiting to be picked up by run_concurrent
+
+    @property
+    def tier(self):
+        # the number of the current tier, as used to jump to it
+        return self.program.tier_ids[self.t]
+
+    def run(self, stdin=None, ts=0, out=None, use_traces=True, max_steps=None, timeout=None, profiler=None,
+            flush_size=FLUSH_SIZE, detect_cycles=False, checkpoint=None, checkpoint_steps=CHECKPOINT_STEPS,
+            stop_at_input=False, recorder=None):
+        # run the program from the start and return its output. input for } is read from stdin, which can be a
+        # stream, a string, an iterable of lines, or a function returning the next line (see InputReader).
+        # input() is used if stdin is None. if out is given, output is written to out in blocks of flush_size
+        # characters as the program runs, instead of being returned. output is also flushed before every read and
+        # when the run ends. the output of a run which raised can be read from vm.output.getvalue() if out is None.
+        # LimitExceeded is raised if the run takes more than max_steps steps, or more than timeout seconds.
+        # with detect_cycles, it is also raised as soon as the program is found to be stuck in an infinite loop (see
+        # run_cycles). this is ignored for programs which can run ` or }, as they can always do something new.
+        # if a Profiler (or a Recorder) is given, the run is made one cell at a time and recorded by it.
+        # if checkpoint is given (a file name), a snapshot of the run is saved to it every checkpoint_steps steps, and
+        # when the run is stopped by max_steps or timeout, so that it can be carried on later (see resume). with
+        # stop_at_input, the run stops without raising once pc reaches a } (e.g. to snapshot it before any input)
+        self.reset(ts)
+        return self.run_on(stdin, out, use_traces, max_steps, timeout, profiler, flush_size, detect_cycles,
+                           checkpoint, checkpoint_steps, stop_at_input, recorder)
+
+    def resume(self, snapshot, stdin=None, out=None, use_traces=True, max_steps=None, timeout=None, profiler=None,
+               flush_size=FLUSH_SIZE, detect_cycles=False, checkpoint=None, checkpoint_steps=CHECKPOINT_STEPS,
+               stop_at_input=False, recorder=None):
+        # carry on a run from a snapshot (see snapshot and load_snapshot), taking the same arguments as run. stdin is
+        # the input left to read. steps are counted from the start of the program, so max_steps is the same as for
+        # an uninterrupted run. output held in the snapshot is output again first, so that a captured run returns
+        # the same output as if it had never stopped. the same snapshot can be resumed any number of times
+        self.restore(snapshot)
+        return self.run_on(stdin, out, use_traces, max_steps, timeout, profiler, flush_size, detect_cycles,
+                           checkpoint, checkpoint_steps, stop_at_input, recorder, snapshot['output'])
+
+    def run_on(self, stdin, out, use_traces, max_steps, timeout, profiler, flush_size, detect_cycles, checkpoint,
+               checkpoint_steps, stop_at_input, recorder, prefix=''):
+        # run the program on from the current state of the vm (see run)
+        if self.program.concurrent and (profiler or recorder or self.breakpoints or detect_cycles or checkpoint or
+                                        stop_at_input or self.memo):
+            raise Exception('profiling, recording, breakpoints, cycle detection, memoization and snapshots can not be '
+                            'used with a concurrent program')
+        if detect_cycles and self.program.deterministic is None:
+            self.program.deterministic = Analysis(self.program).deterministic
+        if max_steps is not None:
+            self.max_steps = max_steps
+        if timeout is not None:
+            self.deadline = monotonic() + timeout
+        output = self.output = OutputBuffer(out, flush_size)
+        self.write = output.write
+        if prefix:
+            output.write(prefix)
+        reader = InputReader(stdin, before_read=output.flush if out is not None else None)
+
+        def read() -> str:
+            line = reader.read()
+            self.lines_read += 1
+            return line
+        self.read = read
+
+        limit = self.max_steps
+        try:
+            while True:
+                if checkpoint is not None:
+                    # stop at the next multiple of checkpoint_steps, save a snapshot, then carry on from there
+                    self.max_steps = min(limit, (self.steps // checkpoint_steps + 1) * checkpoint_steps)
+                try:
+                    self.run_loop(use_traces, profiler, detect_cycles, stop_at_input, recorder)
+                    break
+                except LimitExceeded as e:
+                    at_checkpoint = e.kind == 'step_limit' and self.max_steps < limit
+                    self.max_steps = limit
+                    if checkpoint is not None and e.kind != 'cycle':
+                        output.flush()
+                        save_snapshot(self.snapshot(), checkpoint)
+                    if not at_checkpoint:
+                        raise
+        finally:
+            self.max_steps = limit
+            output.flush()
+        return output.getvalue() if out is None else None
+
+    def run_loop(self, use_traces, profiler, detect_cycles, stop_at_input, recorder):
+        # run until the program ends, with the main loop for the options given
+        try:
+            if self.program.concurrent:
+                self.run_concurrent(use_traces)
+            elif profiler is not None:
+                self.run_profiled(profiler)
+            elif recorder is not None:
+                self.run_recorded(recorder)
+            elif self.breakpoints is not None:
+                self.run_breakpoints()
+            elif stop_at_input:
+                self.run_slice(float('inf'), False, use_traces)
+            elif detect_cycles and self.program.deterministic and self.debug_hook is None:
+                self.run_cycles(use_traces)
+            elif self.memo is not None and use_traces and self.debug_hook is None:
+                self.run_memoized(self.memo)
+            elif use_traces and self.debug_hook is None:
+                self.run_traced()
+            else:
+                while not self.prog_over:
+                    self.step()
+                    if self.deadline is not None:
+                        self.check_time()
+        except BaseException:
+            trace_failed(self, sys.exc_info()[2])
+            raise
+
+    def snapshot(self) -> dict:
+        # the whole state of the run, as a dict which can be saved as json (see save_snapshot). tiers are named by
+        # their number rather than their position in tier_list, and the stack of each tier is held as the index of
+        # its lowest stored value followed by every value up to the top. output captured so far (out=None) is kept
+        tier_ids = self.program.tier_ids
+        self.sps[self.t] = self.sp
+        stacks = []
+        for t, stack in enumerate(self.stacks):
+            if stack.hi is None:
+                if self.sps[t]:
+                    stacks.append([tier_ids[t], self.sps[t], 0, []])
+                continue
+            values = stack.buf[stack.lo - stack.base:stack.hi - stack.base + 1]
+            stacks.append([tier_ids[t], self.sps[t], stack.lo, [None if v is EMPTY_SLOT else v for v in values]])
+        return {'program': self.program.source_hash(), 'tier': tier_ids[self.t], 'pc': [self.x, self.y],
+                'velocity': [self.dx, self.dy], 'mode': self.mode, 'literal': ''.join(self.literal),
+                'jump_pos': list(self.jump_pos), 'ts': self.ts, 'stacks': stacks, 'prog_over': self.prog_over,
+                'steps': self.steps, 'lines_read': self.lines_read, 'output': self.output.getvalue()}
+
+    def restore(self, snapshot):
+        # put the vm into the state held by a snapshot of a run of the same program
+        program = self.program
+        if snapshot['program'] != program.source_hash():
+            raise Exception('the snapshot was taken from a different program (or the program has changed since)')
+        self.reset()
+        for tid, sp, lo, values in snapshot['stacks']:
+            t = program.tier_index[tid]
+            self.sps[t] = sp
+            stack = self.stacks[t]
+            for i, v in enumerate(values, lo):
+                if v is not None:
+                    stack[i] = v
+        self.t = program.tier_index[snapshot['tier']]
+        self.grid = program.grids[self.t]
+        self.sp, self.stack = self.sps[self.t], self.stacks[self.t]
+        self.x, self.y = snapshot['pc']
+        self.dx, self.dy = snapshot['velocity']
+        self.mode = snapshot['mode']
+        self.literal = list(snapshot['literal'])
+        self.jump_pos = tuple(snapshot['jump_pos'])
+        self.ts = snapshot['ts']
+        self.prog_over = snapshot['prog_over']
+        self.steps = snapshot['steps']
+        self.lines_read = snapshot['lines_read']
+
+    async def run_async(self, stdin=None, ts=0, use_traces=True, max_steps=None, timeout=None,
+                        slice_steps=ASYNC_SLICE):
+        # run the program from the start as an async generator, yielding its output in chunks. input for } is
+        # awaited from stdin (see AsyncInputReader), and control is handed back to the event loop after every
+        # slice_steps steps, so that any number of runs can share one event loop. output is yielded before input is
+        # awaited, and when the run ends. the output of a run which raised, which had not yet been yielded, can be
+        # read from vm.output.getvalue(). max_steps and timeout are the same as for run(), other than time spent
+        # waiting for input not counting towards the timeout. debug_hook is not called
+        self.reset(ts)
+        if max_steps is not None:
+            self.max_steps = max_steps
+        if timeout is not None:
+            self.deadline = monotonic() + timeout
+        output = self.output = OutputBuffer()
+        self.write = output.write
+        reader = AsyncInputReader(stdin)
+        lines = deque()  # input which has arrived, waiting to be read by }. None once the input has run out
+
+        def read() -> str:
+            line = lines.popleft()
+            if line is None:
+                raise EOFError('EOF when reading a line')
+            self.lines_read += 1
+            return line
+        self.read = read
+
+        while not self.prog_over:
+            try:
+                needs_input = self.run_slice(slice_steps, bool(lines), use_traces)
+            except BaseException:
+                trace_failed(self, sys.exc_info()[2])
+                raise
+            if output.size:
+                yield output.take()
+            if needs_input:
+                waited = monotonic()
+                lines.append(await reader.read())
+                if self.deadline is not None:
+                    self.deadline += monotonic() - waited  # time spent waiting for input is not counted
+            else:
+                await asyncio.sleep(0)  # let other runs go
+        if output.size:
+            yield output.take()
+
+    def run_slice(self, n_steps, has_input, use_traces=True) -> bool:
+        # run until the program ends, at least n_steps steps have been run, or pc reaches a } when has_input is
+        # False. returns True if the run stopped to wait for input. traces end before any }, so that input is only
+        # ever read by a trace (or step) which starts at the }
+        program = self.program
+        if program.input_stops is None:
+            program.input_stops = Breakpoints(program, '}')
+        input_stops = program.input_stops
+        traces = input_stops.traces
+        end = self.steps + n_steps
+        while not self.prog_over and self.steps < end:
+            if not self.mode and self.grid[self.y][self.x][0] == '}':
+                if not has_input:
+                    return True
+                has_input = False  # } reads the line, which is the only one asked for
+            key = (self.x, self.y, self.t, self.dx, self.dy)
+            entry = None if self.mode or not use_traces else traces.get(key)
+            if entry is None and not self.mode and use_traces:
+                entry = traces[key] = compile_trace(program, *key, stops=input_stops.stops(self.t))
+            if entry is None or self.steps + entry[1] > self.max_steps:
+                self.step_free()
+            else:
+                trace, n_steps = entry
+                trace(self)
+                self.steps += n_steps
+            if self.deadline is not None:
+                self.check_time()
+        return False
+
+    def check_time(self):
+        if monotonic() > self.deadline:
+            raise LimitExceeded('timeout', f'time limit reached after {self.steps} steps')
+
+    def run_traced(self):
+        # main loop using the trace cache, keyed on the entry state (pc, velocity) of each trace
+        program = self.program
+        traces = program.traces
+        hits, misses = 0, 0
+        timed = self.deadline is not None
+        countdown = 1024  # number of traces to run before the time limit is checked again
+        try:
+            while not self.prog_over:
+                if self.mode:
+                    # finish a literal which a trace stopped in the middle of
+                    self.step()
+                    continue
+                key = (self.x, self.y, self.t, self.dx, self.dy)
+                entry = traces.get(key)
+                if entry is None:
+                    entry = traces[key] = compile_trace(program, *key)
+                    misses += 1
+                else:
+                    hits += 1
+                trace, n_steps = entry
+                if self.steps + n_steps > self.max_steps:
+                    # close to the step limit, so go one cell at a time. step() raises once the limit is reached
+                    self.step()
+                    continue
+                trace(self)
+                self.steps += n_steps
+                if timed:
+                    countdown -= 1
+                    if not countdown:
+                        countdown = 1024
+                        self.check_time()
+        finally:
+            self.trace_hits += hits
+            self.trace_misses += misses
+
+    def run_memoized(self, memo):
+        # main loop using the trace cache, with calls into pure functions remembered by memo (see CallCache). the
+        # same as run_traced, other than pc changing tier being looked out for after every trace
+        program = self.program
+        traces = program.traces
+        hits, misses = 0, 0
+        timed = self.deadline is not None
+        countdown = 1024
+        call = None  # the call being recorded, if any
+        try:
+            while not self.prog_over:
+                t = self.t
+                if self.mode:
+                    self.step()
+                    if self.t != t:
+                        call = memo.entered(self, t, call)
+                    continue
+                key = (self.x, self.y, t, self.dx, self.dy)
+                entry = traces.get(key)
+                if entry is None:
+                    entry = traces[key] = compile_trace(program, *key)
+                    misses += 1
+                else:
+                    hits += 1
+                trace, n_steps = entry
+                if self.steps + n_steps > self.max_steps:
+                    self.step()
+                    if self.t != t:
+                        call = memo.entered(self, t, call)
+                    continue
+                trace(self)
+                self.steps += n_steps
+                if self.t != t:
+                    call = memo.entered(self, t, call)
+                if timed:
+                    countdown -= 1
+                    if not countdown:
+                        countdown = 1024
+                        self.check_time()
+        finally:
+            self.trace_hits += hits
+            self.trace_misses += misses
+
+    def run_cycles(self, use_traces=True):
+        # main loop which stops programs stuck in an infinite loop, for programs which always do the same thing from
+        # the same state (no ` or }). the state of the vm (pc, velocity, ts, sp of every tier and a hash of every
+        # stack, kept up to date by HashedStack) is checked at the start of every trace (or step, without traces)
+        # against a copy saved after 1, 2, 4, 8... checks (Brent's algorithm). if the state ever comes back around,
+        # the program can only go around the same loop forever, and LimitExceeded is raised naming the paths in it
+        program = self.program
+        traces = program.traces
+        self.stacks = [HashedStack(s.items()) for s in self.stacks]  # empty, unless the run was resumed
+        self.stack = self.stacks[self.t]
+        timed = self.deadline is not None
+        countdown = 1024
+        saved_pc, saved_key, saved_state, saved_steps = None, None, None, 0
+        power, n_checks = 1, 0
+        path = set()  # (x, y, t, dx, dy) of every trace run since the state was saved
+        while not self.prog_over:
+            if self.mode:
+                self.step()
+                continue
+            key = (self.x, self.y, self.t, self.dx, self.dy)
+            # pc is checked first, then the hashes, and only then the whole state
+            if key == saved_pc and self.cycle_key() == saved_key and self.cycle_state() == saved_state:
+                self.loop_found(path, self.steps - saved_steps)
+            n_checks += 1
+            if n_checks == power:
+                saved_pc, saved_key, saved_state, saved_steps = key, self.cycle_key(), self.cycle_state(), self.steps
+                power, n_checks = power * 2, 0
+                path.clear()
+            path.add(key)
+            entry = None if not use_traces else traces.get(key)
+            if entry is None and use_traces:
+                entry = traces[key] = compile_trace(program, *key)
+            if entry is None or self.steps + entry[1] > self.max_steps:
+                self.step()
+            else:
+                trace, n_steps = entry
+                trace(self)
+                self.steps += n_steps
+            if timed:
+                countdown -= 1
+                if not countdown:
+                    countdown = 1024
+                    self.check_time()
+
+    def cycle_key(self) -> tuple:
+        # the state checked by run_cycles once pc matches, other than the contents of the stacks (hashed instead)
+        return self.sp, type(self.ts), self.ts, tuple(self.sps), tuple(s.hash for s in self.stacks)
+
+    def cycle_state(self) -> tuple:
+        # the full state checked by run_cycles, once the hashes match
+        return self.ts, [s.state() for s in self.stacks]
+
+    def loop_found(self, path, n_steps):
+        # raise LimitExceeded for an infinite loop of n_steps steps, running the traces starting at the pc in path
+        tier_ids = self.program.tier_ids
+        directions = {(1, 0): 'east', (-1, 0): 'west', (0, 1): 'south', (0, -1): 'north'}
+        cells = [f'pc=[{x}, {y}, {tier_ids[t]}] heading {directions[dx, dy]}'
+                 for x, y, t, dx, dy in sorted(path, key=lambda k: (k[2], k[1], k[0]))]
+        shown = '\n'.join(cells[:20]) + (f'\n... and {len(cells) - 20} more' if len(cells) > 20 else '')
+        raise LimitExceeded('cycle', f'infinite loop found after {self.steps} steps. the state of the program '
+                                     f'repeats every {n_steps} steps, going through the paths starting at:\n{shown}')
+
+    def run_profiled(self, profiler):
+        # main loop when profiling, one cell at a time. kept apart from the other loops so that they pay nothing
+        # for the profiler when it is not in use
+        cells, op_counts, op_times = profiler.cells, profiler.op_counts, profiler.op_times
+        tier_times, jumps = profiler.tier_times, profiler.jumps
+        program = self.program
+        literals, max_width, max_height = program.literals, program.max_width, program.max_height
+        timed = self.deadline is not None
+        start = perf_counter()
+        try:
+            while not self.prog_over:
+                t, x, y, dx, dy, mode, steps = self.t, self.x, self.y, self.dx, self.dy, self.mode, self.steps
+                # cells read as part of a literal are counted under the literal, not as the instruction they hold
+                op = LITERAL_OPS[mode] if mode else self.grid[y][x][0]
+                before = perf_counter()
+                self.step()
+                elapsed = perf_counter() - before
+                cells[t, x, y] += 1
+                op_counts[op] += 1
+                if self.steps - steps > 1:
+                    # a whole literal, or a run of cells which do nothing, was passed in one step. its time is
+                    # counted under its first cell
+                    if not mode and op in LITERAL_MODES:
+                        literal_mode, _, _, _, literal_cells = literals[x, y, t, dx, dy]
+                        for cell in literal_cells[1:]:
+                            cells[(t,) + cell] += 1
+                        op_counts[LITERAL_OPS[literal_mode]] += len(literal_cells) - 1
+                    else:
+                        grid = program.grids[t]
+                        for _ in range(self.steps - steps - 1):
+                            x, y = wrap(x + dx, max_width), wrap(y + dy, max_height)
+                            cells[t, x, y] += 1
+                            op_counts[grid[y][x][0]] += 1
+                op_times[op] += elapsed
+                tier_times[t] += elapsed
+                if self.t != t:
+                    jumps[t, self.t] += 1
+                if timed:
+                    self.check_time()
+        finally:
+            profiler.seconds += perf_counter() - start
+
+    def run_recorded(self, recorder):
+        # main loop when recording (see Recorder), one cell at a time. changes to the stacks are logged by
+        # RecordingStack, and everything else is compared before and after every step
+        self.stacks = [s if isinstance(s, RecordingStack) else RecordingStack(s.items(), recorder.ops)
+                       for s in self.stacks]
+        self.stack = self.stacks[self.t]
+        recorder.start(self)
+        add = recorder.add
+        timed = self.deadline is not None
+        while not self.prog_over:
+            x, y, t, dx, dy, mode, sp, ts, steps = (self.x, self.y, self.t, self.dx, self.dy, self.mode, self.sp,
+                                                    self.ts, self.steps)
+            char = self.grid[y][x][0]
+            try:
+                self.step()
+            finally:
+                if self.steps != steps:  # a step which raised is recorded too, unless it was never run
+                    add(self, char, x, y, t, dx, dy, mode, sp, ts, steps)
+            if timed:
+                self.check_time()
+
+    def run_breakpoints(self):
+        # main loop when debugging with breakpoints. while free_run is set, pc runs at full speed without calling
+        # debug_hook, using traces which end at breakpoint cells. once a breakpoint is hit, cells are run one at a
+        # time through step() (which calls debug_hook), until debug_hook sets free_run again
+        program, breakpoints = self.program, self.breakpoints
+        traces = breakpoints.traces
+        timed = self.deadline is not None
+        prev_t = None  # tier pc was in before the last trace or step, so that entering a tier can be spotted
+        while not self.prog_over:
+            if not self.free_run:
+                prev_t = self.t
+                self.step()
+                continue
+            if breakpoints.hit(self, prev_t):
+                self.free_run = False
+                continue
+            prev_t = self.t
+            key = (self.x, self.y, self.t, self.dx, self.dy)
+            entry = None if self.mode else traces.get(key)
+            if entry is None and not self.mode:
+                entry = traces[key] = compile_trace(program, *key, stops=breakpoints.stops(self.t))
+            if entry is None or self.steps + entry[1] > self.max_steps:
+                self.step_free()
+            else:
+                trace, n_steps = entry
+                trace(self)
+                self.steps += n_steps
+            if timed:
+                self.check_time()
+
+    def run_concurrent(self, use_traces=True):
+        # main loop of a concurrent program (see CONCURRENCY). pcs take turns to run CONCURRENT_SLICE steps each, in
+        # the order they were forked, skipping pcs waiting at an R for a message. traces end before every Y, S and R,
+        # which are run by step(). a trace which would run past the end of a slice is run one cell at a time
+        # instead, so slices always end on the same step, and pcs take turns in the same order with or without
+        # traces. if self.workers is more than 1, pcs which can run on their own are handed to worker processes
+        # (see PointerPool), and what they did is taken in as they end, or in the order they were forked if
+        # self.in_order is set
+        program = self.program
+        traces, channels = program.traces, self.channels
+        traced = use_traces and self.debug_hook is None
+        timed = self.deadline is not None
+        ready = deque([self.park()])  # pcs waiting for their turn
+        waiting = []  # pcs waiting at an R for a message
+        pool = PointerPool(program, self.workers, self.in_order) if self.workers and self.workers > 1 else None
+        try:
+            while ready or (pool is not None and pool.pending):
+                if ready:
+                    self.unpark(ready.popleft())
+                    end = self.steps + CONCURRENT_SLICE
+                    limit = min(end, self.max_steps)
+                    blocked = False
+                    while not self.prog_over and self.steps < end:
+                        entry = None
+                        if not self.mode:
+                            char, func, _, _ = self.grid[self.y][self.x]
+                            if func is not None and char in CONCURRENT_OPS:
+                                if char == 'R' and not channels.get(self.t):
+                                    blocked = True
+                                    break
+                            elif traced:
+                                key = (self.x, self.y, self.t, self.dx, self.dy)
+                                entry = traces.get(key)
+                                if entry is None:
+                                    entry = traces[key] = compile_trace(program, *key)
+                        if entry is None or self.steps + entry[1] > limit:
+                            self.step()
+                            if self.forked:
+                                self.start_forked(ready, waiting, pool)
+                        else:
+                            trace, n_steps = entry
+                            trace(self)
+                            self.steps += n_steps
+                        if timed:
+                            self.check_time()
+                    if self.prog_over:
+                        self.prog_over = False  # the pc ran a #, which only ends that pc
+                    else:
+                        (waiting if blocked else ready).append(self.park())
+                if pool is not None and pool.pending and not (ready and pool.in_order):
+                    # with in_order, workers are only heard from once every pc left here is waiting (or has ended)
+                    for result in pool.take(not ready):
+                        self.take_result(result)
+                if waiting:
+                    ready.extend(pc for pc in waiting if channels.get(pc.t))
+                    waiting = [pc for pc in waiting if not channels.get(pc.t)]
+        except BaseException:
+            if pool is not None:
+                pool.close(False)
+            raise
+        if pool is not None:
+            pool.close(True)
+        if waiting:
+            tier_ids = program.tier_ids
+            cells = ', '.join(f'pc=[{pc.x}, {pc.y}, {tier_ids[pc.t]}]' for pc in waiting)
+            raise Exception(f'deadlock: every pc left is waiting for a message which can never be sent.\n{cells}')
+        self.prog_over = True
+
+    def park(self) -> 'Pointer':
+        # the state of the running pc, to be swapped back in by unpark
+        self.sps[self.t] = self.sp
+        return Pointer(self.x, self.y, self.t, self.dx, self.dy, self.ts, self.sps, self.mode, self.literal,
+                       self.jump_pos)
+
+    def unpark(self, pc):
+        self.x, self.y, self.dx, self.dy, self.ts = pc.x, pc.y, pc.dx, pc.dy, pc.ts
+        self.mode, self.literal, self.jump_pos = pc.mode, pc.literal, pc.jump_pos
+        self.sps, self.t = pc.sps, pc.t
+        self.grid = self.program.grids[pc.t]
+        self.sp, self.stack = self.sps[pc.t], self.stacks[pc.t]
+
+    def start_forked(self, ready, waiting, pool):
+        # queue the pcs forked by the last step behind every other pc, unless they can be handed to a worker
+        for pc in self.forked:
+            if pool is None or not pool.submit(self, pc, [self.park(), *ready, *waiting]):
+                ready.append(pc)
+        self.forked.clear()
+
+    def take_result(self, result):
+        # take in what a pc handed to a worker did (see run_pointer), as if it had been run here
+        self.steps += result['steps']
+        self.write(result['output'])
+        for t, messages in result['messages']:
+            channel = self.channels.get(t)
+            if channel is None:
+                channel = self.channels[t] = deque()
+            channel.extend(messages)
+        if result['status'] == 'error':
+            raise Exception(f"a pc run by a worker process failed. {result['error']}")
+        if result['status'] != 'ok':
+            raise LimitExceeded(result['status'], result['error'])
+
+    def step_free(self):
+        # step() without calling debug_hook
+        hook, self.debug_hook = self.debug_hook, None
+        try:
+            self.step()
+        finally:
+            self.debug_hook = hook
+
+    def step(self):
+        # execute the cell at pc, one cell per call (other than literals, see run_literal). used by the debug modes
+        # and to finish literals the trace cache could not complete (e.g. a number which wraps around the edge of
+        # the tier)
+        if self.steps >= self.max_steps:
+            raise LimitExceeded('step_limit', f'step limit of {self.max_steps} steps reached')
+        self.steps += 1
+        # get current (pre-decoded) cell
+        char, func, arg, ends_jump = self.grid[self.y][self.x]
+
+        if self.mode == 1:
+            # reading number
+            if char == "'":
+                func(self)
+            else:
+                self.literal.append(char)
+        elif self.mode == 2:
+            # reading string
+            if char == '"':
+                func(self)
+            else:
+                self.literal.append(char)
+        elif self.mode == 3:
+            # jumping
+            # '-' does not end the address. this enables jumping to negative tiers, should it be allowed?
+            if not ends_jump:
+                self.literal.append(char)
+            else:
+                self.jump()
+                return  # execute the cell pc lands on before moving on
+        elif func is not None:
+            if char in LITERAL_MODES and self.debug_hook is None and self.run_literal():
+                return  # the whole literal has been run, and pc has been moved on from it
+            if arg is None:
+                func(self)
+            else:
+                func(self, arg)
+        elif self.debug_hook is None and self.skip_nops():
+            return  # pc has been moved straight on to the next cell which does something
 
-def input_sp():
-    global visual_dbg, VDB, window, lines_dict
-    sp, stack = get_sp_stack()
-    if visual_dbg:
-        VDB.destroy_window()
-    inp = input()
-    if visual_dbg:
-        window = VDB.create_window()
-    stack[sp] = get_input_type(inp)
-
-
-def stack_operate(arg):
-    global ts
-    # use python exec on operation
-
-    sp, stack = get_sp_stack()
-    v_sp = stack[sp]
-    v_below_sp = stack[sp-1]
-    local_dict_hack = {}
-    # this is a way to get locals() to work in exec(). see https://bugs.python.org/issue4831
-    exec(f"res = {v_sp} {arg} {v_below_sp}", local_dict_hack)
-    res = local_dict_hack['res']
-
-    # push back on top of stack
-    stack_top = get_stack_top(sp, stack)
-    stack[stack_top+1] = res
-
-    # set ts to zero as zero has been evicted
-    ts = 0
-
-
-def check_zero():
-    global pc, velocity
-    sp, stack = get_sp_stack()
-    if stack[sp] == 0:
-        # skip next instruction on current path
-        pc[0] += velocity[0]
-        pc[1] += velocity[1]
-
-
-def boolean_not():
-    global ts
-    sp, stack = get_sp_stack()
-    v = stack[sp]
-    ts = v
-    stack[sp] = 1 if not v else 0
-
-
-def compare():
-    global pc, velocity
-    sp, stack = get_sp_stack()
-    if stack[sp] > stack[sp-1]:
-        # skip next instruction on current path
-        pc[0] += velocity[0]
-        pc[1] += velocity[1]
-
-
-def bin_random():
-    global ts
-    sp, stack = get_sp_stack()
-    # set ts to item about to be evicted
-    ts = stack[sp]
-    stack[sp] = randint(0, 1)
-
-
-def pop_stack():
-    global ts
-    # set ts
-    sp, stack = get_sp_stack()
-    ts = stack[sp]
-
-    # shift stack down to overwrite
-    top = get_stack_top(sp, stack)
-    if sp == top:
-        # if item popped is at top of stack, then just remove from dict
-        stack.pop(sp)
+        # add velocity and continue
+        self.advance_pc()
+
+    def skip_nops(self) -> bool:
+        # move pc from a cell which does nothing (mode = 0) to the next cell along its path which does something,
+        # counting a step for every cell passed. returns False, leaving pc where it is, if there is no such cell
+        # or if the step limit would be passed. the debug modes always move one cell at a time
+        key = (self.x, self.y, self.t, self.dx, self.dy)
+        skips = self.program.skips
+        if key in skips:
+            entry = skips[key]
+        else:
+            entry = skips[key] = find_live_cell(self.program, *key)
+        if entry is None or self.steps + entry[2] - 1 > self.max_steps:
+            return False
+        self.x, self.y, n = entry
+        self.steps += n - 1  # the first cell has already been counted by step()
+        return True
+
+    def run_literal(self) -> bool:
+        # run the whole literal starting at pc as one operation, instead of one cell at a time. returns False if the
+        # literal has to be read one cell at a time instead (see find_literal, or if it would pass the step limit).
+        # the debug modes always read literals one cell at a time, so that the mode of every cell can be seen
+        key = (self.x, self.y, self.t, self.dx, self.dy)
+        literals = self.program.literals
+        if key in literals:
+            entry = literals[key]
+        else:
+            entry = literals[key] = find_literal(self.program, *key)
+        if entry is None or self.steps + len(entry[4]) - 1 > self.max_steps:
+            return False
+        mode, value, x, y, cells = entry
+        self.steps += len(cells) - 1  # the first cell has already been counted by step()
+        if mode == 3:
+            self.enter_tier(value)  # pc stays at the position of the @ sign
+        else:
+            self.ts = self.stack[self.sp]  # store evicted
+            self.stack[self.sp] = value
+            self.x, self.y = x, y
+        return True
+
+    def advance_pc(self):
+        if self.debug_hook is not None:
+            self.debug_hook(self)
+
+        max_width, max_height = self.program.max_width, self.program.max_height
+        x = self.x + self.dx
+        y = self.y + self.dy
+        if x > max_width:
+            x = 0
+        elif x < 0:
+            x = max_width
+        if y > max_height:
+            y = 0
+        elif y < 0:
+            y = max_height
+        self.x, self.y = x, y
+
+    def enter_tier(self, tier):
+        # move pc into another tier, keeping its position. sp of the tier being left is saved
+        t = self.program.tier_index.get(tier) if isinstance(tier, int) else None
+        if t is None:
+            raise Exception(f"jump to a tier which does not exist.\nTier: {tier}.tier")
+        self.sps[self.t] = self.sp
+        self.t = t
+        self.grid = self.program.grids[t]
+        self.sp, self.stack = self.sps[t], self.stacks[t]
+
+    def view_debug(self):
+        char = self.grid[self.y][self.x][0]
+        print(f"char={char}\npc={[self.x, self.y, self.tier]}, vel={[self.dx, self.dy]}\nts={self.ts}\n"
+              f"mode={self.mode}\nsp={self.sp}\nstack={self.stack}\n---")
+
+    def operate(self, symbol, v_sp, v_below_sp):
+        # look up the operation for the types of both operands in the dispatch table for this operator
+        func = arithmetic_ops[symbol].get((type(v_sp), type(v_below_sp)))
+        if func is None:
+            raise Exception(f"unsupported operand types for {symbol}.\nstack[sp]: {v_sp!r}\n"
+                            f"stack[sp-1]: {v_below_sp!r}\nFile:{self.tier}.tier")
+        return func(v_sp, v_below_sp)
+
+    # ---------------------------------------------INSTRUCTIONS---------------------------------------------------
+
+    def change_vel(self, arg):
+        self.dx, self.dy = arg
+
+    def jump(self):
+        if not self.mode:
+            self.mode = 3
+            self.jump_pos = (self.x, self.y)
+        elif self.mode == 3:
+            self.mode = 0
+            str_ver = ''.join(self.literal)  # string version allows to jump to -1.tier
+            self.literal = []
+            jump_x, jump_y = self.jump_pos
+            op = self.grid[jump_y][jump_x][0]  # the address may be that of a Y or S (see CONCURRENCY)
+            if op == 'Y':
+                self.fork(int(str_ver))
+            elif op == 'S':
+                self.send(int(str_ver))
+            else:
+                self.x, self.y = jump_x, jump_y
+                self.enter_tier(int(str_ver))
+
+    def fork(self, tier):
+        # a new pc starts at the position of the Y sign in the tier, the same as a jump. pc carries on from the
+        # cell which ended the address
+        t = self.program.tier_index.get(tier)
+        if t is None:
+            raise Exception(f"fork into a tier which does not exist.\nTier: {tier}.tier")
+        self.sps[self.t] = self.sp
+        jump_x, jump_y = self.jump_pos
+        self.forked.append(Pointer(jump_x, jump_y, t, self.dx, self.dy, self.ts, self.sps[:]))
+
+    def send(self, tier):
+        t = self.program.tier_index.get(tier)
+        if t is None:
+            raise Exception(f"message sent to a tier which does not exist.\nTier: {tier}.tier")
+        channel = self.channels.get(t)
+        if channel is None:
+            channel = self.channels[t] = deque()
+        channel.append(self.stack[self.sp])
+
+    def receive(self):
+        # put the oldest message sent to the current tier into stack[sp]. run_concurrent only runs R once there is
+        # a message to receive
+        channel = self.channels.get(self.t)
+        if not channel:
+            raise Exception(f"no message to receive.\nFile:{self.tier}.tier")
+        self.ts = self.stack[self.sp]  # store evicted
+        self.stack[self.sp] = channel.popleft()
+
+    def change_sp(self, arg):
+        # increment/decrement stack pointer for tier
+        self.sp += arg
+
+    def push_ts(self):
+        stack = self.stack
+        # there may be no items in stack. ts may still be non-zero as ts is available to all stacks
+        stack[stack.top(self.sp) + 1] = self.ts
+        # reset ts back to 0, replacing the 0 that was just evicted
+        self.ts = 0
+
+    def copy_ts(self):
+        self.ts = self.stack[self.sp]
+
+    def copy_sp(self):
+        self.stack[self.sp] = self.ts
+
+    def end_prog(self):
+        self.prog_over = True
+
+    def print_sp(self):
+        # print stack at sp. only strings can hold a \n to be replaced with a newline
+        v = self.stack[self.sp]
+        self.write(v.replace('\\n', '\n') if type(v) is str else str(v))
+
+    def input_sp(self):
+        self.stack[self.sp] = get_input_type(self.read())
+
+    def stack_operate(self, arg):
+        sp, stack = self.sp, self.stack
+        res = self.operate(arg, stack[sp], stack[sp-1])
+
+        # push back on top of stack
+        stack[stack.top(sp) + 1] = res
+
+        # set ts to zero as zero has been evicted
+        self.ts = 0
+
+    def check_zero(self):
+        if self.stack[self.sp] == 0:
+            # skip next instruction on current path
+            self.x += self.dx
+            self.y += self.dy
+
+    def boolean_not(self):
+        v = self.stack[self.sp]
+        self.ts = v
+        self.stack[self.sp] = 1 if not v else 0
+
+    def compare(self):
+        sp, stack = self.sp, self.stack
+        if stack[sp] > stack[sp-1]:
+            # skip next instruction on current path
+            self.x += self.dx
+            self.y += self.dy
+
+    def bin_random(self):
+        # set ts to item about to be evicted
+        self.ts = self.stack[self.sp]
+        self.stack[self.sp] = randint(0, 1)
+
+    def pop_stack(self):
+        sp, stack = self.sp, self.stack
+        # set ts
+        self.ts = stack[sp]
+
+        # shift stack down to overwrite
+        if sp == stack.top(sp):
+            # if item popped is at top of stack, then just remove it
+            stack.pop(sp)
+            return
+        # else if sp is somewhere in the middle of the stack,
+        # move all elements with higher indexes down one. the top element is removed by the move
+        stack.remove(sp)
+
+    def store_num_sp(self):
+        if not self.mode:
+            self.mode = 1
+        elif self.mode == 1:
+            self.mode = 0
+            self.ts = self.stack[self.sp]  # store evicted
+            str_version = r''.join(self.literal)
+            self.literal = []
+            self.stack[self.sp] = parse_number(str_version)
+
+    def store_str_sp(self):
+        # again, this must be done with checks as we need "'" to be valid (result in storing string ' at sp)
+        if not self.mode:
+            self.mode = 2
+        elif self.mode == 2:
+            self.mode = 0
+            # replace on top of stack
+            self.ts = self.stack[self.sp]  # store evicted
+            self.stack[self.sp] = r''.join(self.literal)  # join into string
+            self.literal = []
+
+    def get_index(self):
+        # place the actual value of sp in ts
+        self.ts = self.sp
+
+    def pop_highest(self):
+        stack = self.stack
+        # pop the highest item in the stack into ts
+        stack_top = stack.top(self.sp)
+        self.ts = stack[stack_top]
+        stack.pop(stack_top)
+
+
+# -------------------------------------------------PROFILER-----------------------------------------------------------
+LITERAL_OPS = {1: "'...'", 2: '"..."', 3: '@...'}  # names for the cells read while mode != 0
+OP_NAMES = {None: 'blank', ' ': 'space'}  # names for the ops which would not be readable in the output
+HEAT_CHARS = ' .:-=+*#%@'  # from never executed to the most executed cell of the program
+
+
+class Profiler:
+    # counts and times collected by TierVM.run_profiled. cells and jumps use tier positions (TierVM.t), which are
+    # turned into tier numbers on export
+    __slots__ = ('cells', 'op_counts', 'op_times', 'tier_times', 'jumps', 'seconds')
+
+    def __init__(self):
+        self.cells = defaultdict(int)  # (t, x, y) : number of times the cell was executed
+        self.op_counts = defaultdict(int)  # char : number of times executed
+        self.op_times = defaultdict(float)  # char : seconds
+        self.tier_times = defaultdict(float)  # t : seconds
+        self.jumps = defaultdict(int)  # (t left, t entered) : number of jumps
+        self.seconds = 0.0
+
+    def to_json(self, program) -> dict:
+        tier_ids = program.tier_ids
+        tier_steps = defaultdict(int)
+        tier_cells = defaultdict(list)
+        for (t, x, y), count in sorted(self.cells.items()):
+            tier_steps[t] += count
+            tier_cells[t].append([x, y, count])
+        opcodes = sorted(self.op_counts, key=lambda op: -self.op_times[op])
+        return {
+            'directory': program.directory,
+            'steps': sum(tier_steps.values()),
+            'seconds': self.seconds,
+            'opcodes': {OP_NAMES.get(op, op): {'count': self.op_counts[op], 'seconds': self.op_times[op]}
+                        for op in opcodes},
+            'tiers': {str(tier_ids[t]): {'steps': tier_steps[t], 'seconds': self.tier_times[t],
+                                         'cells': tier_cells[t]}  # [x, y, count] of every executed cell
+                      for t in range(len(tier_ids)) if tier_steps[t]},
+            'jumps': [{'from': tier_ids[a], 'to': tier_ids[b], 'count': count}
+                      for (a, b), count in sorted(self.jumps.items(), key=lambda item: -item[1])],
+        }
+
+    def heatmap(self, program) -> str:
+        # draw the number of times each cell was executed next to the source of every tier that was entered,
+        # on a log scale so that cells run once still show up next to the inner loops
+        max_count = max(self.cells.values(), default=1)
+        scale = log(max_count) if max_count > 1 else 1
+        out = []
+        for t in range(len(program.tier_list)):
+            counts = {(x, y): count for (ct, x, y), count in self.cells.items() if ct == t}
+            if not counts:
+                continue
+            grid = program.grids[t]
+            out.append(f'{program.tier_list[t]}.tier: {sum(counts.values())} steps, {self.tier_times[t]:.6f}s')
+            for y, row in enumerate(grid):
+                if program.lines is not None and y < len(program.lines[t]):
+                    source = program.lines[t][y].rstrip('\r\n').expandtabs(1)
+                else:
+                    source = ''.join(cell[0] or ' ' for cell in row).rstrip()
+                heat = ''.join(' ' if (x, y) not in counts
+                               else HEAT_CHARS[1 + int(log(counts[x, y]) / scale * (len(HEAT_CHARS) - 2))]
+                               for x in range(len(row)))
+                out.append(f'{source.ljust(len(row))} | {heat.rstrip()}')
+            out.append('')
+        out.append(f"{'op':<8}{'count':>12}{'seconds':>12}")
+        for op in sorted(self.op_counts, key=lambda op: -self.op_times[op]):
+            out.append(f"{OP_NAMES.get(op, op):<8}{self.op_counts[op]:>12}{self.op_times[op]:>12.6f}")
+        if self.jumps:
+            out.append('')
+            out.append('jumps: ' + ', '.join(f'{program.tier_ids[a]} -> {program.tier_ids[b]}: {count}'
+                                             for (a, b), count in sorted(self.jumps.items(), key=lambda i: -i[1])))
+        return '\n'.join(out)
+
+
+# -----------------------------------------------BREAKPOINTS----------------------------------------------------------
+class Breakpoints:
+    # places for the debugger to stop a free run. each spec is one of
+    #   x,y or x,y,tier    the cell at column x, row y of a tier (0.tier if not given)
+    #   @tier              pc entering a tier, e.g. @2
+    #   char               any cell holding that instruction, e.g. $
+    # tiers are held as positions in Program.tier_list (TierVM.t). traces which end at breakpoints are kept apart
+    # from Program.traces
+    __slots__ = ('program', 'cells', 'ops', 'tiers', 'stop_cells', 'traces')
+
+    def __init__(self, program, specs):
+        self.program = program
+        self.cells, self.ops, self.tiers = set(), set(), set()
+        self.stop_cells = {}  # t : {(x, y)} where traces must end
+        self.traces = {}
+        for spec in specs:
+            if re.fullmatch('-?[0-9]+,-?[0-9]+(,-?[0-9]+)?', spec):
+                x, y, *tier = (int(v) for v in spec.split(','))
+                self.cells.add((self.position(tier[0] if tier else 0), x, y))
+            elif re.fullmatch('@-?[0-9]+', spec):
+                self.tiers.add(self.position(int(spec[1:])))
+            elif len(spec) == 1:
+                self.ops.add(spec)
+            else:
+                raise Exception(f"could not read breakpoint: {spec}\n"
+                                f"expected x,y or x,y,tier for a cell, @tier for a tier or a single instruction")
+
+    def __bool__(self) -> bool:
+        return bool(self.cells or self.ops or self.tiers)
+
+    def position(self, tier) -> int:
+        t = self.program.tier_index.get(tier)
+        if t is None:
+            raise Exception(f"breakpoint in a tier which does not exist.\nTier: {tier}.tier")
+        return t
+
+    def stops(self, t) -> set:
+        # cells of tier t which a trace must not run past
+        stops = self.stop_cells.get(t)
+        if stops is None:
+            stops = self.stop_cells[t] = {(x, y) for bt, x, y in self.cells if bt == t}
+            if self.ops:
+                stops.update((x, y) for y, row in enumerate(self.program.grids[t])
+                             for x, cell in enumerate(row) if cell[0] in self.ops)
+        return stops
+
+    def hit(self, vm, prev_t) -> bool:
+        # whether the cell at pc should be stopped at, before it is run. prev_t is the tier pc was in before
+        t = vm.t
+        if t != prev_t and t in self.tiers:
+            return True
+        if (t, vm.x, vm.y) in self.cells:
+            return True
+        return not vm.mode and vm.grid[vm.y][vm.x][0] in self.ops
+
+
+# ------------------------------------------------MEMOIZATION---------------------------------------------------------
+MEMO_SIZE = 4096  # number of calls a CallCache remembers
+MEMO_MIN_STEPS = 64  # calls into a function which run fewer steps than this are not worth remembering
+MEMO_TRIAL = 16  # calls into a function after which it is given up on, if they ran fewer than MEMO_MIN_STEPS on average
+IMPURE_OPS = '{}`#YSR'  # instructions which stop a function from being pure (see Analysis.pure)
+
+
+class CallCache:
+    # calls into pure functions, remembered by TierVM.run_memoized. a call starts when pc jumps from one tier (the
+    # caller) into another, and ends the next time pc jumps back into the caller. the function is pure if, from the
+    # state pc enters it in, it can never reach { } ` or # (or Y S R) before jumping back into the caller, which is
+    # found by Analysis. everything such a call does then only depends on that state, ts, and the sp and stack of
+    # every tier pc can reach before it returns, which are the key of the call. the first call with a key is run as
+    # normal and the state it returns in is saved. every later call with the same key returns straight away,
+    # counting the same number of steps. the least recently used calls are forgotten once there are more than size.
+    # calls which run fewer than MEMO_MIN_STEPS steps are not saved, as working out their key costs about as much as
+    # running them, and a function whose first MEMO_TRIAL calls are that short on average is not looked at again.
+    # a function which passes through its caller's tier before returning (as powxy_func does) is split into a call
+    # for each pass, which are usually that short
+    __slots__ = ('size', 'calls', 'functions', 'lengths', 'short', 'hits', 'misses', 'evictions')
+
+    def __init__(self, size=MEMO_SIZE):
+        self.size = size
+        self.calls = OrderedDict()  # key : (x, y, dx, dy, ts, jump_pos, steps, [(t, sp, stack items)])
+        self.functions = {}  # (x, y, t, dx, dy, caller) : tiers pc can reach from there, None if not pure
+        self.lengths = {}  # (x, y, t, dx, dy, caller) : [number of calls, total steps], for the first MEMO_TRIAL calls
+        self.short = set()  # entries of pure functions given up on, as their calls were too short to pay off
+        self.hits, self.misses, self.evictions = 0, 0, 0
+
+    def entered(self, vm, caller, call):
+        # pc has just jumped from caller into vm.t. call is the call being recorded, if any.
+        # returns the call being recorded from now on
+        if call is not None:
+            if vm.t != call[2]:
+                return call  # still inside the function
+            self.returned(vm, call)
+        program = vm.program
+        entry = (vm.x, vm.y, vm.t, vm.dx, vm.dy, caller)
+        if entry in self.functions:
+            tiers = self.functions[entry]
+        else:
+            analysis = Analysis(program, entry[:5], exit_tier=caller)
+            tiers = self.functions[entry] = tuple(sorted(analysis.cells)) if analysis.pure else None
+            self.lengths[entry] = [0, 0]
+        if tiers is None:
+            return None
+        vm.sps[vm.t] = vm.sp
+        key = (entry, type(vm.ts), vm.ts, tuple((vm.sps[t], tuple((i, type(v), v) for i, v in vm.stacks[t].items()))
+                                                for t in tiers))
+        result = self.calls.get(key)
+        if result is None:
+            self.misses += 1
+            return key, tiers, caller, vm.steps
+        x, y, dx, dy, ts, jump_pos, steps, stacks = result
+        if vm.steps + steps > vm.max_steps:
+            return None  # run as normal, so that the step limit is reached on the same step
+        self.calls.move_to_end(key)
+        self.hits += 1
+        for t, sp, items in stacks:
+            stack = vm.stacks[t] = TierStack()
+            for i, v in items:
+                stack[i] = v
+            vm.sps[t] = sp
+        vm.x, vm.y, vm.dx, vm.dy, vm.ts, vm.jump_pos = x, y, dx, dy, ts, jump_pos
+        vm.steps += steps
+        vm.t, vm.grid = caller, program.grids[caller]
+        vm.sp, vm.stack = vm.sps[caller], vm.stacks[caller]
+        return None
+
+    def returned(self, vm, call):
+        # pc has jumped back into the caller of the call being recorded. save the state it returned in
+        key, tiers, caller, steps = call
+        steps = vm.steps - steps
+        entry = key[0]
+        lengths = self.lengths.get(entry)
+        if lengths is not None:
+            lengths[0] += 1
+            lengths[1] += steps
+            if lengths[0] == MEMO_TRIAL:
+                del self.lengths[entry]
+                if lengths[1] < MEMO_MIN_STEPS * MEMO_TRIAL:
+                    self.functions[entry] = None
+                    self.short.add(entry)
+        if steps < MEMO_MIN_STEPS:
+            return
+        stacks = [(t, vm.sps[t], vm.stacks[t].items()) for t in tiers]
+        self.calls[key] = (vm.x, vm.y, vm.dx, vm.dy, vm.ts, vm.jump_pos, steps, stacks)
+        if len(self.calls) > self.size:
+            self.calls.popitem(last=False)
+            self.evictions += 1
+
+    def report(self) -> str:
+        calls = self.hits + self.misses
+        rate = self.hits / calls if calls else 0
+        pure = sum(1 for tiers in self.functions.values() if tiers is not None)
+        impure = len(self.functions) - pure - len(self.short)
+        return (f'memo: {self.hits} hits, {self.misses} misses ({rate:.1%} hit rate), {self.evictions} evictions, '
+                f'{len(self.calls)} calls remembered. function entries: {pure} pure, {impure} impure, '
+                f'{len(self.short)} disabled as their calls were too short to pay off')
+
+
+# -------------------------------------------------RECORDING----------------------------------------------------------
+# a recording is RECORD_MAGIC followed by chunks of up to RECORD_CHUNK records, one record for every step. each chunk
+# starts with a header (number of the first record, number of records, number of the first step, length of the
+# keyframe, length of the records), then a keyframe (a snapshot of the vm before its first record, as zlib compressed
+# json), then the records.
+# a record is a byte of RECORD_* flags, the character at pc plus one (0 for a blank cell), then only what the step
+# changed, each as a varint: the move of pc (if not by velocity), the old and new velocity (one byte), the old and
+# new tier positions, the change of sp, the old and new ts, the old and new mode (one byte), the number of steps (if
+# not 1) and the changes made to the stack (see RecordingStack). every change holds the old value as well as the
+# new, so that a record can be undone as easily as it is applied
+RECORD_MAGIC = b'TIERR\x01'
+RECORD_CHUNK = 2 ** 16  # records between keyframes. seeking applies at most this many records
+RECORD_HEADER = struct.Struct('<QQQQQ')
+RECORD_PC, RECORD_VEL, RECORD_TIER, RECORD_SP, RECORD_TS, RECORD_MODE, RECORD_STEPS, RECORD_OPS = (
+    1, 2, 4, 8, 16, 32, 64, 128)
+FLOAT = struct.Struct('<d')
+
+
+def put_varint(out, n):
+    # n >= 0, 7 bits to a byte
+    while n > 0x7f:
+        out.append(n & 0x7f | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def put_signed(out, n):
+    put_varint(out, n * 2 if n >= 0 else -n * 2 - 1)  # zigzag, so that small negative numbers stay small
+
+
+def put_value(out, v):
+    # a value held by ts or the stack: 0 int, 1 float, 2 string, 3 not stored
+    if v is EMPTY_SLOT:
+        out.append(3)
+    elif type(v) is str:
+        data = v.encode('utf-8', 'surrogatepass')
+        out.append(2)
+        put_varint(out, len(data))
+        out += data
+    elif type(v) is float:
+        out.append(1)
+        out += FLOAT.pack(v)
+    else:
+        out.append(0)
+        put_signed(out, v)
+
+
+def get_varint(data, pos) -> (int, int):
+    n, shift = 0, 0
+    while True:
+        b = data[pos]
+        pos += 1
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+
+def get_signed(data, pos) -> (int, int):
+    n, pos = get_varint(data, pos)
+    return (n >> 1) if not n & 1 else -(n >> 1) - 1, pos
+
+
+def get_value(data, pos) -> tuple:
+    kind = data[pos]
+    pos += 1
+    if kind == 0:
+        return get_signed(data, pos)
+    if kind == 1:
+        return FLOAT.unpack_from(data, pos)[0], pos + 8
+    if kind == 2:
+        n, pos = get_varint(data, pos)
+        return bytes(data[pos:pos + n]).decode('utf-8', 'surrogatepass'), pos + n
+    return EMPTY_SLOT, pos
+
+
+def pack_vel(dx, dy) -> int:
+    return (dx + 1) * 3 + dy + 1
+
+
+VELOCITIES = {pack_vel(dx, dy): (dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)}
+
+
+class Recorder:
+    # records every step of a run (see TierVM.run_recorded), to be viewed later with Replay. records are written to
+    # path as each chunk fills up. if keep_steps is given, only the chunks holding (at least) the last keep_steps
+    # steps are kept, in memory, and written to path by close(): a ring buffer for watching long runs which may fail
+    __slots__ = ('path', 'file', 'chunks', 'ops', 'records', 'first', 'n_records', 'first_step', 'keyframe')
+
+    def __init__(self, path=None, keep_steps=None):
+        self.path = path
+        self.file = None
+        if path is not None and keep_steps is None:
+            self.file = open(path, 'wb')
+            self.file.write(RECORD_MAGIC)
+        self.chunks = deque(maxlen=None if keep_steps is None else keep_steps // RECORD_CHUNK + 2)
+        self.ops = []  # changes made to the stacks by the step being recorded
+        self.records = bytearray()
+        self.first, self.n_records = 0, 0  # number of the first record of the current chunk, records in it
+        self.first_step = 0
+        self.keyframe = None
+
+    def start(self, vm):
+        # start a chunk from the current state of the vm
+        if self.n_records:
+            self.end_chunk()
+        self.first_step = vm.steps
+        snapshot = vm.snapshot()
+        snapshot['output'] = ''
+        self.keyframe = zlib.compress(json.dumps(snapshot, separators=(',', ':')).encode('utf-8'))
+        self.ops.clear()
+
+    def chunk(self) -> tuple:
+        return self.first, self.n_records, self.first_step, self.keyframe, bytes(self.records)
+
+    def end_chunk(self):
+        chunk = self.chunk()
+        if self.file is not None:
+            write_chunk(self.file, chunk)
+        else:
+            self.chunks.append(chunk)
+        self.first += self.n_records
+        self.n_records = 0
+        self.records.clear()
+        self.keyframe = None
+
+    def add(self, vm, char, x, y, t, dx, dy, mode, sp, ts, steps):
+        # record the step which took the vm from the state given (before the step) to its state now
+        # the common cases (ascii characters, small moves of pc) are written as single bytes here, rather than
+        # through put_varint, as this is called for every step
+        out = self.records
+        start = len(out)
+        out.append(0)
+        code = 0 if char is None else ord(char) + 1
+        if code < 0x80:
+            out.append(code)
+        else:
+            put_varint(out, code)
+        flags = 0
+        new_dx, new_dy = vm.dx, vm.dy
+        mx, my = vm.x - x, vm.y - y
+        if mx != new_dx or my != new_dy:
+            flags |= RECORD_PC
+            if -64 <= mx < 64 and -64 <= my < 64:
+                out.append(mx * 2 if mx >= 0 else -mx * 2 - 1)
+                out.append(my * 2 if my >= 0 else -my * 2 - 1)
+            else:
+                put_signed(out, mx)
+                put_signed(out, my)
+        if new_dx != dx or new_dy != dy:
+            flags |= RECORD_VEL
+            out.append(pack_vel(dx, dy) << 4 | pack_vel(new_dx, new_dy))
+        if vm.t != t:
+            flags |= RECORD_TIER  # sp is that of the new tier
+            put_varint(out, t)
+            put_varint(out, vm.t)
+        elif vm.sp != sp:
+            flags |= RECORD_SP
+            put_signed(out, vm.sp - sp)
+        new_ts = vm.ts
+        if new_ts != ts or type(new_ts) is not type(ts):
+            flags |= RECORD_TS
+            put_value(out, ts)
+            put_value(out, new_ts)
+        if vm.mode != mode:
+            flags |= RECORD_MODE
+            out.append(mode << 2 | vm.mode)
+        if vm.steps - steps != 1:
+            flags |= RECORD_STEPS
+            put_varint(out, vm.steps - steps)
+        ops = self.ops
+        if ops:
+            flags |= RECORD_OPS
+            put_varint(out, len(ops))
+            for op in ops:
+                if op[0] is None:
+                    _, i, v, holes = op
+                    out.append(1)
+                    put_signed(out, i)
+                    put_value(out, v)
+                    put_varint(out, len(holes))
+                    for j in holes:
+                        put_varint(out, j - i)
+                else:
+                    i, old, new = op
+                    out.append(0)
+                    put_signed(out, i)
+                    put_value(out, old)
+                    put_value(out, new)
+            ops.clear()
+        out[start] = flags
+        self.n_records += 1
+        if self.n_records == RECORD_CHUNK:
+            self.start(vm)
+
+    def all_chunks(self) -> list:
+        # the chunks held in memory, including the one being recorded
+        return list(self.chunks) + ([self.chunk()] if self.keyframe is not None else [])
+
+    def close(self):
+        if self.file is None and self.path is not None:
+            self.file = open(self.path, 'wb')
+            self.file.write(RECORD_MAGIC)
+            for chunk in self.chunks:
+                write_chunk(self.file, chunk)
+        if self.file is not None:
+            if self.keyframe is not None:
+                write_chunk(self.file, self.chunk())
+            self.file.close()
+            self.file, self.path = None, None
+
+
+def write_chunk(f, chunk):
+    first, n_records, first_step, keyframe, records = chunk
+    f.write(RECORD_HEADER.pack(first, n_records, first_step, len(keyframe), len(records)))
+    f.write(keyframe)
+    f.write(records)
+
+
+def load_recording(path) -> list:
+    # the chunks of a recording saved by Recorder, as (first record, number of records, first step, keyframe, records)
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:len(RECORD_MAGIC)] != RECORD_MAGIC:
+        raise Exception(f'{path} is not a recording of a tier program')
+    chunks, pos = [], len(RECORD_MAGIC)
+    while pos < len(data):
+        first, n_records, first_step, keyframe_len, records_len = RECORD_HEADER.unpack_from(data, pos)
+        pos += RECORD_HEADER.size
+        keyframe = data[pos:pos + keyframe_len]
+        pos += keyframe_len
+        chunks.append((first, n_records, first_step, keyframe, data[pos:pos + records_len]))
+        pos += records_len
+    return chunks
+
+
+def decode_records(data) -> list:
+    # the records of a chunk, as (char, pc move, (old, new) velocity, (old, new) tier, sp change, (old, new) ts,
+    # (old, new) mode, steps, stack changes). fields a step did not change are None
+    records, pos = [], 0
+    while pos < len(data):
+        flags = data[pos]
+        code, pos = get_varint(data, pos + 1)
+        pc = vel = tiers = ts = mode = None
+        sp, steps, ops = 0, 1, ()
+        if flags & RECORD_PC:
+            mx, pos = get_signed(data, pos)
+            my, pos = get_signed(data, pos)
+            pc = (mx, my)
+        if flags & RECORD_VEL:
+            vel = (VELOCITIES[data[pos] >> 4], VELOCITIES[data[pos] & 15])
+            pos += 1
+        if flags & RECORD_TIER:
+            old, pos = get_varint(data, pos)
+            new, pos = get_varint(data, pos)
+            tiers = (old, new)
+        if flags & RECORD_SP:
+            sp, pos = get_signed(data, pos)
+        if flags & RECORD_TS:
+            old, pos = get_value(data, pos)
+            new, pos = get_value(data, pos)
+            ts = (old, new)
+        if flags & RECORD_MODE:
+            mode = (data[pos] >> 2, data[pos] & 3)
+            pos += 1
+        if flags & RECORD_STEPS:
+            steps, pos = get_varint(data, pos)
+        if flags & RECORD_OPS:
+            n, pos = get_varint(data, pos)
+            ops = []
+            for _ in range(n):
+                kind = data[pos]
+                i, pos = get_signed(data, pos + 1)
+                if kind == 1:
+                    v, pos = get_value(data, pos)
+                    n_holes, pos = get_varint(data, pos)
+                    holes = []
+                    for _ in range(n_holes):
+                        j, pos = get_varint(data, pos)
+                        holes.append(i + j)
+                    ops.append((None, i, v, holes))
+                else:
+                    old, pos = get_value(data, pos)
+                    new, pos = get_value(data, pos)
+                    ops.append((i, old, new))
+        records.append((chr(code - 1) if code else None, pc, vel, tiers, sp, ts, mode, steps, ops))
+    return records
+
+
+class Replay:
+    # a recorded run (the chunks of a Recorder, or of load_recording), viewed by moving vm from record to record in
+    # either direction. the program is never run. position is the number of records applied to reach the state of
+    # vm, counted from the start of the run. records are decoded a chunk at a time
+    __slots__ = ('vm', 'chunks', 'chunk', 'records', 'position')
+
+    def __init__(self, program, chunks):
+        if not chunks:
+            raise Exception('the recording is empty')
+        self.vm = TierVM(program)
+        self.chunks = chunks
+        self.chunk, self.records = None, None
+        self.enter_chunk(0)
+
+    def enter_chunk(self, c):
+        # move to the keyframe at the start of chunk c
+        first, _, _, keyframe, records = self.chunks[c]
+        self.vm.restore(json.loads(zlib.decompress(keyframe)))
+        if self.chunk != c:
+            self.chunk, self.records = c, decode_records(records)
+        self.position = first
+
+    @property
+    def end(self) -> int:
+        first, n_records, _, _, _ = self.chunks[-1]
+        return first + n_records
+
+    def next_char(self):
+        # the character run by the next record, or None at the end of the recording
+        r = self.position - self.chunks[self.chunk][0]
+        return self.records[r][0] if r < len(self.records) else None
+
+    def forward(self) -> bool:
+        # apply the next record. returns False at the end of the recording. pc is moved on to the next chunk as
+        # soon as the last record of a chunk is applied, so that the next record is always in self.records
+        r = self.position - self.chunks[self.chunk][0]
+        if r == len(self.records):
+            return False
+        self.apply(self.records[r])
+        self.position += 1
+        if r + 1 == len(self.records) and self.chunk + 1 < len(self.chunks):
+            self.enter_chunk(self.chunk + 1)
+        return True
+
+    def backward(self) -> bool:
+        # undo the last record applied. returns False at the start of the recording
+        r = self.position - self.chunks[self.chunk][0]
+        if r == 0:
+            if self.chunk == 0:
+                return False
+            self.enter_chunk(self.chunk - 1)
+            for record in self.records:
+                self.apply(record)
+            r = len(self.records)
+        self.undo(self.records[r - 1])
+        self.position = self.chunks[self.chunk][0] + r - 1
+        return True
+
+    def apply(self, record):
+        char, pc, vel, tiers, sp, ts, mode, steps, ops = record
+        vm = self.vm
+        stack = vm.stack
+        for op in ops:
+            if op[0] is None:
+                stack.remove(op[1])
+            elif op[2] is EMPTY_SLOT:
+                stack.pop(op[0])
+            else:
+                stack[op[0]] = op[2]
+        if vel is not None:
+            vm.dx, vm.dy = vel[1]
+        if pc is None:
+            vm.x, vm.y = vm.x + vm.dx, vm.y + vm.dy
+        else:
+            vm.x, vm.y = vm.x + pc[0], vm.y + pc[1]
+        if tiers is not None:
+            self.move_tier(tiers[1])
+        vm.sp += sp
+        if ts is not None:
+            vm.ts = ts[1]
+        if mode is not None:
+            vm.mode = mode[1]
+        vm.steps += steps
+
+    def undo(self, record):
+        char, pc, vel, tiers, sp, ts, mode, steps, ops = record
+        vm = self.vm
+        vm.steps -= steps
+        if mode is not None:
+            vm.mode = mode[0]
+        if ts is not None:
+            vm.ts = ts[0]
+        vm.sp -= sp
+        if tiers is not None:
+            self.move_tier(tiers[0])
+        if pc is None:
+            vm.x, vm.y = vm.x - vm.dx, vm.y - vm.dy
+        else:
+            vm.x, vm.y = vm.x - pc[0], vm.y - pc[1]
+        if vel is not None:
+            vm.dx, vm.dy = vel[0]
+        stack = vm.stack
+        for op in reversed(ops):
+            if op[0] is None:
+                _, i, v, holes = op
+                above = [(j, value) for j, value in stack.items() if j >= i]
+                for j, _ in reversed(above):
+                    stack.pop(j)
+                for j, value in above:
+                    stack[j + 1] = value
+                stack[i] = v
+                for j in holes:
+                    stack.pop(j)  # moved back to where they were, having been stored as 0 by the remove
+            elif op[1] is EMPTY_SLOT:
+                stack.pop(op[0])
+            else:
+                stack[op[0]] = op[1]
+
+    def move_tier(self, t):
+        # change tier as enter_tier does, given the position of the tier
+        vm = self.vm
+        vm.sps[vm.t] = vm.sp
+        vm.t, vm.grid = t, vm.program.grids[t]
+        vm.sp, vm.stack = vm.sps[t], vm.stacks[t]
+
+    def seek(self, step):
+        # move to the last record boundary at or before the given step (the start or end of the recording, if step
+        # is outside of it), starting from the closest keyframe
+        c = 0
+        for i, (_, _, first_step, _, _) in enumerate(self.chunks):
+            if i and first_step > step:
+                break
+            c = i
+        if c != self.chunk or self.vm.steps > step:
+            self.enter_chunk(c)
+        while self.vm.steps < step and self.forward():
+            pass
+        if self.vm.steps > step and self.position > self.chunks[0][0]:
+            self.backward()
+
+    def describe(self) -> str:
+        # one line describing the state of the vm, and the character the next record runs
+        vm = self.vm
+        nxt = 'end of recording' if self.position == self.end else OP_NAMES.get(self.next_char(), self.next_char())
+        return (f'step {vm.steps}: pc={[vm.x, vm.y, vm.tier]} vel={[vm.dx, vm.dy]} mode={vm.mode} sp={vm.sp} '
+                f'ts={vm.ts!r} next: {nxt}')
+
+
+# ---------------------------------------------LITERALS AND SKIPS-----------------------------------------------------
+LITERAL_MODES = {"'": 1, '"': 2, '@': 3}  # the mode each literal starts
+
+
+def find_literal(program, x, y, t, dx, dy):
+    # read the literal (number, string or jump address) which starts at the ' " or @ at x, y of tier t, when pc
+    # enters it with velocity dx, dy, following the same path step() would. returns (mode, value, x, y, cells),
+    # where value is the number or string to store or the number of the tier to jump to, x, y is the position pc
+    # moves on to, and cells are the positions read, first and last included.
+    # None is returned for literals which must be read one cell at a time, so that they raise exactly as before:
+    # numbers and strings which run into blank space, and numbers or jump addresses which do not parse
+    rows = program.grids[t]
+    max_width, max_height = program.max_width, program.max_height
+    mode = LITERAL_MODES[rows[y][x][0]]
+    buf = []
+    cells = [(x, y)]
+    cx, cy = x, y
+    while True:
+        # every literal ends within one lap of the tier at the latest, when it comes back around to its first cell
+        cx, cy = wrap(cx + dx, max_width), wrap(cy + dy, max_height)
+        char, _, _, ends_jump = rows[cy][cx]
+        cells.append((cx, cy))
+        if mode == 3:
+            if ends_jump:
+                try:
+                    return mode, int(''.join(buf)), x, y, tuple(cells)  # pc lands on the @ sign
+                except ValueError:
+                    return None
+        elif char is None:
+            return None
+        elif char == ("'" if mode == 1 else '"'):
+            text = ''.join(buf)
+            try:
+                value = parse_number(text) if mode == 1 else text
+            except ValueError:
+                return None
+            return mode, value, wrap(cx + dx, max_width), wrap(cy + dy, max_height), tuple(cells)
+        buf.append(char)
+
+
+def find_live_cell(program, x, y, t, dx, dy):
+    # follow the path of pc from x, y in tier t, to the first cell which does something when mode = 0.
+    # returns (x, y, n) of that cell, where n is the number of cells passed on the way (x, y included), or None
+    # if there is no such cell on the path (pc would loop around it forever)
+    rows = program.grids[t]
+    max_width, max_height = program.max_width, program.max_height
+    n = 0
+    cx, cy = x, y
+    while True:
+        n += 1
+        cx, cy = wrap(cx + dx, max_width), wrap(cy + dy, max_height)
+        if rows[cy][cx][1] is not None:
+            return cx, cy, n
+        if (cx, cy) == (x, y):
+            return None
+
+
+# ------------------------------------------------TRACE CACHE---------------------------------------------------------
+def arithmetic_source(symbol, a='a', b='b') -> list:
+    # source for an arithmetic instruction. a and b are the values of stack[sp] and stack[sp - 1], read from the
+    # stack as a and b unless they are given as constants (numbers known when the trace is compiled).
+    # numbers are operated on inline, anything else goes through the typed dispatch table
+    py_symbol = '//' if symbol == '\\' else symbol
+    lines = [f'{name} = stack[{index}]' for name, index in ((a, 'sp'), (b, 'sp - 1')) if name in ('a', 'b')]
+    checks = ' and '.join(f'type({name}) in NUMERIC' for name in (a, b) if name in ('a', 'b'))
+    if checks:
+        lines.append(f'r = {a} {py_symbol} {b} if {checks} else vm.operate({py_symbol!r}, {a}, {b})')
+    else:
+        lines.append(f'r = {a} {py_symbol} {b}')
+    return lines + ['stack[stack.top(sp) + 1] = r', 'ts = 0']
+
+
+# traces are compiled to python source working on local copies of sp, stack and ts, which are written back to the vm
+# when the trace ends. each entry is the source for the instruction when mode = 0
+trace_source = {
+    '[': ['sp += 1'],
+    ']': ['sp -= 1'],
+    '~': ['stack[stack.top(sp) + 1] = ts', 'ts = 0'],
+    '(': ['ts = stack[sp]'],
+    ')': ['stack[sp] = ts'],
+    ',': ['ts = sp'],
+    '!': ['ts = stack[sp]', 'stack[sp] = 0 if ts else 1'],
+    '`': ['ts = stack[sp]', 'stack[sp] = randint(0, 1)'],
+    ':': ['ts = stack[sp]', 'if sp == stack.top(sp):', '    stack.pop(sp)', 'else:', '    stack.remove(sp)'],
+    '$': ['top = stack.top(sp)', 'ts = stack[top]', 'stack.pop(top)'],
+    '{': ['v = stack[sp]', "vm.write(v.replace('\\\\n', '\\n') if type(v) is str else str(v))"],
+    '}': ['stack[sp] = get_input_type(vm.read())'],
+    '#': ['vm.prog_over = True'],
+}
+for symbol in ('+', '-', '*', '/', '%', '&', '|', '\\'):
+    trace_source[symbol] = arithmetic_source(symbol)
+# conditions for the instructions which skip the next instruction on the current path
+trace_skips = {'=': 'stack[sp] == 0', '?': 'stack[sp] > stack[sp - 1]'}
+FOLD_ARITHMETIC = ('+', '-', '*', '/', '%', '&', '|', '\\')
+FOLD_MAX_STRING = 256  # longest string result of arithmetic that is kept as a constant in a trace
+
+
+SP_CHANGE = re.compile(r'sp ([+-])= (\d+)')
+PURE = re.compile(r'_k\d+|\d+|sp|ts')  # source which reads nothing from the stack, and cannot raise
+
+
+def peephole(body, origins=None) -> list:
+    # fuse neighbouring lines of trace source into fewer operations, with exactly the same effect on sp, ts and the
+    # stack (including the stack cells stored by being read, see TierStack). if origins (the cell each line of body
+    # is for, see compile_trace) is given, it is changed to the cell each line returned is for:
+    #   sp += a, sp += b                          -> sp += a + b, or nothing if they cancel out ([[[, ]] or [])
+    #   ts = x, ts = y                            -> ts = y, as x is evicted unseen ((: or ~()
+    #   stack[sp] = x, ts = stack[sp]             -> stack[sp] = x, ts = x, or nothing for x = ts ()( or )')
+    #   stack[sp] = x, [ts = y,] stack[sp] = z    -> [ts = y,] stack[sp] = z (one literal after another)
+    # x, y and z are PURE, other than the y in ts = y, x (y is then stack[sp]). lines in blocks (if/else) are
+    # indented, so they never match. a fused line is for the cell of the last line fused into it
+    out, kept = [], []  # kept is the origin of each line of out
+    for line, origin in zip(body, origins if origins is not None else [None] * len(body)):
+        target, _, value = line.partition(' = ')
+        match = SP_CHANGE.fullmatch(line)
+        if match and out and SP_CHANGE.fullmatch(out[-1]):
+            last = SP_CHANGE.fullmatch(out.pop())
+            kept.pop()
+            n = int(last[2]) * (1 if last[1] == '+' else -1) + int(match[2]) * (1 if match[1] == '+' else -1)
+            if n:
+                out.append(f"sp {'+' if n > 0 else '-'}= {abs(n)}")
+                kept.append(origin)
+            continue
+        if target == 'ts' and value == 'stack[sp]' and out and out[-1].startswith('stack[sp] = ') and \
+                PURE.fullmatch(out[-1][12:]):
+            if out[-1][12:] == 'ts':
+                continue
+            line, value = f'ts = {out[-1][12:]}', out[-1][12:]
+        if target == 'ts' and (PURE.fullmatch(value) or value == 'stack[sp]') and value != 'ts' and out and \
+                out[-1].startswith('ts = ') and (PURE.fullmatch(out[-1][5:]) or out[-1][5:] == value):
+            out[-1], kept[-1] = line, origin
+            continue
+        if target == 'stack[sp]' and PURE.fullmatch(value):
+            if out and out[-1].startswith('stack[sp] = ') and PURE.fullmatch(out[-1][12:]):
+                out.pop()
+                kept.pop()
+            elif len(out) > 1 and out[-2].startswith('stack[sp] = ') and PURE.fullmatch(out[-2][12:]) and \
+                    out[-1].startswith('ts = ') and PURE.fullmatch(out[-1][5:]):
+                del out[-2], kept[-2]
+                if len(out) > 1 and out[-2] == 'ts = stack[sp]':
+                    del out[-2], kept[-2]  # the cell read is stored again by this line, and the value read is evicted
+        out.append(line)
+        kept.append(origin)
+    if origins is not None:
+        origins[:] = kept
+    return out
+
+
+def wrap(v, v_max) -> int:
+    # pc wraps around the edge of the tier, the same way as TierVM.advance_pc
+    return 0 if v > v_max else v_max if v < 0 else v
+
+
+def fold_arithmetic(char, a, b):
+    # the result of an arithmetic instruction on values known when a trace is compiled, or None if it cannot be
+    # worked out ahead of time (the instruction raises, or the result is a long string not worth keeping)
+    func = arithmetic_ops['//' if char == '\\' else char].get((type(a), type(b)))
+    if func is None:
+        return None
+    if char == '*' and str in (type(a), type(b)) and len(a if type(a) is str else b) * (b if type(a) is str else a) \
+            > FOLD_MAX_STRING:
+        return None
+    try:
+        value = func(a, b)
+    except (ArithmeticError, TypeError, ValueError):
+        return None
+    return None if isinstance(value, str) and len(value) > FOLD_MAX_STRING else value
+
+
+def fold_skip(char, known, sp_off):
+    # whether a = or ? skips the next cell, if the stack values it tests are known. None if they are not
+    if char == '=':
+        return known[sp_off] == 0 if sp_off in known else None
+    if sp_off not in known or sp_off - 1 not in known:
+        return None
+    try:
+        return known[sp_off] > known[sp_off - 1]
+    except TypeError:
+        return None
+
+
+def compile_trace(program, x, y, t, dx, dy, stops=None, folds=None):
+    # record the cells from an entry state (pc, velocity, mode = 0) up to the next control-flow point or wrap,
+    # and compile the whole sequence into a single python function. literals are read statically while recording.
+    # the trace also ends before any (x, y) in stops, other than the one it starts at (used for breakpoints).
+    # stack cells set by literals in the trace are tracked, so that arithmetic on them is done while compiling,
+    # and = or ? testing them follow the one path they can take. each of these is added to folds, if given.
+    # if a cell raises, the vm is left as running the trace one cell at a time would have left it (see
+    # trace_failed). returns the function, and the number of steps (cells executed) it is equivalent to
+    body, consts = [], []
+    n_steps = 0
+    end = []  # source which moves pc on once the trace is finished
+    origins, origin = [], None  # (steps, x, y) of the cell each line of body is for
+    t_mode, buf, jump_from = 0, [], None
+    known, sp_off = {}, 0  # sp - sp at the start of the trace : value of the stack cells known while compiling
+    rows = program.grids[t]
+    max_width, max_height = program.max_width, program.max_height
+
+    def const(v) -> str:
+        consts.append(v)
+        return f'_k{len(consts) - 1}'
+
+    while True:
+        if len(body) > len(origins):
+            origins += [origin] * (len(body) - len(origins))
+        if stops and n_steps and (x, y) in stops:
+            end.append(f'vm.x, vm.y = {x}, {y}')
+            break
+        char, func, arg, ends_jump = rows[y][x]
+        n_steps += 1
+        origin = (n_steps, x, y)
+        stop = False
+        if t_mode == 0:
+            if func is None:
+                pass  # NOP or blank space
+            elif char in FOLD_ARITHMETIC and (sp_off in known or sp_off - 1 in known):
+                a, b = known.get(sp_off), known.get(sp_off - 1)
+                value = fold_arithmetic(char, a, b) if sp_off in known and sp_off - 1 in known else None
+                if value is None:
+                    # numbers stored by a literal are used as constants, and are not checked for their type
+                    body += arithmetic_source(char, const(a) if type(a) in NUMERIC else 'a',
+                                              const(b) if type(b) in NUMERIC else 'b')
+                else:
+                    body += [f'stack[stack.top(sp) + 1] = {const(value)}', 'ts = 0']
+                    if folds is not None:
+                        folds.append((t, x, y, f'{char} of {a!r} and {b!r} folded to {value!r}'))
+            elif char == '{' and sp_off in known:
+                # printing a number or string stored by a literal (e.g. "text"{), so the text is known
+                v = known[sp_off]
+                text = v.replace('\\n', '\n') if type(v) is str else str(v)
+                body.append(f'vm.write({const(text)})')
+            elif char in CONCURRENT_OPS:
+                # forks and messages are left to step(), see run_concurrent
+                end.append(f'vm.x, vm.y = {x}, {y}')
+                n_steps -= 1
+                break
+            elif char in trace_source:
+                body += trace_source[char]
+                stop = char == '#'
+                # keep track of what is known about the stack. pushes (~ and arithmetic) go above every known cell
+                if char in '[]':
+                    sp_off += 1 if char == '[' else -1
+                elif char in ')}`':
+                    known.pop(sp_off, None)
+                elif char == '!' and sp_off in known:
+                    known[sp_off] = 1 if not known[sp_off] else 0
+                elif char in ':$':
+                    known.clear()  # cells above sp move down, or the top of the stack is popped
+            elif char in '^_<>':
+                dx, dy = arg
+                end.append(f'vm.dx, vm.dy = {dx}, {dy}')
+                stop = True
+            elif char in trace_skips:
+                skip = fold_skip(char, known, sp_off)
+                if skip is None:
+                    # the skip depends on the stack, so finish with both possible positions of pc
+                    end += [f'if {trace_skips[char]}:',
+                            f'    vm.x, vm.y = {wrap(x + 2 * dx, max_width)}, {wrap(y + 2 * dy, max_height)}',
+                            'else:',
+                            f'    vm.x, vm.y = {wrap(x + dx, max_width)}, {wrap(y + dy, max_height)}']
+                    break
+                if folds is not None:
+                    folds.append((t, x, y, f"{char} always {'skips' if skip else 'continues'}"))
+                if skip:
+                    # move over the next cell, without wrapping (the same as check_zero and compare)
+                    x, y = x + dx, y + dy
+            elif char == "'":
+                t_mode, buf = 1, []
+            elif char == '"':
+                t_mode, buf = 2, []
+            elif char == '@':
+                t_mode, buf, jump_from = 3, [], (x, y)
+        elif t_mode in (1, 2):
+            if char is None:
+                # leave blank space inside a literal to step(), which raises exactly as before
+                end.append(f'vm.x, vm.y = {x}, {y}')
+                n_steps -= 1
+                break
+            if char == ("'" if t_mode == 1 else '"'):
+                text = ''.join(buf)
+                if t_mode == 1:
+                    try:
+                        known[sp_off] = parse_number(text)
+                        value = const(known[sp_off])
+                    except ValueError:
+                        # not a number, so raise when (and if) the trace is run
+                        known.pop(sp_off, None)
+                        value = f'parse_number({const(text)})'
+                else:
+                    known[sp_off] = text
+                    value = const(text)
+                body += ['ts = stack[sp]', f'stack[sp] = {value}']
+                t_mode = 0
+            else:
+                buf.append(char)
+        else:
+            if not ends_jump:
+                buf.append(char)
+            else:
+                # pc moves to the position of the @ sign in the target tier
+                text = ''.join(buf)
+                try:
+                    target = int(text)
+                except ValueError:
+                    target = f'int({const(text)})'
+                end += [f'vm.x, vm.y = {jump_from[0]}, {jump_from[1]}', f'vm.enter_tier({target})']
+                origin = (n_steps, *jump_from)  # pc is left at the @ sign if the jump raises
+                t_mode = 0
+                break
+
+        # add velocity, the same way as advance_pc
+        nx, ny = wrap(x + dx, max_width), wrap(y + dy, max_height)
+        if stop or (nx, ny) != (x + dx, y + dy):
+            end.append(f'vm.x, vm.y = {nx}, {ny}')
+            break
+        x, y = nx, ny
+
+    origins += [origin] * (len(body) - len(origins))
+    if t_mode:
+        # trace stopped in the middle of a literal, hand the partially read literal over to step()
+        end += [f'vm.mode = {t_mode}', f'vm.literal = {const(buf)}[:]']
+        if t_mode == 3:
+            end.append(f'vm.jump_pos = {jump_from}')
+
+    body = peephole(body, origins)
+    # the cell each line of the trace is for, by line number (see trace_failed). the lines after the body can only
+    # raise at the last cell (a skip or a jump)
+    cells = const(tuple([None] * TRACE_FIRST_LINE + origins + [origin] * (1 + len(end))))
+    src = '\n'.join([f"def make_trace({', '.join(f'_k{i}' for i in range(len(consts)))}):",
+                     f'    def trace(vm, _cells={cells}):',
+                     '        sp, stack, ts = vm.sp, vm.stack, vm.ts'] +
+                    [f'        {line}' for line in body] +
+                    ['        vm.sp, vm.ts = sp, ts'] +
+                    [f'        {line}' for line in end] +
+                    ['    return trace'])
+    namespace = {}
+    exec(compile(src, TRACE_FILE, 'exec'), globals(), namespace)
+    return namespace['make_trace'](*consts), n_steps
+
+
+TRACE_FILE = '<trace>'  # file name of the source made by compile_trace, to find traces in tracebacks
+TRACE_FIRST_LINE = 4  # line number of the first line of the body of a trace, in that source
+
+
+def trace_failed(vm, traceback):
+    # put the vm into the state running the cells of a trace one at a time would have left it in, if the exception
+    # with this traceback was raised by a cell of a trace. a trace only writes sp and ts back to the vm, and counts
+    # its steps, once it has finished, but every cell before the one which raised has already changed the stack. so
+    # sp and ts are taken from the trace's own copies, and that cell (_cells, by the line which raised) is counted
+    # as run with pc left on it, as step() does. this costs nothing unless a trace raises
+    failed = None
+    while traceback is not None:
+        if traceback.tb_frame.f_code.co_filename == TRACE_FILE:
+            failed = traceback
+        traceback = traceback.tb_next
+    if failed is None:
+        return
+    values = failed.tb_frame.f_locals
+    steps, x, y = values['_cells'][failed.tb_lineno]
+    vm.sp, vm.ts = values['sp'], values['ts']
+    vm.steps += steps
+    vm.x, vm.y = x, y
+
+
+# ----------------------------------------------STATIC ANALYSIS-------------------------------------------------------
+class Analysis:
+    # every state (pc, velocity) which pc can reach from the start of 0.tier, found without running the program by
+    # following both paths of each = and ?, and every jump. any cell outside of these can never be run or read.
+    # problems which raise if pc reaches them are recorded, and the traces starting at each reachable state are
+    # compiled (warming Program.traces), recording the operations folded into constants by compile_trace.
+    # tiers pc can never reach are not decoded. start is the state (x, y, t, dx, dy) to follow pc from instead
+    # of the start of the program, and both pcs are followed from every Y of a concurrent program. jumps into
+    # exit_tier, if given, are not followed (see CallCache)
+    __slots__ = ('program', 'exit_tier', 'n_states', 'entries', 'cells', 'errors', 'unknown', 'folds',
+                 'deterministic', 'stack_tiers', 'receives', 'pure')
+
+    def __init__(self, program, start=None, exit_tier=None):
+        self.program = program
+        self.exit_tier = exit_tier
+        self.cells = {}  # tier position : set of (x, y) of every cell pc runs or reads
+        self.errors = []  # (t, x, y, message) of cells which raise when pc reaches them
+        self.unknown = []  # (t, x, y, char) of characters which are not instructions, and are run as NOPs
+        self.deterministic = True  # False if pc can reach a ` or }, so the program may not do the same thing twice
+        self.stack_tiers = set()  # positions of the tiers whose stacks pc can read or write
+        self.receives = False  # whether pc can reach a } or an R
+        self.pure = True  # False if pc can reach any of IMPURE_OPS
+        folds = []
+        if start is None:
+            start = (0, 0, program.tier_index[0], 1, 0)
+        states, entries = {start}, [start]  # entries are the states traces start from
+        queue = deque(entries)
+        max_width, max_height = program.max_width, program.max_height
+        while queue:
+            x, y, t, dx, dy = queue.popleft()
+            cells = self.cells.get(t)
+            if cells is None:
+                cells = self.cells[t] = set()
+            cells.add((x, y))
+            char, func, arg, _ = program.grids[t][y][x]
+            nexts, entry = None, False  # (state, whether a trace starts there) of the states pc moves on to
+            if func is not None:
+                if char not in NO_STACK_OPS:
+                    self.stack_tiers.add(t)
+                if char in IMPURE_OPS:
+                    self.pure = False
+            if func is None:
+                if char is not None and char not in parse_options and not nop_chars.search(char):
+                    self.unknown.append((t, x, y, char))
+            elif char == '#':
+                continue
+            elif char in '`}':
+                self.deterministic = False
+                self.receives = self.receives or char == '}'
+            elif char == 'R':
+                self.receives = True
+            elif char in LITERAL_MODES or char in 'YS':
+                nexts = self.read_literal(x, y, t, dx, dy)
+                if not nexts:
+                    continue
+            elif char in '^_<>':
+                dx, dy = arg
+                entry = True
+            elif char in trace_skips:
+                # the path where the next cell is skipped. both paths start a trace
+                skip_x, skip_y = wrap(x + 2 * dx, max_width), wrap(y + 2 * dy, max_height)
+                entry = True
+            if nexts is None:
+                nx, ny = wrap(x + dx, max_width), wrap(y + dy, max_height)
+                nexts = [((nx, ny, t, dx, dy), entry or (nx, ny) != (x + dx, y + dy))]
+                if char in trace_skips:
+                    nexts.append(((skip_x, skip_y, t, dx, dy), True))
+            for state, entry in nexts:
+                if entry:
+                    entries.append(state)
+                if state not in states:
+                    states.add(state)
+                    queue.append(state)
+        self.n_states = len(states)
+        self.entries = list(dict.fromkeys(entries))
+        traces = program.traces
+        for key in self.entries:
+            if key not in traces:
+                traces[key] = compile_trace(program, *key, folds=folds)
+        self.folds = list(dict.fromkeys(folds))  # traces running through the same cell may fold it more than once
+
+    def read_literal(self, x, y, t, dx, dy) -> list:
+        # read the literal (or the address of a Y or S) which starts at x, y the same way step() would, adding every
+        # cell read to cells. returns a list of (state, whether a trace starts there) of where pc moves on to (and
+        # where the pc forked by a Y starts), which is empty if reading it raises. a number or string with blank
+        # space in it only raises once it is closed, so the cells up to its closing quote (at the latest, the one it
+        # opens with, once pc wraps back around to it) are read too
+        program = self.program
+        rows, cells = program.grids[t], self.cells[t]
+        max_width, max_height = program.max_width, program.max_height
+        op = rows[y][x][0]
+        mode = LITERAL_MODES.get(op, 3)
+        buf = []
+        cx, cy, wrapped, blank = x, y, False, False
+        while True:
+            nx, ny = wrap(cx + dx, max_width), wrap(cy + dy, max_height)
+            wrapped = wrapped or (nx, ny) != (cx + dx, cy + dy)
+            cx, cy = nx, ny
+            char, _, _, ends_jump = rows[cy][cx]
+            cells.add((cx, cy))
+            if mode == 3:
+                if ends_jump:
+                    text = ''.join(buf)
+                    try:
+                        target = int(text)
+                    except ValueError:
+                        self.errors.append((t, x, y, f'jump address {text!r} is not a number'))
+                        return []
+                    if target not in program.tier_index:
+                        self.errors.append((t, x, y, f'jump to {target}.tier, which does not exist'))
+                        return []
+                    landing = (x, y, program.tier_index[target], dx, dy), True  # on the @ (or Y) sign
+                    if op == '@':
+                        return [landing] if landing[0][2] != self.exit_tier else []
+                    # pc carries on from the cell which ends the address
+                    after = (cx, cy, t, dx, dy), True
+                    return [after, landing] if op == 'Y' else [after]
+            elif char is None:
+                if not blank:
+                    self.errors.append((t, cx, cy, f"blank space inside a {'number' if mode == 1 else 'string'}"))
+                blank = True
+            elif char == ("'" if mode == 1 else '"'):
+                if blank:
+                    return []
+                if mode == 1:
+                    try:
+                        parse_number(''.join(buf))
+                    except ValueError:
+                        self.errors.append((t, x, y, f"{''.join(buf)!r} is not a number"))
+                        return []
+                nx, ny = wrap(cx + dx, max_width), wrap(cy + dy, max_height)
+                return [((nx, ny, t, dx, dy), wrapped or (nx, ny) != (cx + dx, cy + dy))]
+            buf.append(char)
+
+    def unreachable(self) -> dict:
+        # tier position : (x, y) of the cells in the tier which are not blank space, and are never run or read.
+        # tiers which are never reached are left out, as they are not decoded
+        cells = {}
+        for t, reached in self.cells.items():
+            cells[t] = [(x, y) for y, row in enumerate(self.program.grids[t]) for x, cell in enumerate(row)
+                        if cell[0] not in (None, ' ') and (x, y) not in reached]
+        return cells
+
+    def report(self) -> str:
+        program = self.program
+        names = program.tier_list
+        out = [f'{self.n_states} reachable states (pc, velocity) in {len(self.cells)} of {len(names)} tiers']
+        skipped = [f'{names[t]}.tier' for t in range(len(names)) if t not in self.cells]
+        if skipped:
+            out.append(f"unreachable tiers, never decoded: {', '.join(skipped)}")
+        for t, cells in self.unreachable().items():
+            if cells:
+                shown = ' '.join(f'[{x}, {y}]' for x, y in sorted(cells, key=lambda c: (c[1], c[0]))[:10])
+                more = ' ...' if len(cells) > 10 else ''
+                out.append(f'{names[t]}.tier: {len(cells)} unreachable cells {shown}{more}')
+        for heading, items in (('raise if reached', self.errors),
+                               ('unknown characters, run as NOPs', [(t, x, y, repr(c)) for t, x, y, c in self.unknown]),
+                               ('folded', self.folds)):
+            if items:
+                out.append(f'{heading}:')
+                out += [f'  pc=[{x}, {y}, {names[t]}] {text}' for t, x, y, text in sorted(items)]
+        return '\n'.join(out)
+
+    def optimize(self) -> int:
+        # blank out every cell which is never run or read, so that the debugger and profiler only show live code.
+        # returns the number of cells removed
+        removed = 0
+        for t, cells in self.unreachable().items():
+            grid = self.program.grids[t]
+            for x, y in cells:
+                grid[y][x] = BLANK_CELL
+            removed += len(cells)
+        return removed
+
+
+# ------------------------------------------------CONCURRENCY---------------------------------------------------------
+# a program loaded with concurrent=True can run any number of pcs at once. three letters, which are otherwise NOPs,
+# become instructions:
+#   Y<tier> forks a new pc at the position of the Y sign in the tier (the same as @). the new pc starts with the same
+#           velocity, and a copy of ts and of the sp of every tier, but has its own from then on. the pc which forked
+#           carries on from the cell which ends the address
+#   S<tier> sends stack[sp] to the channel of the tier
+#   R       moves the oldest message sent to the current tier into stack[sp], evicting its value to ts. pc waits at
+#           the R until there is a message
+# every pc shares the stacks of every tier. # ends only the pc which runs it, and the program ends once every pc has
+# ended. if every pc left is waiting at an R, the program raises
+CONCURRENT_SLICE = 1000  # number of steps each pc runs before the next one takes its turn
+CONCURRENT_OPS = 'YSR'
+NO_STACK_OPS = '^_<>@#,[]Y'  # instructions which never read or write the stack (see Analysis.stack_tiers)
+
+
+class Pointer:
+    # the state of a pc of a concurrent run which is not the one running (see TierVM.park)
+    __slots__ = ('x', 'y', 't', 'dx', 'dy', 'ts', 'sps', 'mode', 'literal', 'jump_pos')
+
+    def __init__(self, x, y, t, dx, dy, ts, sps, mode=0, literal=None, jump_pos=(0, 0)):
+        self.x, self.y, self.t, self.dx, self.dy = x, y, t, dx, dy
+        self.ts = ts
+        self.sps = sps
+        self.mode = mode
+        self.literal = [] if literal is None else literal
+        self.jump_pos = jump_pos
+
+
+class PointerPool:
+    # worker processes for the pcs of a concurrent run which can run on their own. a pc is handed over when it is
+    # forked, if Analysis from the state of the pc finds that it can never reach an R or a }, and never use the stack
+    # of a tier which any other pc (or any pc they fork) can use. the pc only needs the stacks of its own tiers, and
+    # nothing it does can change what the others do, other than the output and messages taken in once it ends
+    __slots__ = ('program', 'executor', 'pending', 'in_order', 'analyses', 'tiers')
+
+    def __init__(self, program, workers, in_order):
+        self.program = program
+        self.executor = ProcessPoolExecutor(workers, initializer=init_pointer_worker, initargs=(program,))
+        self.pending = deque()  # futures of the pcs handed over, in the order they were forked
+        self.in_order = in_order
+        self.analyses = {}  # (x, y, t, dx, dy) : the Analysis from that state
+        self.tiers = set()  # positions of the tiers whose stacks the pcs handed over can use
+
+    def analysis(self, pc):
+        key = (pc.x, pc.y, pc.t, pc.dx, pc.dy)
+        analysis = self.analyses.get(key)
+        if analysis is None:
+            analysis = self.analyses[key] = Analysis(self.program, key)
+        return analysis
+
+    def submit(self, vm, pc, others) -> bool:
+        # hand pc to a worker, if it can run on its own. others are the Pointers left running in vm.
+        # returns False if it can not
+        if any(other.mode for other in others):
+            return False  # a pc in the middle of a literal is not in a state Analysis can start from
+        analysis = self.analysis(pc)
+        tiers = analysis.stack_tiers
+        if analysis.receives or tiers & self.tiers or any(tiers & self.analysis(other).stack_tiers
+                                                          for other in others):
+            return False
+        self.tiers |= tiers
+        stacks = {t: vm.stacks[t].items() for t in tiers}
+        timeout = None if vm.deadline is None else vm.deadline - monotonic()
+        self.pending.append(self.executor.submit(run_pointer, pc, stacks, vm.max_steps - vm.steps, timeout))
+        return True
+
+    def take(self, block) -> list:
+        # results of the pcs handed over which have ended. if block is set, waits for at least one to end.
+        # with in_order, only the oldest is ever taken
+        pending = self.pending
+        if self.in_order:
+            return [pending.popleft().result()] if block or pending[0].done() else []
+        if block:
+            wait(pending, return_when=FIRST_COMPLETED)
+        done = [future for future in pending if future.done()]
+        for future in done:
+            pending.remove(future)
+        return [future.result() for future in done]
+
+    def close(self, finished):
+        # if the run did not finish, pcs still running in the workers are left to end on their own
+        self.executor.shutdown(wait=finished, cancel_futures=True)
+
+
+pointer_program = None  # program run by each worker process of a PointerPool
+
+
+def init_pointer_worker(program):
+    global pointer_program
+    pointer_program = program
+
+
+def run_pointer(pc, stacks, max_steps, timeout) -> dict:
+    # run a pc handed over by a concurrent run, with every pc it forks, until they have all ended. stacks are the
+    # items of the stack of each tier it can use. errors are reported in the result rather than raised
+    vm = TierVM(pointer_program)
+    for t, items in stacks.items():
+        stack = vm.stacks[t]
+        for i, v in items:
+            stack[i] = v
+    vm.unpark(pc)
+    result = {'status': 'ok', 'error': None}
+    try:
+        vm.run_on(None, None, True, max_steps, timeout, None, FLUSH_SIZE, False, None, CHECKPOINT_STEPS, False, None)
+    except LimitExceeded as e:
+        result['status'], result['error'] = e.kind, str(e)
+    except Exception as e:
+        result['status'], result['error'] = 'error', f'{type(e).__name__}: {e}'
+    result['output'] = vm.output.getvalue()
+    result['messages'] = [(t, list(channel)) for t, channel in vm.channels.items() if channel]
+    result['steps'] = vm.steps
+    return result
+
+
+# ------------------------------------------------BATCH RUNS----------------------------------------------------------
+# an input set is a dict of {"ts": starting value of ts, "stdin": lines read by }, "max_steps": ..., "timeout": ...,
+# "detect_cycles": ...} where every key is optional. a string ts is read the same way as the -ts flag (e.g. "'123'"
+# is the number 123). runs can also all be started from the same snapshot, so that the work done before it is only
+# done once
+batch_vm = None  # vm used by each worker process of a batch
+batch_snapshot = None  # snapshot each run of a worker process starts from, if any
+
+
+def run_input_set(vm, index, input_set, max_steps=None, timeout=None, detect_cycles=False, snapshot=None) -> dict:
+    # run a program for one input set, from the start or from a snapshot. errors are reported in the result rather
+    # than raised
+    ts = input_set.get('ts', 0)
+    if isinstance(ts, str):
+        ts = get_input_type(ts)
+    result = {'index': index, 'status': 'ok'}
+    options = {'stdin': input_set.get('stdin', ()), 'max_steps': input_set.get('max_steps', max_steps),
+               'timeout': input_set.get('timeout', timeout),
+               'detect_cycles': input_set.get('detect_cycles', detect_cycles)}
+    try:
+        if snapshot is None:
+            vm.run(ts=ts, **options)
+        else:
+            vm.resume(snapshot, **options)
+    except LimitExceeded as e:
+        result['status'] = e.kind
+        result['error'] = str(e)
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = f'{type(e).__name__}: {e}'
+    result['output'] = vm.output.getvalue()  # captured, including the output of a run which raised
+    result['steps'] = vm.steps
+    return result
+
+
+def init_batch_worker(program, snapshot):
+    global batch_vm, batch_snapshot
+    batch_vm = TierVM(program)
+    batch_snapshot = snapshot
+
+
+def batch_worker(index, input_set, max_steps, timeout, detect_cycles) -> dict:
+    return run_input_set(batch_vm, index, input_set, max_steps, timeout, detect_cycles, batch_snapshot)
+
+
+def run_batch(program, input_sets, workers=None, max_steps=None, timeout=None, detect_cycles=False, snapshot=None):
+    # run a program (a Program, or the directory of one) once for every input set, over a pool of worker processes.
+    # the program is only read and decoded once. results are yielded in the same order as input_sets. if a snapshot
+    # is given, every run is resumed from it instead of starting from the start of the program
+    if not isinstance(program, Program):
+        program = Program(program)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        vm = TierVM(program)
+        for index, input_set in enumerate(input_sets):
+            yield run_input_set(vm, index, input_set, max_steps, timeout, detect_cycles, snapshot)
         return
-    # else if sp is somewhere in the middle of the stack,
-    # move all elements with higher indexes down one, and then
-    for i in range(sp, top):
-        stack[i] = stack[i+1]
-
-    # now remove top element. new top can be found at top - 1, if top-1 exists
-    stack.pop(top)
-
-
-def store_num_sp():
-    global mode, num_to_store, ts
-    if not mode:
-        mode = 1
-    elif mode is 1:
-        mode = 0
-        sp, stack = get_sp_stack()
-        # stack_top = get_stack_top(sp, stack)
-        ts = stack[sp]  # store evicted
-
-        str_version = r''.join(num_to_store)
-        num_version = int(str_version) if str_version.rfind('.') is -1 else float(str_version)
-
-        stack[sp] = num_version  # join into string
-        num_to_store = []
-
-
-def store_str_sp():
-    global mode, string_to_store, ts
-    # again, this must be done with checks as we need "'" to be valid (result in storing string ' at sp)
-    if not mode:
-        mode = 2
-    elif mode is 2:
-        mode = 0
-        # replace on top of stack
-        sp, stack = get_sp_stack()
-        # stack_top = get_stack_top(sp, stack)
-        ts = stack[sp]  # store evicted
-        stack[sp] = r''.join(string_to_store)  # join into string
-        string_to_store = []
-
-
-def advance_pc():
-    global pc, velocity, show_info, window, lines_dict, VDB
-
-    if show_info:
-        view_debug()
-    if visual_dbg:
-        VDB.step_through(window, lines_dict)
-
-    pc[0] += velocity[0]
-    pc[1] += velocity[1]
-    # print(f"updated pc to {pc}")
-
-    if pc[0] > max_width:
-        pc[0] = 0
-    elif pc[0] < 0:
-        pc[0] = max_width
-    if pc[1] > max_height:
-        pc[1] = 0
-    elif pc[1] < 0:
-        pc[1] = max_height
-
-
-def get_index():
-    # place the actual value of sp in ts
-    global ts, pc, gsp_dict
-    ts = gsp_dict[f"{pc[2]}"]
-
-
-def pop_highest():
-    global ts
-    sp, stack = get_sp_stack()
-    # pop the highest item in the stack into ts
-    stack_top = get_stack_top(sp, stack)
-    ts = stack[stack_top]
-    stack.pop(stack_top)
 
+    with ProcessPoolExecutor(workers, initializer=init_batch_worker, initargs=(program, snapshot)) as pool:
+        pending = deque()  # submitted runs, oldest first. limited so that input_sets can be a stream
+        for index, input_set in enumerate(input_sets):
+            pending.append(pool.submit(batch_worker, index, input_set, max_steps, timeout, detect_cycles))
+            if len(pending) >= workers * 4:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def read_input_sets(f):
+    # input sets are read as json, one per line
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+# -----------------------------------------------ASYNC SESSIONS-------------------------------------------------------
+async def run_session(program, reader, writer, max_steps=None, timeout=None, slice_steps=ASYNC_SLICE):
+    # run a program for one connection of a stream server. lines read from the connection are the input of the
+    # program, its output is written back, and the connection is closed when the program ends.
+    # errors are written to the connection rather than raised
+    vm = TierVM(program)
+    try:
+        async for chunk in vm.run_async(stdin=reader, max_steps=max_steps, timeout=timeout, slice_steps=slice_steps):
+            writer.write(chunk.encode('utf-8'))
+            await writer.drain()
+    except ConnectionError:
+        return
+    except Exception as e:
+        writer.write(f'{vm.output.getvalue()}\n{type(e).__name__}: {e}\n'.encode('utf-8'))
+    try:
+        await writer.drain()
+        writer.close()
+        await writer.wait_closed()
+    except ConnectionError:
+        pass
+
+
+async def serve(program, host='127.0.0.1', port=0, max_steps=None, timeout=None, slice_steps=ASYNC_SLICE,
+                backlog=SERVE_BACKLOG):
+    # start a stream server running a program (a Program, or the directory of one) for every connection, all of them
+    # sharing one event loop, and one Program (so traces compiled for one connection are used by every other).
+    # returns the asyncio.Server (port 0 picks a free port, see server.sockets)
+    if not isinstance(program, Program):
+        program = Program(program)
+    return await asyncio.start_server(
+        lambda reader, writer: run_session(program, reader, writer, max_steps, timeout, slice_steps), host, port,
+        backlog=backlog)
+
+
+# --------------------------------------------------DAEMON------------------------------------------------------------
+# a resident interpreter, listening on a unix socket, which keeps the programs it has run loaded (with their traces
+# compiled), so that a run does not pay for starting python, reading and decoding the program every time. each
+# connection sends one request, a line of json such as {"directory": "demos/isPrime", "ts": "'5'", "stdin": ["'7'"]},
+# where every key but directory is optional and read the same as an input set (see BATCH RUNS). without "stdin", the
+# lines sent after the request are the input of the program. output is sent back as it is written, as frames of a
+# DAEMON_FRAME (kind b'o', length) followed by that many bytes of utf-8, and the run ends with a b'e' frame holding
+# its result as json: {"status": "ok" or the kind of LimitExceeded or "error", "error": ..., "steps": ...}.
+# tier_client.py is a client which sends its arguments and stdin, and writes out what comes back
+DAEMON_SOCKET = os.path.expanduser('~/.tier.sock')
+DAEMON_PROGRAMS = 64  # programs each worker of a daemon keeps loaded
+DAEMON_FRAME = struct.Struct('<cI')
+
+
+class ProgramCache:
+    # the last size programs used, by directory and source hash. a program is used again for as long as the size
+    # and mtime of each of its .tier files (and the files there are) stay the same. once they change, the program is
+    # loaded again, and only replaces the one held if the source hash is different too
+    __slots__ = ('size', 'programs', 'signatures', 'hits', 'loads', 'evictions')
+
+    def __init__(self, size=DAEMON_PROGRAMS):
+        self.size = size
+        self.programs = OrderedDict()  # (directory, source hash) : Program, least recently used first
+        self.signatures = {}  # directory : (file_signature of its .tier files, key of its program in programs)
+        self.hits, self.loads, self.evictions = 0, 0, 0
+
+    def get(self, directory) -> Program:
+        directory = format_dir(os.path.abspath(directory))
+        signature = file_signature(find_files(directory))
+        known = self.signatures.get(directory)
+        if known is not None and known[0] == signature and known[1] in self.programs:
+            self.hits += 1
+            self.programs.move_to_end(known[1])
+            return self.programs[known[1]]
+        self.loads += 1
+        program = Program(directory)
+        key = (directory, program.source_hash())
+        self.signatures[directory] = (signature, key)
+        if key in self.programs:
+            program = self.programs[key]  # only touched, so the traces already compiled can still be used
+        else:
+            self.programs[key] = program
+            if known is not None:
+                self.programs.pop(known[1], None)
+        self.programs.move_to_end(key)
+        while len(self.programs) > self.size:
+            (old, _), _ = self.programs.popitem(last=False)
+            self.signatures.pop(old, None)
+            self.evictions += 1
+        return program
+
+
+def write_frame(writer, kind, text):
+    data = text.encode('utf-8', 'surrogatepass')
+    writer.write(DAEMON_FRAME.pack(kind, len(data)) + data)
+
+
+async def run_request(cache, reader, writer, max_steps=None, timeout=None, slice_steps=ASYNC_SLICE):
+    # run one request made to a daemon (see DAEMON). errors are sent back in the result rather than raised
+    result = {'status': 'ok'}
+    vm = None
+    try:
+        request = json.loads(await reader.readline())
+        ts = request.get('ts', 0)
+        if isinstance(ts, str):
+            ts = get_input_type(ts)
+        vm = TierVM(cache.get(request['directory']))
+        async for chunk in vm.run_async(stdin=request.get('stdin', reader), ts=ts,
+                                        max_steps=request.get('max_steps', max_steps),
+                                        timeout=request.get('timeout', timeout), slice_steps=slice_steps):
+            write_frame(writer, b'o', chunk)
+            await writer.drain()
+    except ConnectionError:
+        return
+    except LimitExceeded as e:
+        result['status'] = e.kind
+        result['error'] = str(e)
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = f'{type(e).__name__}: {e}'
+    except asyncio.CancelledError:
+        result['status'] = 'error'
+        result['error'] = 'the daemon was stopped'
+    try:
+        if vm is not None:
+            if vm.output is not None and vm.output.size:
+                write_frame(writer, b'o', vm.output.take())  # written by a run which raised
+            result['steps'] = vm.steps
+        write_frame(writer, b'e', json.dumps(result))
+        await writer.drain()
+        writer.close()
+        await writer.wait_closed()
+    except ConnectionError:
+        pass
+
+
+async def daemon_worker(sock, programs, max_steps, timeout, slice_steps):
+    # answer requests made on a listening socket, until the process is sent SIGTERM
+    cache = ProgramCache(programs)
+    server = await asyncio.start_unix_server(
+        lambda reader, writer: run_request(cache, reader, writer, max_steps, timeout, slice_steps), sock=sock)
+    serving = asyncio.ensure_future(server.serve_forever())
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, serving.cancel)
+    try:
+        await serving
+    except asyncio.CancelledError:
+        pass
+
+
+def run_daemon(path=DAEMON_SOCKET, workers=None, programs=DAEMON_PROGRAMS, max_steps=None, timeout=None,
+               slice_steps=ASYNC_SLICE, ready=None):
+    # listen on a unix socket until interrupted, answering requests (see DAEMON) in a pool of worker processes which
+    # each accept connections from the same socket, and each keep their own ProgramCache. with one worker, requests
+    # are answered in this process. the runs made by one worker share its event loop (see run_async). ready is
+    # called with the socket once it is listening
+    workers = workers or os.cpu_count() or 1
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+            raise Exception(f'a daemon is already listening on {path}')
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.remove(path)  # left behind by a daemon which did not shut down
+        finally:
+            probe.close()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.listen(SERVE_BACKLOG)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())  # so that the socket is still removed
+    if ready is not None:
+        ready(sock)
+    children = set()
+    try:
+        if workers == 1:
+            asyncio.run(daemon_worker(sock, programs, max_steps, timeout, slice_steps))
+            return
+        while True:
+            while len(children) < workers:
+                pid = os.fork()
+                if pid == 0:
+                    try:
+                        asyncio.run(daemon_worker(sock, programs, max_steps, timeout, slice_steps))
+                    finally:
+                        os._exit(0)
+                children.add(pid)
+            children.discard(os.wait()[0])  # a worker which died is replaced
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+        sock.close()
+        os.remove(path)
+
+
+# timestep logic:
+# evaluate current operation (use decorator parsing)
+# advance according to velocity
+parse_options = {  # char : (function, args)
+    '^': (TierVM.change_vel, (0, -1)),
+    '_': (TierVM.change_vel, (0, 1)),
+    '>': (TierVM.change_vel, (1, 0)),
+    '<': (TierVM.change_vel, (-1, 0)),
+    '@': (TierVM.jump, None),
+    '[': (TierVM.change_sp, 1),  # sp += 1
+    ']': (TierVM.change_sp, -1),  # sp -= 1,
+    '~': (TierVM.push_ts, None),
+    '(': (TierVM.copy_ts, None),  # ts = stack[sp]
+    ')': (TierVM.copy_sp, None),  # stack[sp] = ts
+    '#': (TierVM.end_prog, None),
+    '{': (TierVM.print_sp, None),
+    '}': (TierVM.input_sp, None),
+    '+': (TierVM.stack_operate, '+'),  # operator, see arithmetic_ops
+    '-': (TierVM.stack_operate, '-'),
+    '*': (TierVM.stack_operate, '*'),
+    '/': (TierVM.stack_operate, '/'),
+    '%': (TierVM.stack_operate, '%'),
+    '&': (TierVM.stack_operate, '&'),
+    '|': (TierVM.stack_operate, '|'),
+    '\\': (TierVM.stack_operate, '//'),
+    '?': (TierVM.compare, None),
+    '=': (TierVM.check_zero, None),
+    '!': (TierVM.boolean_not, None),
+    '`': (TierVM.bin_random, None),
+    ':': (TierVM.pop_stack, None),
+    '$': (TierVM.pop_highest, None),
+    '\'': (TierVM.store_num_sp, None),
+    "\"": (TierVM.store_str_sp, None),
+    ',': (TierVM.get_index, None)
+}
+
+concurrent_options = {  # parse_options of a concurrent program
+    **parse_options,
+    'Y': (TierVM.jump, None),  # fork, reading the address the same as @
+    'S': (TierVM.jump, None),  # send
+    'R': (TierVM.receive, None)
+}
+
+nop_chars = re.compile('[a-zA-Z0-9.;£ ]')  # non-command chars, ignored unless mode != 0
+BLANK_CELL = (None, None, None, True)  # empty space in a grid. (char, func, arg, ends_jump)
 
 if __name__ == '__main__':
 
@@ -348,26 +3595,24 @@ if __name__ == '__main__':
 
 
         class Debugger:
+            FRAME_TIME = 1 / 60  # with a smaller timestep, the screen is only redrawn once per frame
 
-            def __init__(self):
-                global ts
-                self.prev_vel = [1, 0]
-                self.done_startup = False
-                self.prev_sp = 0
-                self.prev_ts = ts
-                self.prev_stacklen = 0
-                self.prev_tierlen = 0
-                self.prev_tier = 0
-                self.prev_mode = 0
+            def __init__(self, timestep):
+                self.timestep = timestep
+                self.window = None
+                self.drawn_tier = None  # tier whose source is on screen
+                self.drawn_pc = None  # (x, y) of the highlighted cell
+                self.fields = {}  # row : text of each status line on screen, so that only changed lines are redrawn
+                self.last_frame = 0
+                self.help = 'DEBUG - press enter to continue, c to run to the next breakpoint, press other keys to exit'
 
             def create_window(self) -> object:
-                global timestep
                 win = curses.initscr()
                 curses.noecho()
                 curses.curs_set(0)
                 curses.cbreak()     # added to handle destroy()-ing and re-create()-ing the window for input_sp
                 curses.start_color()
-                win.nodelay(not not timestep)
+                win.nodelay(not not self.timestep)
                 # if timestep is 0 then rely on getch to advance debugger. else use timestep to move onwards
                 curses.init_pair(1, curses.COLOR_BLACK, curses.COLOR_RED)  # mode = 0, standard
                 curses.init_pair(2, curses.COLOR_BLACK, curses.COLOR_GREEN)  # mode = 1, reading number
@@ -376,6 +3621,8 @@ if __name__ == '__main__':
 
                 curses.init_pair(5, curses.COLOR_BLACK, curses.COLOR_MAGENTA)  # debug
                 curses.init_pair(6, curses.COLOR_GREEN, curses.COLOR_BLACK)  # debug
+                self.window = win
+                self.drawn_tier = None  # draw everything again
                 return win
 
             def destroy_window(self):
@@ -383,75 +3630,110 @@ if __name__ == '__main__':
                 curses.echo()
                 curses.endwin()
 
-            def step_through(self, cwindow, clines_dict):
-                global pc, prog_over, mode, ts
-                sp, stack = get_sp_stack()
-
-                # use while window.getch() to step through
-                # window.bkgd(' ', curses.color_pair(1) | curses.A_BOLD)
-                if self.prev_tier != pc[2]:
-                    self.done_startup = 0
-                    cwindow.clear()
-                for indx, k in enumerate(clines_dict[f'{pc[2]}']):
-                    if indx == pc[1] and pc[0] >= 0:        # must be >=0 to allow drawing at position
-                        col_start = pc[0]
-                        cwindow.addstr(indx, 0, k[:col_start])
-                        cwindow.addstr(indx, col_start, k[col_start:col_start + 1], curses.color_pair(mode + 1))
-                        cwindow.addstr(indx, col_start + 1, k[col_start + 1:])
-                    else:
-                        cwindow.addstr(indx, 0, k)
-
-                if (self.prev_vel[0] is not velocity[0] and self.prev_vel[1] is not velocity[1]) \
-                        or not self.done_startup:
-                    cwindow.addstr(max_height + 3, 0, f'vel=     ')
-                    cwindow.addstr(max_height + 3, 0, f'vel={velocity[0]},{velocity[1]}')
-                    self.prev_vel = velocity
-
-                if self.prev_mode is not mode or not self.done_startup:  # sp may exceed 255, regularly exceeds -5
-                    cwindow.addstr(max_height + 4, 0, f"mode= ")
-                    cwindow.addstr(max_height + 4, 0, f'mode={mode}')
-                    self.prev_sp = sp
-
-                if self.prev_sp != sp or not self.done_startup:  # sp may exceed 255, regularly exceeds -5
-                    cwindow.addstr(max_height + 5, 0, f"sp={re.sub('[^ ]',' ', str(self.prev_sp))}")
-                    cwindow.addstr(max_height + 5, 0, f'sp={sp}')
-                    self.prev_sp = sp
-
-                if self.prev_ts != ts or not self.done_startup:
-                    cwindow.addstr(max_height + 6, 0, f"ts={re.sub('[^ ]',' ', str(self.prev_ts))}")
-                    cwindow.addstr(max_height + 6, 0, f'ts={ts}')
-                    self.prev_ts = ts
-
-                cwindow.addstr(max_height + 8, 0, "Stack view")
-
-                strstack = []
-                for k, v in sorted(stack.items(), key=lambda x: int(x[0])):
-                    strstack.append(f"[{k}:{str(type(v)).replace('class ','')}: {v}]")
-                strstack = ''.join(strstack)
-                cwindow.addstr(max_height + 9, 0, f"Stack {''.ljust(len(str(self.prev_tier))+20)}"
-                                                  f"{''.ljust(self.prev_stacklen)}")
-                cwindow.addstr(max_height + 9, 0, f"Stack {pc[2]}.tier={''.join(strstack)}", curses.color_pair(6))
-                self.prev_stacklen = len(strstack)
-                self.prev_tier = pc[2]
-
-                if not self.done_startup:
-                    cwindow.addstr(max_height + 2, 0,
-                                   "DEBUG - press enter to continue, press other keys to exit", curses.color_pair(5))
-                    self.done_startup = True
-
-                cwindow.refresh()
+            def read_input(self, prompt='') -> str:
+                # temporarily exit to the console for input
+                self.destroy_window()
+                inp = input(prompt)
+                self.create_window()
+                return inp
+
+            def step_through(self, vm):
+                if self.timestep and self.timestep < self.FRAME_TIME:
+                    # skip frames the terminal would not have time to show
+                    now = monotonic()
+                    if now - self.last_frame < self.FRAME_TIME:
+                        return
+                    self.last_frame = now
+                self.draw(vm)
+
+                cwindow = self.window
                 c = cwindow.getch()  # if timestep is 0, then -1 will be returned if no keys are pressed
-                if c not in (10, -1):
-                    prog_over = True
+                if c == ord('c'):
+                    vm.free_run = True  # run at full speed to the next breakpoint
+                elif c not in (10, -1):
+                    vm.prog_over = True
 
-                if timestep and c is 10:
+                if self.timestep and c == 10:
                     cwindow.nodelay(0)
                     cwindow.getch()  # block until user enters another character
                     cwindow.nodelay(1)
 
+            def draw(self, vm):
+                # only the cells and status lines which have changed since the last step are redrawn
+                cwindow = self.window
+                lines = vm.program.lines[vm.t]
+                max_height = vm.program.max_height
+                if self.drawn_tier != vm.t:
+                    cwindow.clear()
+                    for indx, k in enumerate(lines):
+                        cwindow.addstr(indx, 0, k)
+                    cwindow.addstr(max_height + 2, 0, self.help, curses.color_pair(5))
+                    cwindow.addstr(max_height + 8, 0, "Stack view")
+                    self.drawn_tier, self.drawn_pc, self.fields = vm.t, None, {}
+
+                if self.drawn_pc is not None:
+                    self.draw_cell(lines, *self.drawn_pc, curses.A_NORMAL)
+                self.draw_cell(lines, vm.x, vm.y, curses.color_pair(vm.mode + 1))
+                self.drawn_pc = (vm.x, vm.y)
+
+                self.draw_field(max_height + 3, f'vel={vm.dx},{vm.dy}')
+                self.draw_field(max_height + 4, f'mode={vm.mode}')
+                self.draw_field(max_height + 5, f'sp={vm.sp}')
+                self.draw_field(max_height + 6, f'ts={vm.ts}')
+                # the stack is only formatted as far as there is room for it on the screen
+                rows, cols = cwindow.getmaxyx()
+                room = max((rows - max_height - 9) * cols - 1, 0)
+                text = f'Stack {vm.tier}.tier='
+                for k, v in vm.stack.items():
+                    if len(text) > room:
+                        break
+                    text += f"[{k}:{str(type(v)).replace('class ', '')}: {v}]"
+                self.draw_field(max_height + 9, text[:room], curses.color_pair(6))
+                cwindow.refresh()
+
+            def view_replay(self, replay):
+                # step through a recording (see Replay) in either direction, without running the program
+                self.help = 'REPLAY - enter/n forward, b back, g go to step, s start, e end, other keys to exit'
+                self.create_window()
+                max_height = replay.vm.program.max_height
+                try:
+                    while True:
+                        self.draw(replay.vm)
+                        self.draw_field(max_height + 7, replay.describe())
+                        c = self.window.getch()
+                        if c in (10, ord('n')):
+                            replay.forward()
+                        elif c == ord('b'):
+                            replay.backward()
+                        elif c == ord('g'):
+                            text = self.read_input('go to step: ').strip()
+                            if text.isdigit():
+                                replay.seek(int(text))
+                        elif c == ord('s'):
+                            replay.seek(0)
+                        elif c == ord('e'):
+                            replay.seek(float('inf'))
+                        else:
+                            break
+                finally:
+                    self.destroy_window()
+
+            def draw_cell(self, lines, x, y, attr):
+                line = lines[y] if y < len(lines) else ''
+                char = line[x] if x < len(line) and line[x] not in '\r\n' else ' '
+                self.window.addstr(y, x, char, attr)
+
+            def draw_field(self, row, text, attr=curses.A_NORMAL):
+                prev = self.fields.get(row)
+                if prev == text:
+                    return
+                if prev is not None and len(prev) > len(text):
+                    self.window.addstr(row, 0, ' ' * len(prev))  # blank out the end of the longer text
+                self.window.addstr(row, 0, text, attr)
+                self.fields[row] = text
+
     else:
         curses_found = False
-        window = None
 
 
         class Debugger:
@@ -459,133 +3741,140 @@ if __name__ == '__main__':
 
     # -----------------------------------------------------------------------------------------------------------------
 
-    show_info = False
-    timestep = 0
-    visual_dbg = False
-
-    ts = 0  # temp storage, common to all stacks. holds the most recent stack operation result
-
     # take in command line arg of directory with the 0.tier, 1.tier, 2.tier etc files
-    gfiles = get_input()
+    args = get_input()
+
+    if args.command == 'batch':
+        with (sys.stdin if args.file == '-' else open(args.file)) as input_file:
+            snapshot = load_snapshot(args.resume) if args.resume is not None else None
+            for res in run_batch(args.directory, read_input_sets(input_file), args.jobs, args.max_steps, args.timeout,
+                                 args.detect_cycles, snapshot):
+                print(json.dumps(res), flush=True)
+        sys.exit()
+    if args.command == 'analyze':
+        print(Analysis(Program(args.directory, concurrent=args.concurrent)).report())
+        sys.exit()
+    if args.command == 'daemon':
+        run_daemon(args.socket, args.jobs, args.programs, args.max_steps, args.timeout, args.slice,
+                   lambda sock: print(f'listening on {args.socket}', flush=True))
+        sys.exit()
+    if args.command == 'replay':
+        replay = Replay(Program(args.directory, keep_lines=True), load_recording(args.file))
+        if args.tail is not None:
+            replay.seek(float('inf'))
+            for _ in range(args.tail):
+                if not replay.backward():
+                    break
+            print(replay.describe())
+            while replay.forward():
+                print(replay.describe())
+        elif curses_found:
+            replay.seek(args.step)
+            Debugger(0).view_replay(replay)
+        sys.exit()
+    if args.command == 'serve':
+        async def serve_forever():
+            server = await serve(args.directory, args.host, args.port, args.max_steps, args.timeout, args.slice)
+            print(f"serving {format_dir(args.directory)} on {', '.join(str(s.getsockname()) for s in server.sockets)}")
+            async with server:
+                await server.serve_forever()
+        try:
+            asyncio.run(serve_forever())
+        except KeyboardInterrupt:
+            pass
+        sys.exit()
 
-    # handle visual debugging
-    visual_dbg &= curses_found
-    window = None
-    VDB = None
+    timestep = args.timestep
+    show_info = args.info
 
-    if visual_dbg:
-        VDB = Debugger()
-        window = VDB.create_window()
-        # timestep = 0
+    # handle visual debugging
+    visual_dbg = args.visual and curses_found
 
-    # open all the files and add all characters to dictionaries where key:val  = "row-col-dim":'char'
+    # open all the files and decode every tier into a dense grid of pre-classified cells
     # ignore all lines which have a ; character in the column 0
-    # (space inefficient, but allows for O(1) lookup time for characters at each timestep)
-    gchar_dict, gtier_list, max_height, max_width, lines_dict = store_chars(gfiles)
-    # create empty stacks and stack pointers for every layer
-    gsp_dict, gstacks_dict = create_stacks(gtier_list)
-
-    # create velocity and pc
-    velocity = [1, 0]  # eastwards     0th index = col velocity, 1st index = row velocity
-    pc = [0, 0, 0]  # top left corner, tier 0
-
-    # ts set by user or defaults to zero
-    # timestep logic:
-    # evaluate current operation (use decorator parsing)
-    # advance according to velocity
-    parse_options = \
-        defaultdict(lambda: (lambda: None, None),  # lambda since func needs callable object
-                    {  # char : (function, args)
-                        '^': (change_vel, [0, -1]),
-                        '_': (change_vel, [0, 1]),
-                        '>': (change_vel, [1, 0]),
-                        '<': (change_vel, [-1, 0]),
-                        '@': (jump, None),
-                        '[': (change_sp, 1),  # sp += 1
-                        ']': (change_sp, -1),  # sp -= 1,
-                        '~': (push_ts, None),
-                        '(': (copy_ts, None),  # ts = stack[sp]
-                        ')': (copy_sp, None),  # stack[sp] = ts
-                        '#': (end_prog, None),
-                        '{': (print_sp, None),
-                        '}': (input_sp, None),
-                        '+': (stack_operate, '+'),  # operator for exec
-                        '-': (stack_operate, '-'),
-                        '*': (stack_operate, '*'),
-                        '/': (stack_operate, '/'),
-                        '%': (stack_operate, '%'),
-                        '&': (stack_operate, '&'),
-                        '|': (stack_operate, '|'),
-                        '\\': (stack_operate, '//'),
-                        '?': (compare, None),
-                        '=': (check_zero, None),
-                        '!': (boolean_not, None),
-                        '`': (bin_random, None),
-                        ':': (pop_stack, None),
-                        '$': (pop_highest, None),
-                        '\'': (store_num_sp, None),
-                        "\"": (store_str_sp, None),
-                        ',': (get_index, None)
-                    })   
-
-    prog_over = False
-    mode = 0  # 0 = simple traversal, 1 = reading numbers, 2 = reading strings, 3 = jumping
-    string_to_store = []
-    num_to_store = []  # build as str to handle '.' (vs num*10 + new)
-    jump_address = []
-    jump_pos = [0, 0]
-    changing_mode = False
-
-    while not prog_over:
-        if timestep is not 0:
-            sleep(timestep)
-        # get current char
-        char = gchar_dict[f'{pc[0]}-{pc[1]}-{pc[2]}']
-
-        # ignore specific characters if mode = 0
-        find = re.search('[a-zA-Z0-9.;£ ]', f'{char}')  # non-command chars
-
-        if mode is 1:
-            # reading number
-            if char is "'":
-                changing_mode = True
-            else:
-                num_to_store.append(char)
-        if mode is 2:
-            # reading string
-            if char is '\"':
-                changing_mode = True
-            else:
-                string_to_store.append(char)
+    # (grids are indexed with integers, so fetching the instruction at pc is O(1) with no string formatting)
+    print(f'Building program from directory:{format_dir(args.directory)}')
+    chunk_memory = args.chunked * 2 ** 20 if args.chunked is not None else None
+    program = Program(args.directory, keep_lines=visual_dbg or args.profile is not None, use_cache=not args.no_cache,
+                      concurrent=args.concurrent, chunk_memory=chunk_memory)
+    if args.optimize:
+        removed = Analysis(program).optimize()
+        if args.stats:
+            print(f'optimize: removed {removed} unreachable cells', file=sys.stderr)
+    vm = TierVM(program)
+    vm.workers, vm.in_order = args.workers, args.deterministic
+    if args.memoize is not None:
+        vm.memo = CallCache(args.memoize)
+    stdin = None
 
-        if mode is 3:
-            # jumping
-
-            # this or statement enables jumping to negative tiers, should it be allowed?
-            if (char not in parse_options.keys() or char is '-') and (char not in (None, ' ', '.')):
-                jump_address.append(char)
-            else:
-                jump()
-                continue
-
-        if char is None:
-            advance_pc()
-            continue  # blank space
-
-        if not mode or changing_mode:
-            changing_mode = False
-            if not find:
-                func, arg = parse_options[f'{char}']
-                if func is None:
-                    raise Exception(f"unexpected character encountered. unknown purpose. "
-                                    f"\nCharacter: {char}.\nFile:{pc[2]}.tier\nLine:{pc[1]}\nCol:{pc[0]}")
-                if arg is None:
-                    output = func()
-                else:
-                    output = func(arg)
-
-        # add velocity and continue
-        advance_pc()
+    VDB = None
+    if visual_dbg:
+        VDB = Debugger(timestep)
+        VDB.create_window()
+        stdin = VDB.read_input
+
+    flush_size = args.flush_size
+    if show_info or visual_dbg or timestep != 0:
+        flush_size = 0  # write output straight away, so it stays in step with the debug output
+
+        def debug_hook(cvm):
+            # called on every step, before pc is advanced
+            if show_info:
+                cvm.view_debug()
+            if visual_dbg:
+                VDB.step_through(cvm)
+            if timestep != 0:
+                sleep(timestep)
+        vm.debug_hook = debug_hook
+    if args.breakpoint or (vm.debug_hook is not None and not program.concurrent):
+        # with no breakpoints, the debugger can still be told to run at full speed to the end of the program
+        vm.breakpoints = Breakpoints(program, args.breakpoint or ())
+
+    snapshot = load_snapshot(args.resume) if args.resume is not None else None
+    input_file = None
+    if args.input is not None:
+        input_file = open(args.input, 'r')
+        stdin = input_file
+        for _ in range(snapshot['lines_read'] if snapshot is not None else 0):
+            input_file.readline()  # already read by the run the snapshot was taken from
+
+    profiler = Profiler() if args.profile is not None else None
+    recorder = Recorder(args.record, args.record_last) if args.record is not None else None
+    stopped = None  # LimitExceeded, if the program was stopped before it ended
+    options = {'stdin': stdin, 'out': sys.stdout, 'use_traces': not args.no_trace, 'profiler': profiler,
+               'flush_size': flush_size, 'max_steps': args.max_steps, 'timeout': args.timeout,
+               'detect_cycles': args.detect_cycles, 'checkpoint': args.checkpoint,
+               'checkpoint_steps': args.checkpoint_steps, 'stop_at_input': args.stop_at_input,
+               'recorder': recorder}
+    try:
+        if snapshot is None:
+            vm.run(ts=args.set_ts, **options)
+        else:
+            vm.resume(snapshot, **options)
+        if args.checkpoint is not None:
+            save_snapshot(vm.snapshot(), args.checkpoint)  # the state the run ended in (or stopped at input)
+    except LimitExceeded as e:
+        stopped = e
+    finally:
+        if input_file is not None:
+            input_file.close()
+        if recorder is not None:
+            recorder.close()  # also when the run failed, so that the steps leading up to the failure can be seen
 
     if visual_dbg:
         VDB.destroy_window()
+    if args.stats:
+        print(f'trace cache: {vm.trace_hits} hits, {vm.trace_misses} misses', file=sys.stderr)
+        if vm.memo is not None:
+            print(vm.memo.report(), file=sys.stderr)
+        if program.chunks is not None:
+            print(program.chunks.report(), file=sys.stderr)
+    if profiler is not None:
+        with open(args.profile, 'w') as profile_file:
+            json.dump(profiler.to_json(program), profile_file, indent=1)
+        print(profiler.heatmap(program), file=sys.stderr)
+    if args.detect_cycles and not program.deterministic:
+        print('cycle detection was not used, as the program can run ` or }', file=sys.stderr)
+    if stopped is not None:
+        print(f'\n{stopped}', file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,623 @@
+# benchmarks for the Tier interpreter
+# e.g.
+#   python benchmark.py stack                            stack microbenchmark
+#   python benchmark.py demos --save baseline.json       run every program in demos/ and save the results
+#   python benchmark.py demos --compare baseline.json    fail if any program got slower than the saved results
+#   python benchmark.py stress                           synthetic programs at increasing sizes
+#   python benchmark.py sessions -n 500                  500 concurrent connections to programs served over tcp
+#   python benchmark.py concurrent -n 16                 16 pcs of a concurrent program, with and without workers
+#   python benchmark.py memo -n 20000                    20000 calls into a pure function, with and without --memoize
+#   python benchmark.py daemon -n 100                    100 runs of each of a few demos, with and without a daemon
+#   python benchmark.py grid -n 100000000                a program of 10^8 cells, loaded dense and in chunks
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from collections import defaultdict
+from time import perf_counter
+
+import tier_client
+from Tier import TierStack, Program, TierVM, LimitExceeded, find_files, format_dir, store_chars, decode_tiers, \
+    create_stacks, serve, CallCache, MEMO_SIZE, CHUNK_MEMORY
+
+DEMOS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'demos')
+
+# fixed inputs for the demos. programs which never end are stopped by a step limit
+DEMO_INPUTS = {
+    'boolXOR_func': {},
+    'cat': {'stdin': ['hello, world!']},
+    'e_approx': {'max_steps': 300000},
+    'fibonacci': {'max_steps': 300000},
+    'helloworld': {},
+    'isPrime': {'stdin': ["'7919'"]},
+    'powxy_func': {},
+    'square_or_cube': {'stdin': ["'7'"]},
+    'truth_machine': {'stdin': ["'1'"], 'max_steps': 300000},
+}
+DEFAULT_MAX_STEPS = 300000  # for any program in demos/ which is not listed above
+NOISE = 0.001  # slowdowns smaller than this many seconds are not counted as regressions
+
+
+def report(name, n, seconds):
+    print(f'{name:<40} n={n:<9} {seconds:8.3f}s  {n / seconds:>12,.0f} ops/s')
+
+
+# -------------------------------------------------STACK--------------------------------------------------------------
+
+def legacy_push(n):
+    # the dict based stack TierStack replaced, which searched max(keys) on every push
+    stack, sp = defaultdict(lambda: 0), 0
+    start = perf_counter()
+    for v in range(n):
+        top = 0 if not len(stack) else max(max(stack.keys()), sp)
+        stack[top + 1] = v
+    return perf_counter() - start
+
+
+def stack_push(n):
+    # push n values the same way as ~ does (ts is pushed to stack top + 1)
+    stack, sp = TierStack(), 0
+    start = perf_counter()
+    for v in range(n):
+        stack[stack.top(sp) + 1] = v
+    elapsed = perf_counter() - start
+    assert len(stack) == n and stack.top(sp) == n
+    return elapsed
+
+
+def stack_pop_middle(n, pops):
+    # : with sp at the bottom of a large stack shifts every element above it down
+    stack, sp = TierStack(), 0
+    for v in range(n):
+        stack[stack.top(sp) + 1] = v
+    start = perf_counter()
+    for _ in range(pops):
+        stack[sp]
+        stack.remove(sp)
+    return perf_counter() - start
+
+
+def stack_pop_highest(n):
+    stack, sp = TierStack(), 0
+    for v in range(n):
+        stack[stack.top(sp) + 1] = v
+    start = perf_counter()
+    for _ in range(n):
+        stack.pop(stack.top(sp))
+    return perf_counter() - start
+
+
+def bench_stack(n):
+    report('TierStack push', n, stack_push(n))
+    report('TierStack pop highest ($)', n, stack_pop_highest(n))
+    pops = min(n, 10 ** 3)
+    report(f'TierStack pop middle (:) of {n}', pops, stack_pop_middle(n, pops))
+    legacy_n = min(n, 10 ** 4)
+    report('dict + max(keys) push (before TierStack)', legacy_n, legacy_push(legacy_n))
+
+
+# -------------------------------------------------PROGRAMS-----------------------------------------------------------
+
+def best_of(repeat, func):
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        func()
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run_once(directory, inputs, use_traces=True) -> (float, int):
+    # run a program with a freshly loaded Program (so traces are compiled, as they would be from the command line)
+    vm = TierVM(Program(directory))
+    random.seed(0)  # for programs using `
+    start = perf_counter()
+    try:
+        vm.run(stdin=inputs.get('stdin', ()), ts=inputs.get('ts', 0), max_steps=inputs.get('max_steps'),
+               use_traces=use_traces)
+    except LimitExceeded:
+        pass
+    return perf_counter() - start, vm.steps
+
+
+def measure(directory, inputs, repeat, use_traces=True) -> dict:
+    usedir = format_dir(directory)
+    files = find_files(usedir)
+    rows_dict, tier_list, max_height, max_width, _ = store_chars(files)
+    result = {
+        # startup, one phase at a time
+        'scan': best_of(repeat, lambda: find_files(usedir)),
+        'store_chars': best_of(repeat, lambda: store_chars(files)),
+        'decode': best_of(repeat, lambda: decode_tiers(rows_dict, tier_list, max_height, max_width)),
+        'create_stacks': best_of(repeat, lambda: create_stacks(len(tier_list))),
+    }
+    result['startup'] = result['scan'] + result['store_chars'] + result['decode'] + result['create_stacks']
+    # loading a whole Program, without and then with the compiled cache (which only decodes tiers when used)
+    result['load'] = best_of(repeat, lambda: Program(directory, use_cache=False))
+    Program(directory)  # make sure the cache has been saved
+    result['load_cached'] = best_of(repeat, lambda: Program(directory))
+
+    runs = [run_once(directory, inputs, use_traces) for _ in range(repeat)]
+    result['seconds'] = min(seconds for seconds, _ in runs)
+    result['steps'] = runs[0][1]
+    result['steps_per_second'] = result['steps'] / result['seconds'] if result['seconds'] else 0
+
+    # peak memory is measured in a separate run, as tracing allocations slows the interpreter down
+    tracemalloc.start()
+    run_once(directory, inputs, use_traces)
+    result['peak_kb'] = tracemalloc.get_traced_memory()[1] / 1024
+    tracemalloc.stop()
+    return result
+
+
+def print_header():
+    print(f"{'program':<28}{'startup':>10}{'run':>10}{'steps':>11}{'steps/s':>13}{'peak KB':>10}   "
+          f"load / cached (ms)   startup phases: scan / store_chars / decode / create_stacks (ms)")
+
+
+def print_result(name, res):
+    print(f"{name:<28}{res['startup'] * 1000:>8.2f}ms{res['seconds']:>9.3f}s{res['steps']:>11,}"
+          f"{res['steps_per_second']:>13,.0f}{res['peak_kb']:>10,.0f}   "
+          f"{res['load'] * 1000:>7.2f} / {res['load_cached'] * 1000:<9.2f}"
+          f"{res['scan'] * 1000:.2f} / {res['store_chars'] * 1000:.2f} / {res['decode'] * 1000:.2f} / "
+          f"{res['create_stacks'] * 1000:.3f}")
+
+
+def bench_demos(repeat, use_traces) -> dict:
+    results = {}
+    print_header()
+    for name in sorted(os.listdir(DEMOS_DIR)):
+        directory = os.path.join(DEMOS_DIR, name)
+        if not os.path.isdir(directory):
+            continue
+        inputs = DEMO_INPUTS.get(name, {'max_steps': DEFAULT_MAX_STEPS})
+        results[name] = measure(directory, inputs, repeat, use_traces)
+        print_result(name, results[name])
+    return results
+
+
+def compare(results, baseline, threshold) -> bool:
+    # compare run and startup times against a saved baseline. returns False if anything regressed
+    ok = True
+    print(f"\n{'program':<28}{'run':>10}{'baseline':>10}{'ratio':>8}{'startup':>10}{'baseline':>10}{'ratio':>8}")
+    for name, res in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f'{name:<28}  (not in baseline)')
+            continue
+        run_ratio = res['seconds'] / base['seconds'] if base['seconds'] else 1
+        startup_ratio = res['startup'] / base['startup'] if base['startup'] else 1
+        flags = []
+        if run_ratio > 1 + threshold and res['seconds'] - base['seconds'] > NOISE:
+            flags.append('RUN REGRESSED')
+        if startup_ratio > 1 + threshold and res['startup'] - base['startup'] > NOISE:
+            flags.append('STARTUP REGRESSED')
+        if res['steps'] != base['steps']:
+            # the demos are deterministic, so this means the behaviour of the interpreter has changed
+            flags.append(f"STEPS CHANGED (baseline {base['steps']})")
+        ok &= not flags
+        print(f"{name:<28}{res['seconds']:>9.3f}s{base['seconds']:>9.3f}s{run_ratio:>8.2f}"
+              f"{res['startup'] * 1000:>8.2f}ms{base['startup'] * 1000:>8.2f}ms{startup_ratio:>8.2f}  "
+              f"{' '.join(flags)}")
+    return ok
+
+
+# --------------------------------------------------STRESS------------------------------------------------------------
+# generators for synthetic programs. each returns {file name: source}
+
+def snake(ops, width) -> list:
+    # lay out a sequence of single character instructions along a path which snakes down the rows of a tier,
+    # east along even rows and west along odd rows, finishing with #
+    inner = width - 2
+    rows = []
+    ops = list(ops) + ['#']
+    for r in range(0, len(ops), inner):
+        chunk = ops[r:r + inner]
+        if (r // inner) % 2 == 0:
+            rows.append('>' + ''.join(chunk).ljust(inner, '.') + '_')
+        else:
+            rows.append('_' + ''.join(reversed(chunk)).rjust(inner, '.') + '<')
+    return rows
+
+
+def stress_large_grid(n) -> dict:
+    # an n by n tier, every cell of which is executed
+    return {'0.tier': '\n'.join(snake('[]' * (n * (n - 2) // 2), n))}
+
+
+def stress_deep_stack(n) -> dict:
+    # push n values onto the stack, then pop them all
+    return {'0.tier': '\n'.join(snake("'1'(" + '~' * n + '$' * n, max(16, int(n ** 0.5))))}
+
+
+def stress_many_tiers(n) -> dict:
+    # n tiers, with pc jumping from each one to the next
+    files = {f'{t}.tier': f'@{t + 1}' for t in range(n - 1)}
+    files[f'{n - 1}.tier'] = '#'
+    return files
+
+
+def stress_jumps(n) -> dict:
+    # jump back and forth between two tiers n times. stack[0] of 0.tier counts down to 0
+    setup = f"'{n}']'1'[_"
+    col = len(setup) - 1
+    loop = '.' * col + '>-$)=@1#..........'
+    return {'0.tier': setup + '\n' + loop,
+            '1.tier': '\n' + '.' * (col + 9) + '@0'}
+
+
+def stress_gaps(n) -> dict:
+    # a loop with n empty cells between each instruction
+    gap = ' ' * n
+    return {'0.tier': '>' + gap + '[' + gap + ']' + gap}
+
+
+def stress_mismatched(n) -> dict:
+    # a small loop in 0.tier, in a grid made n wide and n high by another (never entered) tier
+    return {'0.tier': '>[]',
+            '1.tier': '\n' * (n - 1) + '.' * n}
+
+
+STRESS = {  # name : (generator, sizes, inputs)
+    'large_grid': (stress_large_grid, [50, 100, 200, 400], {}),
+    'deep_stack': (stress_deep_stack, [10 ** 3, 10 ** 4, 10 ** 5], {}),
+    'many_tiers': (stress_many_tiers, [10, 100, 1000], {}),
+    'jumps': (stress_jumps, [10 ** 3, 10 ** 4, 10 ** 5], {}),
+    # these never end, so are stopped after the same number of steps at every size
+    'gaps': (stress_gaps, [10, 100, 1000], {'max_steps': 10 ** 6}),
+    'mismatched': (stress_mismatched, [10, 100, 1000], {'max_steps': 10 ** 6}),
+}
+
+
+def bench_stress(names, repeat, scale, use_traces) -> dict:
+    results = {}
+    print_header()
+    for name in names:
+        generate, sizes, inputs = STRESS[name]
+        for size in sizes:
+            size = max(2, int(size * scale))
+            with tempfile.TemporaryDirectory() as directory:
+                for fname, source in generate(size).items():
+                    with open(os.path.join(directory, fname), 'w') as f:
+                        f.write(source)
+                key = f'{name}({size})'
+                results[key] = measure(directory, inputs, repeat, use_traces)
+                print_result(key, results[key])
+    return results
+
+
+# -------------------------------------------------SESSIONS-----------------------------------------------------------
+SESSION_DEMOS = ('cat', 'isPrime', 'powxy_func')  # demos which always give the same output for the same input
+
+
+async def session_client(port, stdin) -> (str, float):
+    # connect, send all of the input, and read the output until the program ends
+    start = perf_counter()
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(''.join(f'{line}\n' for line in stdin).encode('utf-8'))
+    await writer.drain()
+    output = (await reader.read()).decode('utf-8')
+    writer.close()
+    return output, perf_counter() - start
+
+
+async def run_sessions(n) -> (list, float):
+    servers, expected = {}, {}
+    for name in SESSION_DEMOS:
+        directory = os.path.join(DEMOS_DIR, name)
+        stdin = DEMO_INPUTS[name].get('stdin', ())
+        expected[name] = TierVM(Program(directory)).run(stdin=list(stdin))
+        servers[name] = await serve(directory)
+    names = [SESSION_DEMOS[i % len(SESSION_DEMOS)] for i in range(n)]
+    start = perf_counter()
+    results = await asyncio.gather(*(session_client(servers[name].sockets[0].getsockname()[1],
+                                                    DEMO_INPUTS[name].get('stdin', ())) for name in names))
+    elapsed = perf_counter() - start
+    for server in servers.values():
+        server.close()
+        await server.wait_closed()
+    return [(name, output == expected[name], seconds) for name, (output, seconds) in zip(names, results)], elapsed
+
+
+def bench_sessions(n) -> bool:
+    # n connections at once, shared between the programs in SESSION_DEMOS, all served by one event loop.
+    # returns False if any connection got the wrong output
+    results, elapsed = asyncio.run(run_sessions(n))
+    print(f'{n} sessions in {elapsed:.3f}s, {n / elapsed:,.0f} sessions/s')
+    for name in SESSION_DEMOS:
+        times = sorted(seconds for session, _, seconds in results if session == name)
+        wrong = sum(1 for session, ok, _ in results if session == name and not ok)
+        print(f'{name:<16} {len(times):>6} sessions  latency median {times[len(times) // 2] * 1000:8.1f}ms  '
+              f'max {times[-1] * 1000:8.1f}ms  wrong output {wrong}')
+    return all(ok for _, ok, _ in results)
+
+
+# ------------------------------------------------CONCURRENT----------------------------------------------------------
+def concurrent_primes(numbers) -> dict:
+    # a concurrent program which forks one pc for each number, into a tier of its own. each pc tests its number for
+    # primality by trial division (stack: 1, divisor, number) and sends the answer to 0.tier, which prints the
+    # answers as they arrive. no two pcs use the same stack, so every pc can be handed to a worker
+    files = {'0.tier': ''.join(f'Y{k + 1} ' for k in range(len(numbers))) + 'R{' * len(numbers) + '#'}
+    for k, n in enumerate(numbers):
+        head = ' ' * (3 * k) + f"'1'['2'['{n}'"  # the pc starts at the position of its Y
+        loop = len(head)  # the > which starts each division
+        files[f'{k + 1}.tier'] = '\n'.join([head + '>..........%[=_' + f'"{n} is not prime\\n"S0#',
+                                            ' ' * loop + '^_?[)]]$[[+]]$<',
+                                            ' ' * (loop + 1) + f'>"{n} is prime\\n"S0#'])
+    return files
+
+
+def largest_primes(n, below) -> list:
+    found, k = [], below - 1
+    while len(found) < n:
+        if k > 1 and all(k % d for d in range(2, int(k ** 0.5) + 1)):
+            found.append(k)
+        k -= 1
+    return found
+
+
+CONCURRENT_DEMOS = ('e_approx', 'isPrime', 'powxy_func')
+
+
+def bench_concurrent(n, size, workers, repeat) -> bool:
+    # n pcs each testing a prime below size, run in one process, then handing every pc to a pool of workers (as
+    # they finish, and in the order they were forked), then a few demos with and without --concurrent.
+    # returns False if any run printed the wrong answers, or a demo ran differently as a concurrent program
+    with tempfile.TemporaryDirectory() as directory:
+        for fname, source in concurrent_primes(largest_primes(n, size)).items():
+            with open(os.path.join(directory, fname), 'w') as f:
+                f.write(source)
+        program = Program(directory, concurrent=True)
+        runs = [('one process', None, False), (f'{workers} workers', workers, False),
+                (f'{workers} workers, in order', workers, True)]
+        expected = sorted(f'{k} is prime' for k in largest_primes(n, size))
+        ok, base = True, None
+        for name, n_workers, in_order in runs:
+            outputs = []
+
+            def run():
+                vm = TierVM(program)
+                vm.workers, vm.in_order = n_workers, in_order
+                outputs.append((sorted(vm.run().splitlines()), vm.steps))
+            seconds = best_of(repeat, run)
+            base = base or seconds
+            ok = ok and all(answers == expected for answers, _ in outputs)
+            print(f'{name:<24} {seconds:8.3f}s {outputs[0][1] / seconds:>14,.0f} steps/s  '
+                  f'speedup {base / seconds:6.2f}x')
+    print(f'{n} pcs, {os.cpu_count()} cores')
+    # programs with one pc, which cross blank space, run as they would without --concurrent
+    for name in CONCURRENT_DEMOS:
+        inputs, results = DEMO_INPUTS[name], []
+        for concurrent in (False, True):
+            program = Program(os.path.join(DEMOS_DIR, name), concurrent=concurrent)
+
+            def run():
+                vm = TierVM(program)
+                try:
+                    output = vm.run(stdin=inputs.get('stdin', ()), max_steps=inputs.get('max_steps', DEFAULT_MAX_STEPS))
+                except LimitExceeded:
+                    output = vm.output.getvalue()
+                results.append((output, vm.steps))
+            seconds = best_of(repeat, run)
+            label = f"{name}{', concurrent' if concurrent else ''}"
+            print(f'{label:<24} {seconds:8.3f}s {results[-1][1] / seconds:>14,.0f} steps/s')
+        ok = ok and results[0] == results[-1]
+    return ok
+
+
+# ---------------------------------------------------MEMO-------------------------------------------------------------
+def triangle_calls(n, distinct) -> dict:
+    # 0.tier calls a function in 1.tier n times, with the arguments n % distinct, (n - 1) % distinct ... 1, printing
+    # each answer. the function works out 1 + 2 + ... + (k + 1) for an argument k one addition at a time
+    # (stack: 1, k + 1, total), and leaves its stack empty, so that every call with the same argument is the same
+    head = f"'{distinct}'['{n}'"
+    call = head + '>%[$]'  # stack: distinct, calls left
+    body = ".[)]'1'[+[$])["
+    loop = len(call) + len(body)  # the > which starts each addition
+    function = ' ' * len(call) + body + '>+[$])]-[[$]])=_]:::@0'
+    back = len(function) - 1  # the 0 of @0, which pc carries on from in 0.tier once the call returns
+    main = call + '@1' + ' ' * (back - len(call) - 2) + '.[){" "{\'-1\'+[$]])[:]=_#'
+    return {'0.tier': '\n'.join([main, ' ' * len(head) + '^' + '.' * (len(main) - len(head) - 3) + '<']),
+            '1.tier': '\n'.join([function, ' ' * loop + '^' + '.' * (len(function) - loop - 9) + '[<'])}
+
+
+def bench_memo(n, distinct, repeat) -> bool:
+    # n calls into a pure function with distinct different arguments, run without memoization, with a cache big
+    # enough for every argument, and with one too small to keep any (the least recently used call is always the
+    # next one made), then e_approx, which never calls its functions with the same arguments twice, and whose calls
+    # pass through the caller's tier, so are split into calls too short to keep (see CallCache).
+    # returns False if memoization changed the output or the number of steps of any run
+    ok = True
+    with tempfile.TemporaryDirectory() as directory:
+        for fname, source in triangle_calls(n, distinct).items():
+            with open(os.path.join(directory, fname), 'w') as f:
+                f.write(source)
+        programs = [(f'{n} calls', Program(directory), None),
+                    ('e_approx', Program(os.path.join(DEMOS_DIR, 'e_approx')), 3 * 10 ** 6)]
+        for name, program, max_steps in programs:
+            print(name)
+            expected, base = None, None
+            for size in (None, MEMO_SIZE, distinct // 2):
+                results = []
+
+                def run():
+                    vm = TierVM(program)
+                    vm.memo = CallCache(size) if size is not None else None
+                    try:
+                        output = vm.run(max_steps=max_steps)
+                    except LimitExceeded:
+                        output = vm.output.getvalue()
+                    results.append((output, vm.steps, vm.memo))
+                seconds = best_of(repeat, run)
+                output, steps, memo = results[0]
+                expected = expected or (output, steps)
+                base = base or seconds
+                ok = ok and (output, steps) == expected
+                label = 'no memo' if size is None else f'memo, {size} calls'
+                print(f'  {label:<22} {seconds:8.3f}s {steps / seconds:>14,.0f} steps/s  speedup {base / seconds:6.2f}x'
+                      f"  {memo.report() if memo is not None else ''}")
+    return ok
+
+
+# --------------------------------------------------DAEMON------------------------------------------------------------
+DAEMON_DEMOS = ('helloworld', 'isPrime', 'powxy_func')
+
+
+def bench_daemon(n) -> bool:
+    # the time taken by each run of a few small demos: as a new python Tier.py process, as a new python
+    # tier_client.py process talking to a daemon, and as a request made to the daemon from this process.
+    # returns False if any run through the daemon got different output
+    here = os.path.dirname(os.path.abspath(__file__))
+    ok = True
+    with tempfile.TemporaryDirectory() as temp:
+        path = os.path.join(temp, 'tier.sock')
+        command = [sys.executable, os.path.join(here, 'Tier.py'), 'daemon', '--socket', path, '-j', '1']
+        daemon = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+        try:
+            daemon.stdout.readline()  # listening on ...
+            print(f"{'':<14}{'Tier.py':>14}{'tier_client.py':>16}{'request':>14}")
+            for name in DAEMON_DEMOS:
+                directory = os.path.join(DEMOS_DIR, name)
+                stdin = ''.join(f'{line}\n' for line in DEMO_INPUTS[name].get('stdin', ()))
+                commands = [[sys.executable, os.path.join(here, 'Tier.py'), '-d', directory],
+                            [sys.executable, os.path.join(here, 'tier_client.py'), '-d', directory, '--socket', path]]
+                times, outputs = [], []
+                for command in commands:
+                    runs = []
+                    seconds = best_of(n, lambda: runs.append(subprocess.run(command, input=stdin, capture_output=True,
+                                                                             text=True).stdout))
+                    times.append(seconds)
+                    outputs.append(runs[0])
+                runs = []
+                times.append(best_of(n * 10, lambda: runs.append(
+                    tier_client.request(directory, stdin=stdin.splitlines(), path=path)['output'])))
+                outputs.append(runs[0])
+                # Tier.py prints the directory it builds the program from, before the output of the program
+                ok = ok and outputs[0].split('\n', 1)[1] == outputs[1] == outputs[2]
+                print(f'{name:<14}' + ''.join(f'{seconds * 1000:>12.3f}ms' for seconds in times))
+        finally:
+            daemon.terminate()
+            daemon.wait()
+    return ok
+
+
+# ---------------------------------------------------GRID-------------------------------------------------------------
+def write_large_program(directory, side):
+    # a side by side tier of . with pc going once around its edge: east along the top row, south down the last
+    # column and west along the bottom row, where it prints done and ends
+    with open(os.path.join(directory, '0.tier'), 'w') as f:
+        f.write('>' + '.' * (side - 2) + '_\n')
+        row = '.' * side + '\n'
+        for _ in range(side - 2):
+            f.write(row)
+        f.write('.' * (side - 9) + '#{"enod"<\n')
+
+
+def peak_rss() -> int:
+    # bytes. VmHWM where there is one, as on linux ru_maxrss is kept across fork and exec, so would count the memory
+    # of the benchmark process itself
+    try:
+        with open('/proc/self/status') as file:
+            return next(int(line.split()[1]) * 1024 for line in file if line.startswith('VmHWM:'))
+    except (OSError, StopIteration):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def grid_run(directory, use_cache, chunk_memory) -> dict:
+    # load and run a program in this process, which should do nothing else, so that its peak rss is that of the run
+    start = perf_counter()
+    program = Program(directory, use_cache=use_cache, chunk_memory=chunk_memory)
+    load = perf_counter() - start
+    vm = TierVM(program)
+    output = vm.run()
+    return {'load': load, 'run': perf_counter() - start - load, 'output': output, 'steps': vm.steps,
+            'rss': peak_rss(),
+            'chunks': program.chunks.report() if program.chunks is not None else ''}
+
+
+def bench_grid(n, memory) -> bool:
+    # a program of about n cells, loaded and run in a new process for each of: decoded in full from the .tier files,
+    # from the compiled cache (built beforehand), and in chunks held to memory megabytes and to a tenth of that.
+    # returns False if any of them got different output
+    side = max(10, int(n ** 0.5))
+    runs = [('dense', False, None), ('compiled cache', True, None), (f'chunked, {memory}MB', False, memory),
+            (f'chunked, {memory / 10:g}MB', False, memory / 10)]
+    ok, expected = True, None
+    with tempfile.TemporaryDirectory() as directory:
+        write_large_program(directory, side)
+        print(f'{side} by {side} cells, {os.path.getsize(os.path.join(directory, "0.tier")) / 2 ** 20:.1f}MB of source')
+        Program(directory)  # build the compiled cache
+        print(f"{'':<22}{'load':>10}{'run':>10}{'peak rss':>12}")
+        for name, use_cache, megabytes in runs:
+            code = (f'import json, sys; sys.path.insert(0, {os.path.dirname(os.path.abspath(__file__))!r}); '
+                    f'from benchmark import grid_run; print(json.dumps(grid_run({directory!r}, {use_cache}, '
+                    f'{None if megabytes is None else int(megabytes * 2 ** 20)})))')
+            result = json.loads(subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                                               check=True).stdout)
+            expected = expected or (result['output'], result['steps'])
+            ok = ok and (result['output'], result['steps']) == expected
+            print(f"{name:<22}{result['load']:>9.3f}s{result['run']:>9.3f}s{result['rss'] / 2 ** 20:>10.1f}MB  "
+                  f"{result['chunks']}")
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('suite', choices=['stack', 'demos', 'stress', 'sessions', 'concurrent', 'memo', 'daemon',
+                                          'grid'],
+                        help='benchmark to run')
+    parser.add_argument('-n', type=int, default=None,
+                        help='number of values to push (stack, default 1000000), of connections (sessions, default '
+                             '300), of pcs (concurrent, default 2 per core), of calls (memo, default 20000), of '
+                             'runs (daemon, default 20), or of cells (grid, default 100000000)')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='number of times to repeat each measurement')
+    parser.add_argument('--save', type=str, default=None, help='save the results as a json baseline')
+    parser.add_argument('--compare', type=str, default=None, help='json baseline to compare the results against')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='fraction a time can grow by before it counts as a regression. default 0.2')
+    parser.add_argument('--only', nargs='*', default=list(STRESS), choices=list(STRESS),
+                        help='stress programs to run')
+    parser.add_argument('--scale', type=float, default=1, help='multiply the sizes of the stress programs')
+    parser.add_argument('--no_trace', action='store_true', default=False,
+                        help='run the programs one cell at a time, without the trace cache')
+    parser.add_argument('--size', type=int, default=50000,
+                        help='each pc of the concurrent program tests a prime below this. default 50000')
+    parser.add_argument('--memory', type=int, default=CHUNK_MEMORY,
+                        help=f'megabytes of chunks the grid benchmark holds at once. default {CHUNK_MEMORY}')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes for the concurrent program. default to the number of cores')
+    args = parser.parse_args()
+
+    if args.suite == 'stack':
+        bench_stack(args.n or 10 ** 6)
+        sys.exit()
+    if args.suite == 'sessions':
+        sys.exit(0 if bench_sessions(args.n or 300) else 1)
+    if args.suite == 'concurrent':
+        cores = os.cpu_count() or 1
+        sys.exit(0 if bench_concurrent(args.n or 2 * cores, args.size, args.jobs or max(2, cores), args.repeat) else 1)
+    if args.suite == 'memo':
+        sys.exit(0 if bench_memo(args.n or 20000, 10, args.repeat) else 1)
+    if args.suite == 'daemon':
+        sys.exit(0 if bench_daemon(args.n or 20) else 1)
+    if args.suite == 'grid':
+        sys.exit(0 if bench_grid(args.n or 10 ** 8, args.memory) else 1)
+
+    if args.suite == 'demos':
+        bench_results = bench_demos(args.repeat, not args.no_trace)
+    else:
+        bench_results = bench_stress(args.only, args.repeat, args.scale, not args.no_trace)
+    if args.save:
+        with open(args.save, 'w') as out_file:
+            json.dump(bench_results, out_file, indent=2)
+    if args.compare:
+        with open(args.compare) as in_file:
+            if not compare(bench_results, json.load(in_file), args.threshold):
+                sys.exit(1)
@@ -0,0 +1,101 @@
+# finds the most frequent sequences (n-grams) of instructions run one after another along a straight path of pc, to
+# decide which sequences are worth fusing in the trace compiler (see peephole in Tier.py)
+# e.g.
+#   python ngrams.py                                  every program in demos/, counted once per path
+#   python ngrams.py --run                            demos/, weighted by the number of times each sequence is run
+#   python ngrams.py -d demos/isPrime my_program -n 2 3 --top 10
+# sequences marked with * are already fused by the trace compiler
+import argparse
+import os
+import random
+from collections import Counter
+
+from Tier import Program, TierVM, Analysis, Profiler, LimitExceeded, LITERAL_MODES, FOLD_ARITHMETIC, find_literal, \
+    trace_source, peephole, wrap
+from benchmark import DEMOS_DIR, DEMO_INPUTS, DEFAULT_MAX_STEPS
+
+LITERAL_TOKENS = {1: "'n'", 2: '"s"'}  # numbers and strings are counted as one instruction, whatever they hold
+LITERAL_SOURCE = ['ts = stack[sp]', 'stack[sp] = _k0']
+
+
+def straight_paths(program, analysis) -> list:
+    # the instructions on the path from every state a trace starts at, up to the next change of velocity, jump,
+    # branch, or wrap. returns a list of paths, each a list of (token, (t, x, y) of its first cell)
+    paths = []
+    for x, y, t, dx, dy in analysis.entries:
+        rows = program.grids[t]
+        path = []
+        while True:
+            char, func, _, _ = rows[y][x]
+            if func is not None:
+                if char in '^_<>?=#@':
+                    break
+                if char in LITERAL_MODES:
+                    literal = find_literal(program, x, y, t, dx, dy)
+                    if literal is None:
+                        break
+                    path.append((LITERAL_TOKENS[literal[0]], (t, x, y)))
+                    x, y = literal[4][-1]  # carry on from the cell which ends the literal
+                else:
+                    path.append((char, (t, x, y)))
+            nx, ny = wrap(x + dx, program.max_width), wrap(y + dy, program.max_height)
+            if (nx, ny) != (x + dx, y + dy):
+                break
+            x, y = nx, ny
+        paths.append(path)
+    return paths
+
+
+def cell_counts(directory, program) -> dict:
+    # number of times each cell is run, with the fixed inputs used by benchmark.py
+    inputs = DEMO_INPUTS.get(os.path.basename(os.path.normpath(directory)), {})
+    profiler = Profiler()
+    random.seed(0)
+    try:
+        TierVM(program).run(stdin=inputs.get('stdin', ()), ts=inputs.get('ts', 0), profiler=profiler,
+                            max_steps=inputs.get('max_steps', DEFAULT_MAX_STEPS))
+    except LimitExceeded:
+        pass
+    return profiler.cells
+
+
+def fused(gram) -> bool:
+    # whether the trace compiler already does better than running the instructions one after another: a number or
+    # string is used straight away by arithmetic or {, or the peephole pass shortens the source of the instructions
+    if any(a in LITERAL_TOKENS.values() and (b in FOLD_ARITHMETIC or b == '{') for a, b in zip(gram, gram[1:])):
+        return True
+    lines = [line for token in gram for line in (LITERAL_SOURCE if token in LITERAL_TOKENS.values()
+                                                 else trace_source[token])]
+    return len(peephole(lines)) < len(lines)
+
+
+def count_ngrams(directories, sizes, run) -> dict:
+    # n : Counter of n-grams (tuples of tokens)
+    counts = {n: Counter() for n in sizes}
+    for directory in directories:
+        program = Program(directory)
+        paths = straight_paths(program, Analysis(program))
+        cells = cell_counts(directory, program) if run else None
+        for path in paths:
+            for n in sizes:
+                for i in range(len(path) - n + 1):
+                    gram = tuple(token for token, _ in path[i:i + n])
+                    counts[n][gram] += cells.get(path[i][1], 0) if run else 1
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--directories', nargs='*', default=None,
+                        help='program directories to mine. default to every program in demos/')
+    parser.add_argument('-n', '--sizes', nargs='*', type=int, default=[2, 3, 4], help='lengths of sequence to count')
+    parser.add_argument('--top', type=int, default=15, help='number of sequences to show for each length')
+    parser.add_argument('--run', action='store_true', default=False,
+                        help='weight each sequence by the number of times it is run, instead of counting it once')
+    args = parser.parse_args()
+
+    directories = args.directories or [os.path.join(DEMOS_DIR, name) for name in sorted(os.listdir(DEMOS_DIR))]
+    for n, counter in count_ngrams(directories, args.sizes, args.run).items():
+        print(f'{n}-grams ({sum(counter.values())} in total)')
+        for gram, count in counter.most_common(args.top):
+            print(f"  {'*' if fused(gram) else ' '} {''.join(gram):<16} {count:>10}")
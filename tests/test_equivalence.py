@@ -0,0 +1,290 @@
+# checks that every way of running a program does exactly what running it one cell at a time does (use_traces=False):
+# the same output, the same error (if any), the same number of steps and the same final snapshot, for every program
+# in demos/ and for random programs (made with a fixed seed, so every run checks the same ones). runs which raise are
+# compared too, as the state they are left in is what batch, daemon and concurrent results and snapshots report
+# e.g.
+#   python -m pytest tests
+#   python tests/test_equivalence.py                             every mode
+#   python tests/test_equivalence.py -n 3000 memo memo_all       more random programs, in the memo modes only
+import argparse
+import asyncio
+import atexit
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import Tier
+from Tier import Program, TierVM, Analysis, CallCache, Recorder, LimitExceeded, get_input_type, run_batch
+from benchmark import DEMOS_DIR, DEMO_INPUTS, DEFAULT_MAX_STEPS, triangle_calls
+
+RANDOM_PROGRAMS = 300  # number of random programs checked by each test
+RANDOM_MAX_STEPS = 2000  # random programs often never end
+RANDOM_STDIN = ["'3'", 'hello', "'0'", "'1.5'"]  # lines read by }, after which it raises EOFError
+CALLS = 60  # calls made by the program which calls a function (see cases)
+OPS = '^_<>[]~(),!:$+-*/%&|\\?={'
+NUMBERS = ['1', '2', '3', '0', '12', '1.5', '7', '1x']
+STRINGS = ['a', 'hi', '\\n', 'x', '']
+
+
+def write_random_program(rng, directory):
+    # one to three tiers of instructions, blank space, literals (some of which are not numbers), jumps (between tiers
+    # which exist, or to one which does not), comments and characters which are not instructions
+    n_tiers = rng.randint(1, 3)
+    width, height = rng.randint(3, 14), rng.randint(1, 6)
+    for t in range(n_tiers):
+        rows = []
+        for _ in range(rng.randint(1, height)):
+            row = ''
+            while len(row) < rng.randint(0, width):
+                r = rng.random()
+                if r < 0.3:
+                    row += rng.choice(' ..')
+                elif r < 0.75:
+                    row += rng.choice(OPS)
+                elif r < 0.83:
+                    row += f"'{rng.choice(NUMBERS)}'"
+                elif r < 0.87:
+                    row += f'"{rng.choice(STRINGS)}"'
+                elif r < 0.94:
+                    target = str(rng.randrange(n_tiers + 1))
+                    row += rng.choice(['@' + target, target + '@'])
+                elif r < 0.96:
+                    row += '#'
+                elif r < 0.98:
+                    row += '}'
+                else:
+                    row += rng.choice('ab9`')
+            rows.append(row)
+        if rng.random() < 0.3:
+            rows.append(';comment')
+        with open(os.path.join(directory, f'{t}.tier'), 'w') as f:
+            f.write('\n'.join(rows) + ('\n' if rng.random() < 0.5 else ''))
+
+
+def cases(n_random=RANDOM_PROGRAMS, seed=0) -> list:
+    # (directory, ts, stdin, max_steps) of every demo, of a program calling a function many times with the same few
+    # arguments (so that memoization has hits, see benchmark.py), then of n_random random programs. programs are
+    # written to a temporary directory which is removed when python exits
+    found = [(os.path.join(DEMOS_DIR, name), 0, DEMO_INPUTS.get(name, {}).get('stdin', ()),
+              DEMO_INPUTS.get(name, {}).get('max_steps', DEFAULT_MAX_STEPS)) for name in sorted(os.listdir(DEMOS_DIR))]
+    rng = random.Random(seed)
+    root = tempfile.mkdtemp()
+    atexit.register(shutil.rmtree, root, True)
+    os.mkdir(os.path.join(root, 'calls'))
+    for fname, source in triangle_calls(CALLS, 6).items():
+        with open(os.path.join(root, 'calls', fname), 'w') as f:
+            f.write(source)
+    found.append((os.path.join(root, 'calls'), 0, (), DEFAULT_MAX_STEPS))
+    for i in range(n_random):
+        directory = os.path.join(root, str(i))
+        os.mkdir(directory)
+        write_random_program(rng, directory)
+        found.append((directory, rng.choice([0, "'2'", 'a']), RANDOM_STDIN[:rng.randint(0, len(RANDOM_STDIN))],
+                      RANDOM_MAX_STEPS))
+    return found
+
+
+def outcome(vm, run) -> tuple:
+    # (output, error, steps, snapshot) of a run. run is called with no arguments, and may raise
+    random.seed(0)  # for `
+    error = None
+    try:
+        run()
+    except LimitExceeded as e:
+        error = f'{e.kind}: {e}'
+    except Exception as e:
+        error = f'{type(e).__name__}: {e}'
+    try:
+        snapshot = vm.snapshot()
+        del snapshot['program']  # the hash is not worked out for chunked programs
+        if not snapshot['mode']:
+            # only used while reading the address of a jump, and otherwise left as it was by the last jump read one
+            # cell at a time (see TierVM.jump), which runs of whole literals and traces need not be
+            del snapshot['jump_pos']
+    except TypeError as e:
+        snapshot = str(e)  # a literal which ran into blank space holds None, which cannot be saved
+    return vm.output.getvalue(), error, vm.steps, snapshot
+
+
+def load(case, **options) -> Program:
+    return Program(case[0], use_cache=False, **options)
+
+
+def start_ts(case):
+    ts = case[1]
+    return get_input_type(ts) if isinstance(ts, str) else ts
+
+
+def run_plain(case, use_traces=True, program=None, setup=None, **options) -> tuple:
+    vm = TierVM(program or load(case))
+    if setup is not None:
+        setup(vm)
+    return outcome(vm, lambda: vm.run(stdin=case[2], ts=start_ts(case), use_traces=use_traces, max_steps=case[3],
+                                      **options))
+
+
+def run_async(case) -> tuple:
+    # in slices of a few steps, so that traces are cut short and runs stop to wait for input
+    vm = TierVM(load(case))
+    chunks = []
+
+    async def run():
+        async for chunk in vm.run_async(stdin=case[2], ts=start_ts(case), max_steps=case[3], slice_steps=7):
+            chunks.append(chunk)
+
+    def run_all():
+        try:
+            asyncio.run(run())
+        finally:
+            vm.output.write(''.join(chunks) + vm.output.take())  # output yielded, then any left when it raised
+    return outcome(vm, run_all)
+
+
+def run_optimized(case) -> tuple:
+    program = load(case)
+    Analysis(program).optimize()
+    return run_plain(case, program=program)
+
+
+def run_memoized(case, min_steps, memo=None) -> tuple:
+    saved = Tier.MEMO_MIN_STEPS
+    Tier.MEMO_MIN_STEPS = min_steps  # with 0, every call is saved, so later calls with the same key are hits
+    try:
+        memo = memo or CallCache()
+        return run_plain(case, setup=lambda vm: setattr(vm, 'memo', memo))
+    finally:
+        Tier.MEMO_MIN_STEPS = saved
+
+
+def run_recorded(case) -> tuple:
+    with tempfile.TemporaryDirectory() as directory:
+        recorder = Recorder(os.path.join(directory, 'run.rec'))
+        try:
+            return run_plain(case, recorder=recorder)
+        finally:
+            recorder.close()
+
+
+MODES = {
+    'traces': run_plain,
+    'async': run_async,
+    'optimize': run_optimized,
+    'memo': lambda case: run_memoized(case, Tier.MEMO_MIN_STEPS),
+    'memo_all': lambda case: run_memoized(case, 0),
+    'chunked': lambda case: run_plain(case, program=load(case, chunk_memory=0)),
+    'recorded': run_recorded,
+    'concurrent': lambda case: run_plain(case, program=load(case, concurrent=True)),
+}
+
+
+def differences(expected, result) -> str:
+    # the parts of two outcomes which differ
+    names = ('output', 'error', 'steps')
+    found = [f'{name}: {a!r} != {b!r}' for name, a, b in zip(names, expected, result) if a != b]
+    if isinstance(expected[3], dict) and isinstance(result[3], dict):
+        found += [f'snapshot {key}: {expected[3][key]!r:.200} != {result[3].get(key)!r:.200}' for key in expected[3]
+                  if key not in names and expected[3][key] != result[3].get(key)]
+    elif expected[3] != result[3]:
+        found.append(f'snapshot: {expected[3]!r:.200} != {result[3]!r:.200}')
+    return '; '.join(found)
+
+
+def mismatches(mode, all_cases) -> list:
+    # (directory, how the run in mode differs from the run one cell at a time) of every case which differs
+    found = []
+    for case in all_cases:
+        expected = run_plain(case, use_traces=False)
+        result = MODES[mode](case)
+        if result != expected:
+            found.append((case[0], differences(expected, result)))
+    return found
+
+
+cached_cases = []
+
+
+def shared_cases() -> list:
+    # the cases checked by every test, made once
+    if not cached_cases:
+        cached_cases.extend(cases())
+    return cached_cases
+
+
+def check(mode):
+    found = mismatches(mode, shared_cases())
+    assert not found, f'{len(found)} runs differ in mode {mode}, the first in {found[0][0]}: {found[0][1]}'
+
+
+def test_traces():
+    check('traces')
+
+
+def test_async():
+    check('async')
+
+
+def test_optimize():
+    check('optimize')
+
+
+def test_memo():
+    check('memo')
+
+
+def test_memo_every_call_saved():
+    check('memo_all')
+
+
+def test_memo_hits():
+    # the checks above only show anything about memoization if calls are replaced by saved state
+    case = next(case for case in shared_cases() if os.path.basename(case[0]) == 'calls')
+    for min_steps in (Tier.MEMO_MIN_STEPS, 0):
+        memo = CallCache()
+        assert run_memoized(case, min_steps, memo) == run_plain(case, use_traces=False)
+        assert memo.hits > CALLS // 2, memo.report()
+
+
+def test_chunked():
+    check('chunked')
+
+
+def test_recorded():
+    check('recorded')
+
+
+def test_concurrent():
+    check('concurrent')
+
+
+def test_batch():
+    # batch results, which are reported rather than raised, hold the output and steps of the run up to any error
+    for case in shared_cases():
+        input_set = {'ts': case[1], 'stdin': list(case[2]), 'max_steps': case[3]}
+        random.seed(0)
+        result = next(run_batch(load(case), [input_set], workers=1))
+        output, error, steps, _ = run_plain(case, use_traces=False)
+        assert (result['output'], result['steps'], result['status'] == 'ok') == (output, steps, error is None), case[0]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('modes', nargs='*', help=f"modes to check, of {', '.join(MODES)}. default to every mode")
+    parser.add_argument('-n', type=int, default=RANDOM_PROGRAMS, help='number of random programs')
+    parser.add_argument('--seed', type=int, default=0, help='seed the random programs are made with')
+    args = parser.parse_args()
+
+    unknown = [name for name in args.modes if name not in MODES]
+    if unknown:
+        parser.error(f"unknown modes: {', '.join(unknown)}")
+    all_cases = cases(args.n, args.seed)
+    failed = False
+    for name in args.modes or MODES:
+        found = mismatches(name, all_cases)
+        print(f'{name:<24} {len(all_cases) - len(found)} of {len(all_cases)} runs the same')
+        for directory, difference in found[:5]:
+            print(f'  {directory}: {difference}')
+        failed = failed or bool(found)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,98 @@
+# a thin client for the daemon started by python Tier.py daemon (see DAEMON in Tier.py), which runs a program there
+# and writes out its output as it arrives. only uses the standard library, so that it starts far quicker than Tier.py
+# e.g.
+#   python tier_client.py -d demos/isPrime                       lines of stdin are sent as the program reads them
+#   python tier_client.py -d demos/isPrime -ts "'5'" --input lines.txt
+# exits with 1 if the run was stopped or failed, printing why to stderr, the same as Tier.py
+import argparse
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+
+DAEMON_SOCKET = os.path.expanduser('~/.tier.sock')  # the same default as Tier.py daemon
+DAEMON_FRAME = struct.Struct('<cI')
+
+
+def send_input(sock, fd):
+    # send everything read from a file descriptor as input, then tell the daemon there is no more. unbuffered, so
+    # that the process can still exit while this is waiting for input the program never read
+    try:
+        for data in iter(lambda: os.read(fd, 65536), b''):
+            sock.sendall(data)
+        sock.shutdown(socket.SHUT_WR)
+    except OSError:
+        pass  # the run has already ended
+
+
+def request(directory, ts=None, stdin=None, max_steps=None, timeout=None, path=DAEMON_SOCKET, out=None) -> dict:
+    # run a program in the daemon, returning its result ({"status": ..., "error": ..., "steps": ...}). stdin is a
+    # list of lines, or a file descriptor to send the input from as it is read (none if None). output is passed to
+    # out as it arrives, or kept in the result as "output" if out is None. ts is read the same as the -ts flag
+    message = {'directory': os.path.abspath(directory)}
+    for key, value in (('ts', ts), ('max_steps', max_steps), ('timeout', timeout)):
+        if value is not None:
+            message[key] = value
+    if stdin is None or isinstance(stdin, list):
+        message['stdin'] = stdin or []
+    parts = []
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+        if 'stdin' not in message:
+            threading.Thread(target=send_input, args=(sock, stdin), daemon=True).start()
+        frames = sock.makefile('rb')
+        while True:
+            header = frames.read(DAEMON_FRAME.size)
+            if len(header) < DAEMON_FRAME.size:
+                raise ConnectionError('the daemon closed the connection before the run ended')
+            kind, length = DAEMON_FRAME.unpack(header)
+            text = frames.read(length).decode('utf-8', 'surrogatepass')
+            if kind == b'e':
+                result = json.loads(text)
+                break
+            if out is None:
+                parts.append(text)
+            else:
+                out(text)
+    if out is None:
+        result['output'] = ''.join(parts)
+    return result
+
+
+def write_out(text):
+    sys.stdout.write(text)
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--directory', required=False, type=str, action='store', default=os.curdir,
+                        help='directory containing .tier files for program. default to curdir')
+    parser.add_argument('-ts', '--set_ts', required=False, type=str, action='store', default=None,
+                        help="starting value of ts, e.g. \"'5'\" for a number. default 0")
+    parser.add_argument('--input', required=False, type=str, action='store', default=None,
+                        help='file to read input from, one line per }, instead of stdin')
+    parser.add_argument('--max_steps', required=False, type=int, action='store', default=None,
+                        help='stop the program once it has run this many steps')
+    parser.add_argument('--timeout', required=False, type=float, action='store', default=None,
+                        help='stop the program once it has run for this many seconds')
+    parser.add_argument('--socket', required=False, type=str, action='store', default=DAEMON_SOCKET,
+                        help=f'socket the daemon is listening on. default {DAEMON_SOCKET}')
+    args = parser.parse_args()
+
+    if args.input is not None:
+        with open(args.input, 'r') as input_file:
+            stdin = input_file.read().splitlines()
+    else:
+        stdin = sys.stdin.fileno()
+    try:
+        res = request(args.directory, args.set_ts, stdin, args.max_steps, args.timeout, args.socket, write_out)
+    except OSError as e:
+        print(f'\nno answer from the daemon on {args.socket}: {e}', file=sys.stderr)
+        sys.exit(1)
+    if res['status'] != 'ok':
+        print(f"\n{res['error']}", file=sys.stderr)
+        sys.exit(1)